@@ -0,0 +1,209 @@
+import asyncio
+from typing import List
+
+from core.aiofetch import AsyncTileFetcher
+from core.constants import DEFAULT_FPS
+from core.fetch import TileFetchError
+from core.models import MapConfig, Tile, TileKey, Layer
+from core.tilestore import TileStore
+from core.tileservice import TileService
+from tilemap import TileMap
+
+
+class AsyncTileMap(TileMap):
+    def __init__(self, mapconfig: MapConfig, debug_tileraster: bool = False, layers: List[Layer] = None, tilestore: TileStore = None, fetcher: AsyncTileFetcher = None, service: TileService = None) -> None:
+        """
+            A TileMap for apps which already run an asyncio event loop: the tiles are fetched, decoded and composed
+            by coroutines in that loop instead of threads, the number of open connections is bounded by the fetcher.
+            It has to be created inside a coroutine (the loop must be running), everything else works like TileMap:
+
+                async def main():
+                    m = AsyncTileMap(mapconfig)
+                    await drive_frames(lambda: frame(m))
+                    await m.aclose()
+
+            Like TileMap it uses the tile store of its service, so the images (and the memory budget) are shared with
+            the other maps.
+            Sources drawn with 'render_async' (core.vectortiles.VectorTileSource) still use their own workers.
+
+            :param fetcher [AsyncTileFetcher] -- The fetcher (AsyncTileFetcher() if None)
+        """
+        self.loop = asyncio.get_running_loop()
+        ## Running tasks (the loop only keeps weak references to them)
+        self.tasks: set = set()
+        ## (zoom, X, Y) -> task composing the tile, so a tile requested twice is only fetched once
+        self.loading: dict = {}
+
+        super().__init__(mapconfig, debug_tileraster, layers, tilestore, fetcher if fetcher is not None else AsyncTileFetcher(), service)
+
+
+    def spawn(self, coroutine) -> asyncio.Task:
+        """ Runs a coroutine in the loop and keeps a reference to it until it is done. """
+        task = self.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        return task
+
+
+    def request_tile_image(self, tile: Tile) -> None:
+        self.spawn(self.load_pending_tile(tile))
+
+
+    def request_recompose(self, tile: Tile) -> None:
+        self.spawn(self.recompose_tile(tile))
+
+
+    def request_grid_tile(self, lx: int, ly: int, zoom: int) -> None:
+        self.spawn(self.load_grid_tile(lx, ly, zoom))
+
+
+    def create_tile(self, posx, posy, key: TileKey = None, load: bool = True):
+        """
+            Same as TileMap.create_tile but never waits for the image: a tile which is not in the tile store is
+            returned without one and its image is loaded in the loop.
+        """
+        tile = super().create_tile(posx, posy, key, load = False)
+        if load and not tile.loaded:
+            self.request_tile_image(tile)
+
+        return tile
+
+
+    async def load_pending_tile(self, tile: Tile) -> None:
+        """ Coroutine version of 'load_pending_tile_thread', the loop runs the frames so the image is shown right away. """
+        self.set_tile_image(tile, await self.load_tile_image_async(tile.x, tile.y, tile.zoom))
+
+
+    async def load_grid_tile(self, lx: int, ly: int, zoom: int) -> None:
+        """ Coroutine version of 'load_tile_thread'. """
+        tile = super().create_tile(0, 0, TileKey(zoom, lx, ly), load = False)
+        if not tile.loaded:
+            await self.load_pending_tile(tile)
+
+        self.place_tile(tile, zoom)
+
+
+    async def recompose_tile(self, tile: Tile) -> None:
+        """ Coroutine version of 'recompose_tile_thread'. """
+        self.set_tile_image(tile, await self.compose_tile_image_async(tile.x, tile.y, tile.zoom))
+
+
+    async def load_tile_image_async(self, lx: int, ly: int, zoom: int):
+        """
+            Coroutine version of 'load_tile_image'.
+
+            :returns pygame.Surface
+        """
+        key = (zoom, lx, ly)
+
+        tile_image = self.tilestore.get(self.layers.composite_key(zoom, lx, ly))
+        if tile_image is not None:
+            return tile_image
+
+        task = self.loading.get(key)
+        if task is None:
+            task = self.loading[key] = self.loop.create_task(self.compose_tile_image_async(lx, ly, zoom))
+            task.add_done_callback(lambda task: self.loading.pop(key, None))
+
+        ## Shielded, another tile may be waiting for the same task
+        return await asyncio.shield(task)
+
+
+    async def compose_tile_image_async(self, lx: int, ly: int, zoom: int):
+        """
+            Coroutine version of 'compose_tile_image'.
+
+            :returns pygame.Surface
+        """
+        key = (zoom, lx, ly)
+
+        try:
+            tile_image = await self.layers.compose_async(zoom, lx, ly, self.fetcher.fetch_async)
+        except TileFetchError as e:
+            self.failed.add(key)
+            return e.partial if e.partial is not None else self.fallback_image(lx, ly, zoom)
+
+        self.failed.discard(key)
+        self.tilestore.put(self.layers.composite_key(zoom, lx, ly), tile_image)
+
+        return tile_image
+
+
+    def surrounding_tiles(self, margin: int = 1) -> set:
+        """
+            Returns the tiles in a ring of 'margin' tiles around the grid (the next ones shown when the map is dragged).
+
+            :returns set -- The tiles (zoom, X, Y)
+        """
+        anchor_row, anchor_col, anchor = self.grid_anchor()
+        if anchor is None:
+            return set()
+
+        rows, cols = self.narray.shape
+        x0, y0 = anchor.x - anchor_col, anchor.y - anchor_row
+        n = 2 ** anchor.zoom
+
+        return {
+            (anchor.zoom, x, y)
+            for y in range(max(0, y0 - margin), min(n, y0 + rows + margin))
+            for x in range(max(0, x0 - margin), min(n, x0 + cols + margin))
+            if not (y0 <= y < y0 + rows and x0 <= x < x0 + cols)
+        }
+
+
+    async def prefetch(self, keys) -> None:
+        """
+            Loads tiles into the tile store without showing them, e.g. 'surrounding_tiles()'.
+
+            :param keys -- The tiles (zoom, X, Y)
+        """
+        await asyncio.gather(*(
+            self.load_tile_image_async(x, y, zoom) for zoom, x, y in keys if self.layers.composite_key(zoom, x, y) not in self.tilestore
+        ))
+
+
+    def close(self) -> None:
+        """
+            Unsubscribes the map from its tile store like TileMap.close, cancels the tiles which are still loading and
+            closes the idle connections. The cancelled tasks end when the loop runs next, see 'aclose'.
+        """
+        for task in list(self.tasks) + list(self.loading.values()):
+            task.cancel()
+
+        super().close()
+        self.fetcher.close()
+
+
+    async def aclose(self) -> None:
+        """ Closes the map (see 'close') once the tiles which are still loading have been cancelled. """
+        tasks = list(self.tasks) + list(self.loading.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+
+        self.close()
+
+
+
+async def drive_frames(frame, fps: int = DEFAULT_FPS) -> None:
+    """
+        Runs the pygame frames from the event loop: 'frame' (handling the events, drawing the map and flipping the
+        display) is called up to 'fps' times per second and the loop runs the fetches in between, until it returns False.
+
+        :param frame -- Function or coroutine function drawing one frame
+        :param fps [int] -- The maximum number of frames per second
+    """
+    loop = asyncio.get_running_loop()
+    interval = 1 / fps
+
+    while True:
+        start = loop.time()
+
+        result = frame()
+        if asyncio.iscoroutine(result):
+            result = await result
+        if result is False:
+            break
+
+        await asyncio.sleep(max(0, interval - (loop.time() - start)))
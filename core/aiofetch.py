@@ -0,0 +1,223 @@
+import asyncio
+import socket
+import ssl
+import time
+from urllib.parse import urlsplit
+
+from core.constants import DEFAULT_ASYNC_MAX_CONNECTIONS, DEFAULT_ASYNC_HOST_CONNECTIONS
+from core.fetch import TileFetcher, TileFetchError, PERMANENT_STATUS
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status: int) -> None:
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+
+class AsyncTileFetcher(TileFetcher):
+    def __init__(self, max_connections: int = DEFAULT_ASYNC_MAX_CONNECTIONS,
+                 host_connections: int = DEFAULT_ASYNC_HOST_CONNECTIONS, **kwargs) -> None:
+        """
+            Fetches tiles with asyncio streams (HTTP/1.1 with keep-alive), so any number of concurrent requests runs
+            in the event loop without threads.
+            Timeouts, retries, the negative cache and the circuit breakers are the same as those of
+            'core.fetch.TileFetcher' (and shared with its blocking 'fetch', which still works).
+
+            :param max_connections [int] -- The number of requests running at the same time, the others wait
+            :param host_connections [int] -- The number of connections to one host
+            :param kwargs -- The parameters of 'core.fetch.TileFetcher'
+        """
+        super().__init__(**kwargs)
+        self.max_connections = max_connections
+        self.host_connections = host_connections
+
+        ## Created on first use, in the loop running the requests
+        self.connections: asyncio.Semaphore = None
+        self.hosts: dict = {}
+        ## (scheme, host, port) -> idle connections [(reader, writer), ...]
+        self.idle: dict = {}
+        ## (scheme, host, port) -> task resolving the host, asyncio resolves names in threads so it is only done once per host
+        self.addresses: dict = {}
+        self.ssl_context = None
+
+
+    def host_semaphore(self, origin) -> asyncio.Semaphore:
+        if self.connections is None:
+            self.connections = asyncio.Semaphore(self.max_connections)
+
+        semaphore = self.hosts.get(origin)
+        if semaphore is None:
+            semaphore = self.hosts[origin] = asyncio.Semaphore(self.host_connections)
+        return semaphore
+
+
+    async def fetch_async(self, url: str) -> bytes:
+        """
+            Returns the content of the url (coroutine version of 'fetch').
+
+            :param url [str] -- The url of the tile
+
+            :raises core.fetch.TileFetchError -- If the tile does not exist, the host is down or all attempts failed
+            :returns bytes
+        """
+        breaker = self.begin(url)
+        end = time.monotonic() + self.deadline
+        error = None
+        ## A permanent error is reported as a success (the host answered), see 'not_found'
+        reported = False
+
+        try:
+            for attempt in range(self.retries + 1):
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                try:
+                    data = await asyncio.wait_for(self.request(url), min(self.timeout, remaining))
+
+                except HTTPStatusError as e:
+                    if e.status in PERMANENT_STATUS:
+                        reported = True
+                        raise self.not_found(url, e.status, breaker) from e
+                    error = e
+
+                except Exception as e:
+                    ## Timeouts, resets, answers cut short, malformed answers, ...
+                    error = e
+
+                else:
+                    breaker.success()
+                    return data
+
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff_delay(attempt, end))
+
+        except BaseException:
+            ## Cancelled (e.g. by AsyncTileMap.close), which says nothing about the host: only the trial request (if it was one) ends
+            if not reported:
+                breaker.abandon()
+            raise
+
+        breaker.failure()
+        raise TileFetchError(f"{url} failed: {error!r}") from error
+
+
+    async def request(self, url: str) -> bytes:
+        """
+            Sends one GET request, reusing an idle connection to the host if there is one.
+
+            :raises HTTPStatusError -- If the answer is not 200
+            :returns bytes -- The body of the answer
+        """
+        parts = urlsplit(url)
+        secure = parts.scheme == "https"
+        origin = (parts.scheme, parts.hostname, parts.port or (443 if secure else 80))
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+
+        async with self.host_semaphore(origin), self.connections:
+            idle = self.idle.setdefault(origin, [])
+            reader = writer = None
+            while idle and reader is None:
+                reader, writer = idle.pop()
+                if reader.at_eof() or writer.is_closing():
+                    writer.close()
+                    reader = writer = None
+
+            if reader is None:
+                reader, writer = await self.connect(origin)
+
+            keep = False
+            try:
+                writer.write(
+                    f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nUser-Agent: Real-world-maps-in-pygame\r\n"
+                    f"Accept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n".encode("latin-1")
+                )
+                await writer.drain()
+                status, body, keep = await self.read_response(reader)
+            finally:
+                if keep:
+                    idle.append((reader, writer))
+                else:
+                    writer.close()
+
+        if status != 200:
+            raise HTTPStatusError(status)
+
+        return body
+
+
+    async def connect(self, origin):
+        """ Opens a connection to (scheme, host, port). """
+        scheme, host, port = origin
+
+        resolving = self.addresses.get(origin)
+        if resolving is None:
+            ## A task, the requests started before the name is resolved wait for the same one
+            resolving = self.addresses[origin] = asyncio.ensure_future(asyncio.get_running_loop().getaddrinfo(host, port, type = socket.SOCK_STREAM))
+
+        try:
+            address = (await resolving)[0][4][0]
+        except OSError:
+            self.addresses.pop(origin, None)
+            raise
+
+        if scheme != "https":
+            return await asyncio.open_connection(address, port)
+
+        if self.ssl_context is None:
+            self.ssl_context = ssl.create_default_context()
+        return await asyncio.open_connection(address, port, ssl = self.ssl_context, server_hostname = host)
+
+
+    async def read_response(self, reader: asyncio.StreamReader):
+        """
+            Reads an HTTP/1.1 answer (Content-Length, chunked or until the connection is closed).
+
+            :returns int, bytes, bool -- The status, the body and whether the connection can be used again
+        """
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the server")
+        version, status = status_line.split(b" ", 2)[:2]
+        status = int(status)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep = version == b"HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    ## Trailers, up to the empty line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+
+        else:
+            body = await reader.read()
+            keep = False
+
+        return status, body, keep
+
+
+    def close(self) -> None:
+        """ Closes the idle connections. """
+        for connections in self.idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self.idle.clear()
@@ -3,6 +3,46 @@
 DEFAULT_TILESIZE: int = 512
 DEFAULT_ZOOM: int = 10
 DEFAULT_BEARING: int = 0
+MAX_ZOOM: int = 22
 
 
-DEFAULT_MAP_TILESARRAY_SIZE: int = 400
\ No newline at end of file
+DEFAULT_MAP_TILESARRAY_SIZE: int = 400
+
+
+DEFAULT_TILE_STORE_BUDGET: int = 256 * 1024 * 1024
+DEFAULT_TILE_STORE_LOW_WATERMARK: float = 0.9
+DEFAULT_FETCH_WORKERS: int = 8
+## Threads decoding the images fetched by the event loop (pygame releases the GIL while decoding)
+DEFAULT_DECODE_WORKERS: int = 2
+DEFAULT_SCALED_CACHE_SIZE: int = 64
+DEFAULT_ZOOM_SETTLE_MS: int = 250
+DEFAULT_ZOOM_STEP: float = 1.1
+DEFAULT_ROTATION_MARGIN: int = 256
+DEFAULT_VECTOR_DATA_CACHE_SIZE: int = 2048
+DEFAULT_VECTOR_RASTER_CACHE_SIZE: int = 256
+DEFAULT_VECTOR_MAX_DATA_ZOOM: int = 14
+DEFAULT_SPATIAL_CELL_SEGMENTS: int = 16
+DEFAULT_SPATIAL_MAX_CELL_ZOOM: int = 24
+DEFAULT_SPATIAL_MAX_DEAD: float = 0.5
+DEFAULT_SPATIAL_MAX_CELLS: int = 256
+DEFAULT_HIT_TOLERANCE: int = 5
+DEFAULT_HEATMAP_BINS: int = 128
+DEFAULT_HEATMAP_SATURATION: float = 50
+DEFAULT_FETCH_TIMEOUT: float = 5
+DEFAULT_FETCH_DEADLINE: float = 10
+DEFAULT_FETCH_RETRIES: int = 2
+DEFAULT_FETCH_BACKOFF: float = 0.2
+DEFAULT_NEGATIVE_CACHE_TTL: float = 300
+DEFAULT_BREAKER_THRESHOLD: int = 5
+DEFAULT_BREAKER_COOLDOWN: float = 30
+DEFAULT_FAILED_RETRY_MS: int = 5000
+DEFAULT_FALLBACK_LEVELS: int = 4
+DEFAULT_ASYNC_MAX_CONNECTIONS: int = 128
+DEFAULT_ASYNC_HOST_CONNECTIONS: int = 32
+DEFAULT_FPS: int = 60
+DEFAULT_TRACK_CAPACITY: int = 1024
+DEFAULT_TRACK_TRIM_SLACK: float = 0.125
+DEFAULT_LABEL_CACHE_SIZE: int = 1024
+DEFAULT_LABEL_FONT_SIZE: int = 16
+DEFAULT_LABEL_PADDING: int = 2
+DEFAULT_ARCHIVE_CHUNK: int = 65536
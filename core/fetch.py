@@ -0,0 +1,235 @@
+import random
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from core.constants import (
+    DEFAULT_FETCH_TIMEOUT,
+    DEFAULT_FETCH_DEADLINE,
+    DEFAULT_FETCH_RETRIES,
+    DEFAULT_FETCH_BACKOFF,
+    DEFAULT_NEGATIVE_CACHE_TTL,
+    DEFAULT_BREAKER_THRESHOLD,
+    DEFAULT_BREAKER_COOLDOWN
+)
+
+
+## HTTP status codes which will not change by asking again (cached negatively)
+PERMANENT_STATUS = {400, 401, 403, 404, 410}
+
+
+class TileFetchError(Exception):
+    """
+        Raised when a tile could not be fetched.
+
+        :param permanent [bool] -- True if asking again will not help (e.g. 404)
+        :param partial -- For composed tiles, the image composed from the layers which could be fetched (or None)
+    """
+    def __init__(self, message: str, permanent: bool = False, partial = None) -> None:
+        super().__init__(message)
+        self.permanent = permanent
+        self.partial = partial
+
+
+
+class CircuitBreaker():
+    def __init__(self, threshold: int = DEFAULT_BREAKER_THRESHOLD, cooldown: float = DEFAULT_BREAKER_COOLDOWN) -> None:
+        """
+            Stops sending requests to a host which keeps failing.
+            After 'threshold' failures in a row the breaker opens and every request fails right away. After 'cooldown'
+            seconds one request is let through, if it succeeds the breaker closes again, else it stays open.
+
+            :param threshold [int] -- The number of failures in a row after which the breaker opens
+            :param cooldown [float] -- The time (seconds) before a request is tried again
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures: int = 0
+        self.opened_at: float = None
+        self.trial: bool = False
+        self.lock = threading.Lock()
+
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+
+    def allow(self) -> bool:
+        """ Returns True if a request may be sent. """
+        with self.lock:
+            if self.opened_at is None:
+                return True
+
+            if not self.trial and time.monotonic() - self.opened_at >= self.cooldown:
+                ## Half open, only this request is let through
+                self.trial = True
+                return True
+
+            return False
+
+
+    def success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+
+    def failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self.trial = False
+
+
+    def abandon(self) -> None:
+        """ Reports a request which was given up (e.g. cancelled): not a failure, but the trial (if it was one) is over. """
+        with self.lock:
+            self.trial = False
+
+
+
+class TileFetcher():
+    def __init__(self, timeout: float = DEFAULT_FETCH_TIMEOUT, deadline: float = DEFAULT_FETCH_DEADLINE,
+                 retries: int = DEFAULT_FETCH_RETRIES, backoff: float = DEFAULT_FETCH_BACKOFF,
+                 negative_ttl: float = DEFAULT_NEGATIVE_CACHE_TTL, breaker_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+                 breaker_cooldown: float = DEFAULT_BREAKER_COOLDOWN, opener = urlopen) -> None:
+        """
+            Fetches tiles without ever blocking for long:
+                - every request has a timeout and all attempts of a fetch together have a deadline
+                - failed requests are retried a few times, waiting a random (jittered) and growing time in between
+                - tiles which do not exist (404, ...) are not asked for again during 'negative_ttl' seconds
+                - a circuit breaker per host makes the fetches fail right away while the host is down
+
+            :param timeout [float] -- The timeout of one request (seconds)
+            :param deadline [float] -- The time after which no more attempts are made (seconds)
+            :param retries [int] -- The number of times a failed request is tried again
+            :param backoff [float] -- The base of the wait between attempts (seconds), doubled after each attempt
+            :param negative_ttl [float] -- How long (seconds) tiles which do not exist are remembered
+            :param breaker_threshold [int] -- The number of failed fetches in a row after which a host is not asked anymore
+            :param breaker_cooldown [float] -- How long (seconds) before a host is asked again
+            :param opener -- The function opening an url, urlopen(url, timeout = ...)
+        """
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.negative_ttl = negative_ttl
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.opener = opener
+
+        ## url -> time (time.monotonic) until which it is known not to exist
+        self.negative: dict = {}
+        self.breakers: dict = {}
+        self.lock = threading.Lock()
+
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        """ Returns the circuit breaker of the host of the url. """
+        host = urlsplit(url).netloc
+        with self.lock:
+            breaker = self.breakers.get(host)
+            if breaker is None:
+                breaker = self.breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return breaker
+
+
+    def available(self, url: str) -> bool:
+        """ Returns False if fetching the url would fail right away (negatively cached or host down). """
+        expires = self.negative.get(url)
+        if expires is not None and expires > time.monotonic():
+            return False
+
+        breaker = self.breaker(url)
+        return not breaker.is_open or time.monotonic() - breaker.opened_at >= breaker.cooldown
+
+
+    def begin(self, url: str) -> CircuitBreaker:
+        """
+            Checks that the url may be fetched, before the first attempt.
+
+            :raises TileFetchError -- If the url is negatively cached or its host is down
+            :returns CircuitBreaker -- The breaker of the host, to report the outcome to
+        """
+        expires = self.negative.get(url)
+        if expires is not None:
+            if expires > time.monotonic():
+                raise TileFetchError(f"{url} does not exist (cached)", permanent = True)
+            self.negative.pop(url, None)
+
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise TileFetchError(f"{urlsplit(url).netloc} is unavailable (circuit open)")
+
+        return breaker
+
+
+    def not_found(self, url: str, status: int, breaker: CircuitBreaker) -> TileFetchError:
+        """ Caches a permanent error negatively and returns the error to raise. """
+        ## The host answered, so it is healthy
+        breaker.success()
+        self.negative[url] = time.monotonic() + self.negative_ttl
+        return TileFetchError(f"{url} returned {status}", permanent = True)
+
+
+    def backoff_delay(self, attempt: int, end: float) -> float:
+        """ Full jitter: a random wait up to backoff * 2**attempt, without going over the deadline. """
+        wait = random.uniform(0, self.backoff * 2 ** attempt)
+        return max(0, min(wait, end - time.monotonic()))
+
+
+    def fetch(self, url: str) -> bytes:
+        """
+            Returns the content of the url.
+
+            :param url [str] -- The url of the tile
+
+            :raises TileFetchError -- If the tile does not exist, the host is down or all attempts failed
+            :returns bytes
+        """
+        breaker = self.begin(url)
+        end = time.monotonic() + self.deadline
+        error = None
+        ## A permanent error is reported as a success (the host answered), see 'not_found'
+        reported = False
+
+        try:
+            for attempt in range(self.retries + 1):
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                try:
+                    with self.opener(url, timeout = min(self.timeout, remaining)) as response:
+                        data = response.read()
+
+                except HTTPError as e:
+                    if e.code in PERMANENT_STATUS:
+                        reported = True
+                        raise self.not_found(url, e.code, breaker) from e
+                    error = e
+
+                except Exception as e:
+                    ## Anything else the opener or read() raise (timeouts, resets, http.client.IncompleteRead, ...)
+                    error = e
+
+                else:
+                    breaker.success()
+                    return data
+
+                if attempt < self.retries:
+                    time.sleep(self.backoff_delay(attempt, end))
+
+        except BaseException:
+            ## Interrupted (KeyboardInterrupt, ...), which says nothing about the host: only the trial request (if it was one) ends
+            if not reported:
+                breaker.abandon()
+            raise
+
+        breaker.failure()
+        raise TileFetchError(f"{url} failed: {error!r}") from error
@@ -0,0 +1,333 @@
+import asyncio
+import io
+import pygame
+from concurrent import futures
+from typing import List
+
+from core.constants import DEFAULT_FETCH_WORKERS, DEFAULT_DECODE_WORKERS
+from core.fetch import TileFetchError
+from core.models import Layer
+from core.tilestore import TileStore
+
+
+class LayerStack():
+    def __init__(self, layers: List[Layer], tilestore: TileStore, fetch, tilesize: int, token: str, service = None) -> None:
+        """
+            A stack of raster layers which are composed into one image per tile.
+            The images of every layer are kept in the tile store, so when one layer changes only that layer has to be
+            fetched again and the tile composed again from the stored images of the other layers.
+
+            :param layers [List[Layer]] -- The layers, the first one is at the bottom
+            :param tilestore [TileStore] -- The store keeping the images of the layers, keyed by (zoom, X, Y, store name)
+                                            (see 'store_name')
+            :param fetch -- The function used to fetch a tile from an url (returns a file like object)
+            :param tilesize [int] -- The size of the composed tiles
+            :param token [str] -- The access token used for the layers without one
+            :param service [core.tileservice.TileService] -- The service whose workers load the layers, an image
+                                                             loaded by another map at the same time is not loaded twice
+        """
+        self.layers: List[Layer] = []
+        ## layer name -> the name its images are stored under
+        self.store_names: dict = {}
+        ## layer name -> the tile packs read before fetching its images, see 'add_pack'
+        self.packs: dict = {}
+        self.service = service
+        self.fetch = fetch
+        self.tilesize = tilesize
+        self.token = token
+
+        self.tilestore = tilestore
+
+        ## Separate from the map's executor, the composition already runs in one of its threads
+        if service is not None:
+            self.executor = service.layer_executor
+            self.decoder = service.decode_executor
+            self.once = service.once
+        else:
+            self.executor = futures.ThreadPoolExecutor(DEFAULT_FETCH_WORKERS)
+            self.decoder = futures.ThreadPoolExecutor(DEFAULT_DECODE_WORKERS)
+            self.once = lambda key, function, *args: function(*args)
+
+        for layer in layers:
+            self.add(layer)
+
+
+    def add(self, layer: Layer) -> None:
+        """ Adds a layer on top of the others. """
+        if self.service is not None:
+            self.store_names.update(self.service.register_layers([layer], self.tilesize))
+        else:
+            self.store_names[layer.name] = layer.name
+        self.layers.append(layer)
+
+
+    def add_pack(self, name: str, pack) -> None:
+        """
+            Reads the images of a layer from a tile pack when they are not in the tile store, they are only fetched if
+            the pack does not hold them either.
+
+            :param name [str] -- The name of the layer
+            :param pack [core.tilepack.TilePack] -- The pack (of the layer's url or source and of this tile size)
+        """
+        self.get_layer(name)
+        self.packs.setdefault(name, []).append(pack)
+
+
+    def pack_image(self, layer: Layer, zoom: int, x: int, y: int):
+        """ Returns the image of one layer for the tile from the packs of the layer, None if none holds it. """
+        for pack in self.packs.get(layer.name, ()):
+            image = pack.get(zoom, x, y)
+            if image is not None:
+                return image
+
+        return None
+
+
+    def store_name(self, layer: Layer) -> str:
+        """
+            Returns the name the images of the layer are stored under, the same for all layers (of all maps of the
+            service) showing the same url or source at the same tile size (see TileService.register_layers).
+        """
+        return self.store_names[layer.name]
+
+
+    def image_key(self, layer: Layer, zoom: int, x: int, y: int) -> tuple:
+        """ Returns the key of the image of one layer in the tile store. """
+        return (zoom, x, y, self.store_name(layer))
+
+
+    def get_layer(self, name: str) -> Layer:
+        """ Returns the layer with the given name. """
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+
+        raise KeyError(f"No layer named '{name}'")
+
+
+    def layer_image(self, layer: Layer, zoom: int, x: int, y: int):
+        """
+            Returns the image of one layer for the tile, fetched if it is not in the tile store.
+
+            :returns pygame.Surface
+        """
+        key = self.image_key(layer, zoom, x, y)
+
+        image = self.tilestore.get(key)
+        if image is None:
+            image = self.once(key, self.store_layer_image, layer, zoom, x, y)
+
+        return image
+
+
+    def store_layer_image(self, layer: Layer, zoom: int, x: int, y: int):
+        """ Loads the image of one layer for the tile and puts it into the tile store. """
+        key = self.image_key(layer, zoom, x, y)
+
+        ## It may have been stored while waiting
+        image = self.tilestore.get(key)
+        if image is None:
+            image = self.load_layer_image(layer, zoom, x, y)
+            self.tilestore.put(key, image)
+
+        return image
+
+
+    def load_layer_image(self, layer: Layer, zoom: int, x: int, y: int):
+        """
+            Reads the image of one layer for the tile from its packs, or else fetches (or draws, if the layer has a
+            source) it.
+
+            :raises core.fetch.TileFetchError -- If the image could not be fetched
+            :returns pygame.Surface
+        """
+        image = self.pack_image(layer, zoom, x, y)
+        if image is not None:
+            return image
+
+        if layer.source is not None:
+            return self.fit(layer.source.render(zoom, x, y, self.tilesize))
+
+        url = layer.build_url(zoom, x, y, self.tilesize, self.token)
+        return self.decode(url, self.fetch(url))
+
+
+    def decode(self, url: str, data):
+        """
+            Decodes a fetched image.
+
+            :param url [str] -- The url of the image (for the error message)
+            :param data -- The image (file like object)
+
+            :raises core.fetch.TileFetchError -- If it is not an image
+            :returns pygame.Surface
+        """
+        try:
+            image = pygame.image.load(data)
+        except pygame.error as e:
+            raise TileFetchError(f"{url} is not an image: {e}") from e
+
+        return self.fit(image)
+
+
+    def fit(self, image):
+        """ Scales an image to the size of the tiles. """
+        if image.get_size() != (self.tilesize, self.tilesize):
+            image = pygame.transform.smoothscale(image, (self.tilesize, self.tilesize))
+
+        return image
+
+
+    def shown_layers(self, zoom: int) -> List[Layer]:
+        """ Returns the layers which are drawn at a zoom level. """
+        return [layer for layer in self.layers if layer.shown_at(zoom) and layer.opacity > 0]
+
+
+    def composite_key(self, zoom: int, x: int, y: int) -> tuple:
+        """
+            Returns the key of the composed tile in the tile store.
+            A tile showing a single layer is the image of that layer, the others are keyed by the layers they show, so
+            maps with other layers can use the same tile store.
+
+            :returns tuple -- (zoom, X, Y, store name) or (zoom, X, Y, ((store name, opacity), ...))
+        """
+        layers = self.shown_layers(zoom)
+        if len(layers) == 1 and layers[0].opacity == 1:
+            return self.image_key(layers[0], zoom, x, y)
+
+        return (zoom, x, y, tuple((self.store_name(layer), layer.opacity) for layer in layers))
+
+
+    def compose(self, zoom: int, x: int, y: int):
+        """
+            Returns the image of the tile with all layers shown at this zoom level composed.
+            The layers which are not cached are fetched in parallel.
+
+            :param zoom [int] -- The zoom level of the tile
+            :param x [int] -- The X value of the tile
+            :param y [int] -- The Y value of the tile
+
+            :raises core.fetch.TileFetchError -- If a layer could not be fetched, 'partial' is the tile composed without
+                                                 the missing layers (None if the bottom layer is missing)
+            :returns pygame.Surface
+        """
+        layers = self.shown_layers(zoom)
+
+        if len(layers) == 1 and layers[0].opacity == 1:
+            ## The tile is the image of the layer, stored under the same key (see 'composite_key')
+            return self.layer_image(layers[0], zoom, x, y)
+
+        fut = [self.executor.submit(self.layer_image, layer, zoom, x, y) for layer in layers]
+
+        images = []
+        for image in fut:
+            try:
+                images.append(image.result())
+            except TileFetchError as e:
+                images.append(e)
+
+        return self.blend(layers, images)
+
+
+    def blend(self, layers: List[Layer], images: list):
+        """
+            Draws the images of the layers on top of each other.
+
+            :param layers [List[Layer]] -- The layers, the first one is at the bottom
+            :param images [list] -- The image of each layer, or the TileFetchError raised while fetching it
+
+            :raises core.fetch.TileFetchError -- If an image is missing (see 'compose')
+            :returns pygame.Surface
+        """
+        composite = pygame.Surface((self.tilesize, self.tilesize), pygame.SRCALPHA)
+        errors = []
+        for layer, image in zip(layers, images):
+            if isinstance(image, TileFetchError):
+                errors.append((layer, image))
+                continue
+
+            if layer.opacity < 1:
+                image = image.copy()
+                image.set_alpha(round(layer.opacity * 255))
+
+            composite.blit(image, (0, 0))
+
+        if errors:
+            raise TileFetchError(
+                "; ".join(f"{layer.name}: {e}" for layer, e in errors),
+                permanent = all(e.permanent for layer, e in errors),
+                partial = None if errors[0][0] is layers[0] else composite
+            )
+
+        return composite
+
+
+    async def layer_image_async(self, layer: Layer, zoom: int, x: int, y: int, fetch):
+        """ Coroutine version of 'layer_image', 'fetch' is a coroutine function returning the bytes of an url. """
+        key = self.image_key(layer, zoom, x, y)
+
+        image = self.tilestore.get(key)
+        if image is None:
+            image = await self.load_layer_image_async(layer, zoom, x, y, fetch)
+            self.tilestore.put(key, image)
+
+        return image
+
+
+    async def load_layer_image_async(self, layer: Layer, zoom: int, x: int, y: int, fetch):
+        """
+            Coroutine version of 'load_layer_image'.
+            Sources with a 'render_async' method (see core.vectortiles.VectorTileSource) are awaited, the others are
+            drawn right away. The fetched images and the packs are decoded by the few threads of 'self.decoder': a
+            PNG takes milliseconds, decoding a burst of tiles in the loop would hold up the frames it runs. The pool is
+            small as decoding is CPU bound and the frames need the CPU too.
+        """
+        loop = asyncio.get_running_loop()
+
+        if self.packs.get(layer.name):
+            image = await loop.run_in_executor(self.decoder, self.pack_image, layer, zoom, x, y)
+            if image is not None:
+                return image
+
+        if layer.source is not None:
+            render_async = getattr(layer.source, "render_async", None)
+            if render_async is not None:
+                return self.fit(await asyncio.wrap_future(render_async(zoom, x, y, self.tilesize)))
+            return self.fit(layer.source.render(zoom, x, y, self.tilesize))
+
+        url = layer.build_url(zoom, x, y, self.tilesize, self.token)
+        data = await fetch(url)
+        return await loop.run_in_executor(self.decoder, self.decode, url, io.BytesIO(data))
+
+
+    async def compose_async(self, zoom: int, x: int, y: int, fetch):
+        """
+            Coroutine version of 'compose', the layers are fetched concurrently in the event loop.
+
+            :param fetch -- Coroutine function returning the bytes of an url (e.g. AsyncTileFetcher.fetch_async)
+        """
+        layers = self.shown_layers(zoom)
+
+        if len(layers) == 1 and layers[0].opacity == 1:
+            return await self.layer_image_async(layers[0], zoom, x, y, fetch)
+
+        images = await asyncio.gather(*(self.layer_image_async(layer, zoom, x, y, fetch) for layer in layers), return_exceptions = True)
+        for image in images:
+            if isinstance(image, BaseException) and not isinstance(image, TileFetchError):
+                raise image
+
+        return self.blend(layers, images)
+
+
+    def invalidate(self, name: str) -> None:
+        """
+            Drops the cached images of one layer (for example when the weather overlay has been updated).
+            The next 'compose' fetches that layer again and reuses the images of the other layers.
+
+            :param name [str] -- The name of the layer
+        """
+        store_name = self.store_name(self.get_layer(name))
+
+        for key in self.tilestore.keys():
+            if len(key) == 4 and key[3] == store_name:
+                self.tilestore.discard(key)
@@ -1,11 +1,12 @@
 from pydantic import BaseModel
-from typing import Any, List
+from typing import Any, List, NamedTuple
 
 from core.constants import (
     DEFAULT_TILESIZE,
     DEFAULT_ZOOM,
     DEFAULT_BEARING,
-    DEFAULT_MAP_TILESARRAY_SIZE
+    DEFAULT_MAP_TILESARRAY_SIZE,
+    MAX_ZOOM
 )
 
 
@@ -22,7 +23,7 @@ class MapConfig(BaseModel):
         :param token [str] -- The access token for the tile service
         :param coordinates [Coordinate] -- The starting coordinates (will be those on the top left corner of the window)
         :param zoom [int] -- The starting zoom level
-        (:param bearing [int] -- The bearing level) NOT USED
+        :param bearing [int] -- The bearing of the map, the direction (degrees clockwise from north) shown at the top of the window
         :param tilesize [int] -- The size of the tiles (w=h) all tiles are of equal size
         :param show_attribution [bool] -- Show the attribution (of the tile provider) on each tile
         :param show_logo [bool] -- Show the logo (of the tile provider) on each tile
@@ -31,8 +32,8 @@ class MapConfig(BaseModel):
         (:param array_x [int] -- The x position in the array which stores the tiles) NOT USED
         (:param array_y [int] -- The y position in the array which stores the tiles) NOT USED
         :param url [str] -- The url from which to get the tiles
-        :param tilesarray_size [int] -- The size of the array (the bigger = the more tiles are stored = less often new tiles have to be fetched)
-        (:param tilesarray [numpy.array] -- The array in which tiles are stored) NOT USED (array is tilemap.narray for now)
+        (:param tilesarray_size [int] -- The size of the array) NOT USED (tiles are stored in tilemap.tilestore, see core.tilestore.TileStore)
+        (:param tilesarray [numpy.array] -- The array in which tiles are stored) NOT USED (tiles are stored in tilemap.tilestore)
     """
     token: str
     coordinates: Coordinate
@@ -53,7 +54,64 @@ class MapConfig(BaseModel):
 
     def build_url(self) -> str:
         """Returns the url string, only built here as we don't know some values at the start of the program"""
-        return f"{self.url}/{self.tilesize}/{self.zoom}/{self.x}/{self.y}?access_token={self.token}"
+        return self.url_template().format(z = self.zoom, x = self.x, y = self.y)
+
+    def url_template(self) -> str:
+        """Returns the url of the tiles with {z}, {x} and {y} left to fill in (e.g. 'template.format(z = 3, x = 4, y = 2)')"""
+        url, token = self.url.replace("{", "{{").replace("}", "}}"), self.token.replace("{", "{{").replace("}", "}}")
+        return f"{url}/{self.tilesize}/{{z}}/{{x}}/{{y}}?access_token={token}"
+
+
+
+
+class Layer(BaseModel):
+    """
+        A raster tile source which is drawn on top of the map (weather, traffic, hillshade, ...).
+
+        :param name [str] -- The name of the layer (used to update it)
+        :param url [str] -- The url from which to get the tiles, either a template with {z}, {x}, {y} (and {token})
+                            or a tile service url like MapConfig.url
+        :param source -- Object drawing the tiles instead of fetching them from the url
+                         (e.g. core.vectortiles.VectorTileSource, has a render(zoom, x, y, tilesize) method)
+        :param token [str] -- The access token for the tile service (MapConfig.token if None)
+        :param opacity [float] -- The opacity of the layer (0 = invisible, 1 = opaque)
+        :param min_zoom [int] -- The lowest zoom level at which the layer is shown
+        :param max_zoom [int] -- The highest zoom level at which the layer is shown
+    """
+    name: str
+    url: str = None
+    source: Any = None
+    token: str = None
+    opacity: float = 1.0
+    min_zoom: int = 0
+    max_zoom: int = MAX_ZOOM
+
+    def build_url(self, zoom: int, x: int, y: int, tilesize: int, token: str) -> str:
+        """Returns the url of the tile (x, y) at the given zoom level"""
+        token = self.token or token
+        if "{z}" in self.url:
+            return self.url.format(z = zoom, x = x, y = y, token = token)
+
+        return f"{self.url}/{tilesize}/{zoom}/{x}/{y}?access_token={token}"
+
+    def shown_at(self, zoom: int) -> bool:
+        """Returns True if the layer is shown at the given zoom level"""
+        return self.min_zoom <= zoom <= self.max_zoom
+
+
+
+
+class TileKey(NamedTuple):
+    """
+        Identifies a tile, immutable and equal to the tuple (zoom, x, y) (it can be used as a tile store key).
+
+        :param zoom [int] -- The zoom level of the tile
+        :param x [int] -- The X value on the world map raster
+        :param y [int] -- The Y value on the world map raster
+    """
+    zoom: int
+    x: int
+    y: int
 
 
 
@@ -86,6 +144,7 @@ class Tile(BaseModel):
         :param rect -- A pygame.Rect()
         :param x [int] -- The X value on the world map raster
         :param y [int] -- The Y value on the world map raster
+        :param loaded [bool] -- False while the image of the tile is still being loaded (image is None)
     """
     coordinates: Coordinate
     position: Position
@@ -97,12 +156,18 @@ class Tile(BaseModel):
     rect: Any
     x: int
     y: int
+    loaded: bool = True
     #coord_topleft: ReferenceCoordinate
     #coord_topright: ReferenceCoordinate
     #coord_bottomleft: ReferenceCoordinate
     #coord_bottomright: ReferenceCoordinate
     #coord_center: ReferenceCoordinate
 
+    @property
+    def key(self) -> TileKey:
+        """The (zoom, x, y) of the tile"""
+        return TileKey(self.zoom, self.x, self.y)
+
     def move_by(self, x: int, y: int) -> None:
         """
             Adds the x, y values to the position of the tile.
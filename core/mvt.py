@@ -0,0 +1,245 @@
+import gzip
+import struct
+from typing import Dict, List
+
+
+## Decoder for Mapbox Vector Tiles (https://github.com/mapbox/vector-tile-spec/tree/master/2.1)
+## Only the few protobuf messages of the spec are needed, so they are decoded here instead of depending on protobuf.
+
+GEOM_UNKNOWN: int = 0
+GEOM_POINT: int = 1
+GEOM_LINESTRING: int = 2
+GEOM_POLYGON: int = 3
+
+CMD_MOVE_TO: int = 1
+CMD_LINE_TO: int = 2
+CMD_CLOSE_PATH: int = 7
+
+
+def _varint(data, pos: int):
+    """
+        Reads a protobuf varint.
+
+        :param data [memoryview] -- The message
+        :param pos [int] -- The position of the varint in the message
+
+        :returns int, int -- The value and the position after it
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _zigzag(n: int) -> int:
+    return (n >> 1) ^ -(n & 1)
+
+
+def _fields(data):
+    """
+        Yields the fields of a protobuf message as (field number, wire type, value).
+        The value is an int for varints and a memoryview for all other wire types.
+    """
+    pos, end = 0, len(data)
+    while pos < end:
+        key, pos = _varint(data, pos)
+        number, wire = key >> 3, key & 0x7
+
+        if wire == 0:
+            value, pos = _varint(data, pos)
+        elif wire == 1:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire == 2:
+            length, pos = _varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire == 5:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire}")
+
+        yield number, wire, value
+
+
+def _packed_varints(data) -> List[int]:
+    out = []
+    pos, end = 0, len(data)
+    while pos < end:
+        value, pos = _varint(data, pos)
+        out.append(value)
+    return out
+
+
+def _value(data):
+    """ Decodes a 'Tile.Value' message. """
+    for number, wire, value in _fields(data):
+        if number == 1:
+            return bytes(value).decode("utf-8")
+        elif number == 2:
+            return struct.unpack("<f", value)[0]
+        elif number == 3:
+            return struct.unpack("<d", value)[0]
+        elif number == 4:
+            return value - (1 << 64) if value >= (1 << 63) else value
+        elif number == 5:
+            return value
+        elif number == 6:
+            return _zigzag(value)
+        elif number == 7:
+            return bool(value)
+
+    return None
+
+
+def _ring_area(ring) -> float:
+    area = 0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        area += x1 * y2 - x2 * y1
+    return area / 2
+
+
+def decode_geometry(geom_type: int, commands: List[int]) -> list:
+    """
+        Decodes the geometry commands of a feature.
+
+        :param geom_type [int] -- The type of the geometry (GEOM_POINT, GEOM_LINESTRING, GEOM_POLYGON)
+        :param commands [List[int]] -- The (packed) geometry field of the feature
+
+        :returns list -- Points: [(x, y), ...]
+                         Lines: [[(x, y), ...], ...]
+                         Polygons: [[exterior ring, hole, ...], ...] (rings are lists of (x, y), not closed)
+    """
+    parts = []
+    current = []
+    x = y = 0
+    i, end = 0, len(commands)
+
+    while i < end:
+        command, count = commands[i] & 0x7, commands[i] >> 3
+        i += 1
+
+        if command == CMD_MOVE_TO:
+            for _ in range(count):
+                x += _zigzag(commands[i])
+                y += _zigzag(commands[i + 1])
+                i += 2
+                if geom_type == GEOM_POINT:
+                    current.append((x, y))
+                else:
+                    if current:
+                        parts.append(current)
+                    current = [(x, y)]
+
+        elif command == CMD_LINE_TO:
+            for _ in range(count):
+                x += _zigzag(commands[i])
+                y += _zigzag(commands[i + 1])
+                i += 2
+                current.append((x, y))
+
+        elif command == CMD_CLOSE_PATH:
+            if current:
+                parts.append(current)
+            current = []
+
+        else:
+            raise ValueError(f"Unknown geometry command {command}")
+
+    if current:
+        parts.append(current)
+
+    if geom_type == GEOM_POINT:
+        return parts[0] if parts else []
+
+    if geom_type != GEOM_POLYGON:
+        return parts
+
+    ## An exterior ring has a positive area, the rings with a negative area after it are its holes
+    polygons = []
+    for ring in parts:
+        area = _ring_area(ring)
+        if area > 0 or not polygons:
+            polygons.append([ring])
+        elif area < 0:
+            polygons[-1].append(ring)
+
+    return polygons
+
+
+def _feature(data, keys: List[str], values: list) -> dict:
+    feature = {"id": None, "type": GEOM_UNKNOWN, "properties": {}, "geometry": []}
+    tags = []
+    commands = []
+
+    for number, wire, value in _fields(data):
+        if number == 1:
+            feature["id"] = value
+        elif number == 2:
+            tags = _packed_varints(value)
+        elif number == 3:
+            feature["type"] = value
+        elif number == 4:
+            commands = _packed_varints(value)
+
+    for i in range(0, len(tags) - 1, 2):
+        feature["properties"][keys[tags[i]]] = values[tags[i + 1]]
+
+    feature["geometry"] = decode_geometry(feature["type"], commands)
+
+    return feature
+
+
+def _layer(data) -> dict:
+    name = None
+    extent = 4096
+    keys = []
+    values = []
+    features = []
+
+    for number, wire, value in _fields(data):
+        if number == 1:
+            name = bytes(value).decode("utf-8")
+        elif number == 2:
+            features.append(value)
+        elif number == 3:
+            keys.append(bytes(value).decode("utf-8"))
+        elif number == 4:
+            values.append(_value(value))
+        elif number == 5:
+            extent = value
+
+    ## The keys and values can come after the features, so they are decoded last
+    return {
+        "name": name,
+        "extent": extent,
+        "features": [_feature(feature, keys, values) for feature in features]
+    }
+
+
+def decode(data: bytes) -> Dict[str, dict]:
+    """
+        Decodes a Mapbox Vector Tile (gzip compressed or not).
+
+        :param data [bytes] -- The content of the .mvt/.pbf file
+
+        :returns Dict[str, dict] -- The layers by name:
+            {"name": str, "extent": int, "features": [{"id": int, "type": int, "properties": dict, "geometry": list}]}
+            (see 'decode_geometry' for the format of the geometry)
+    """
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+
+    layers = {}
+    for number, wire, value in _fields(memoryview(data)):
+        if number == 3:
+            layer = _layer(value)
+            layers[layer["name"]] = layer
+
+    return layers
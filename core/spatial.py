@@ -0,0 +1,393 @@
+import numpy
+from typing import List
+
+from core.constants import (
+    DEFAULT_SPATIAL_CELL_SEGMENTS,
+    DEFAULT_SPATIAL_MAX_CELL_ZOOM,
+    DEFAULT_SPATIAL_MAX_CELLS,
+    DEFAULT_SPATIAL_MAX_DEAD
+)
+from core.utility import px_from_latlng
+
+
+def world_xy(points) -> numpy.ndarray:
+    """
+        Returns the position of coordinates on the world map, normalised to 0..1 (web mercator, like the tiles).
+
+        :param points -- The coordinates [[lon, lat], ...] (list or numpy array)
+
+        :returns numpy.ndarray -- Shape (n, 2)
+    """
+    points = numpy.asarray(points, dtype = float).reshape(-1, 2)
+    x, y = px_from_latlng(points[:, 0], points[:, 1], 0, 1)
+
+    return numpy.column_stack((x, y))
+
+
+def segment_distances(segments: numpy.ndarray, x: float, y: float) -> numpy.ndarray:
+    """
+        Returns the distance of a point to every segment.
+
+        :param segments [numpy.ndarray] -- Shape (n, 4), the segments (x0, y0, x1, y1)
+        :param x [float] -- The x position of the point
+        :param y [float] -- The y position of the point
+
+        :returns numpy.ndarray -- Shape (n,)
+    """
+    ax, ay, bx, by = segments[:, 0], segments[:, 1], segments[:, 2], segments[:, 3]
+    dx, dy = bx - ax, by - ay
+    length = dx * dx + dy * dy
+
+    t = ((x - ax) * dx + (y - ay) * dy) / numpy.where(length > 0, length, 1)
+    t = numpy.clip(t, 0, 1)
+
+    return numpy.hypot(ax + t * dx - x, ay + t * dy - y)
+
+
+
+class SpatialIndex():
+    def __init__(self, features: list = None, cell_zoom: int = None) -> None:
+        """
+            Index of the segments of map features (e.g. features.line.Line with coordinates as points) on a uniform grid
+            over the world map, to find the feature under the cursor or the features in an area.
+            Features can be added and removed at any time. The segments of removed features are only marked until they
+            are more than DEFAULT_SPATIAL_MAX_DEAD of the index, then it is compacted; the grid is chosen again each time
+            the number of segments has doubled.
+
+            :param features [list] -- Features to load right away (see 'load')
+            :param cell_zoom [int] -- The grid has as many cells as there are tiles at this zoom level, chosen from the
+                                      extent and the density of the features if None (see 'choose_cell_zoom')
+        """
+        self.fixed_zoom: bool = cell_zoom is not None
+        self.cell_zoom: int = cell_zoom if cell_zoom is not None else 0
+        self.cells_per_axis: int = 2 ** self.cell_zoom
+        ## The number of segments when the grid was last chosen
+        self.chosen_count: int = 0
+
+        ## Segments (x0, y0, x1, y1) in world coordinates (0..1), the id of their feature and if it is still indexed
+        self.segments = numpy.empty((0, 4), dtype = float)
+        self.owners = numpy.empty(0, dtype = numpy.int64)
+        self.alive = numpy.empty(0, dtype = bool)
+        self.count: int = 0
+        ## The number of segments of removed features
+        self.dead: int = 0
+
+        ## Features by id (None once removed), the id of each feature and the range of its segments
+        self.features: list = []
+        self.ids: dict = {}
+        self.ranges: dict = {}
+
+        ## Cell (cx * cells_per_axis + cy) -> list of arrays of segment indices
+        self.cells: dict = {}
+        ## Segments covering too many cells, they are checked by every query
+        self.large: List[numpy.ndarray] = []
+
+        if features:
+            self.load(features)
+
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+    def __contains__(self, feature) -> bool:
+        return id(feature) in self.ids
+
+
+    def _reserve(self, n: int) -> None:
+        """ Grows the segment arrays (doubling) so n more segments fit. """
+        if self.count + n <= len(self.segments):
+            return
+
+        capacity = max(self.count + n, 2 * len(self.segments), 1024)
+        segments = numpy.empty((capacity, 4), dtype = float)
+        owners = numpy.empty(capacity, dtype = numpy.int64)
+        alive = numpy.zeros(capacity, dtype = bool)
+
+        segments[:self.count] = self.segments[:self.count]
+        owners[:self.count] = self.owners[:self.count]
+        alive[:self.count] = self.alive[:self.count]
+
+        self.segments, self.owners, self.alive = segments, owners, alive
+
+
+    def load(self, features: list) -> None:
+        """
+            Adds many features at once (the segments are put into the cells with numpy).
+            Features without points are not indexed.
+
+            :param features [list] -- Objects with a 'points' attribute [[lon, lat], ...]
+        """
+        points = []
+        owners = []
+
+        for feature in features:
+            if id(feature) in self.ids:
+                continue
+
+            feature_points = numpy.asarray(feature.points, dtype = float).reshape(-1, 2)
+            if len(feature_points) == 0:
+                continue
+            if len(feature_points) == 1:
+                feature_points = numpy.vstack((feature_points, feature_points))
+
+            fid = len(self.features)
+            self.features.append(feature)
+            self.ids[id(feature)] = fid
+
+            points.append(feature_points)
+            owners.append(numpy.full(len(feature_points), fid, dtype = numpy.int64))
+
+        if not points:
+            return
+
+        ## One segment between each point and the next one of the same feature
+        points = world_xy(numpy.concatenate(points))
+        owners = numpy.concatenate(owners)
+        same = owners[:-1] == owners[1:]
+        segments = numpy.hstack((points[:-1], points[1:]))[same]
+        owners = owners[:-1][same]
+        start = self.count
+
+        self._reserve(len(segments))
+        self.segments[start:start + len(segments)] = segments
+        self.owners[start:start + len(segments)] = owners
+        self.alive[start:start + len(segments)] = True
+        self.count += len(segments)
+
+        ## The segments of a feature are consecutive
+        bounds = numpy.flatnonzero(numpy.diff(owners)) + 1
+        firsts = numpy.concatenate(([0], bounds))
+        lasts = numpy.concatenate((bounds, [len(owners)]))
+        for fid, first, last in zip(owners[firsts].tolist(), firsts.tolist(), lasts.tolist()):
+            self.ranges[fid] = (start + first, start + last)
+
+        if not self.fixed_zoom and self.count >= 2 * self.chosen_count:
+            self._rebuild()
+        else:
+            self._assign(start, self.count)
+
+
+    def insert(self, feature) -> None:
+        """ Adds one feature. """
+        self.load([feature])
+
+
+    def remove(self, feature) -> None:
+        """ Removes a feature, its segments are only marked as removed until the index is compacted. """
+        fid = self.ids.pop(id(feature), None)
+        if fid is None:
+            return
+
+        first, last = self.ranges.pop(fid)
+        self.alive[first:last] = False
+        self.features[fid] = None
+        self.dead += last - first
+
+        if self.dead > DEFAULT_SPATIAL_MAX_DEAD * self.count:
+            self._rebuild()
+
+
+    def update(self, feature) -> None:
+        """ Indexes a feature again after its points have changed. """
+        self.remove(feature)
+        self.insert(feature)
+
+
+    def choose_cell_zoom(self) -> int:
+        """
+            Returns the zoom level of the grid for the indexed segments: where there are segments, a cell holds about
+            DEFAULT_SPATIAL_CELL_SEGMENTS of them, but the cells are not much smaller than the segments (which would be
+            put into many cells).
+        """
+        segments = self.segments[:self.count][self.alive[:self.count]]
+        if len(segments) == 0:
+            return self.cell_zoom
+
+        x = (segments[:, 0] + segments[:, 2]) / 2
+        y = (segments[:, 1] + segments[:, 3]) / 2
+
+        ## Cells down to half the typical segment
+        size = float(numpy.median(numpy.maximum(numpy.abs(segments[:, 2] - segments[:, 0]), numpy.abs(segments[:, 3] - segments[:, 1]))))
+        limit = DEFAULT_SPATIAL_MAX_CELL_ZOOM
+        if size > 0:
+            limit = int(numpy.clip(numpy.floor(1 - numpy.log2(size)), 0, limit))
+
+        ## As if the segments were spread evenly over their extent, then finer where they are denser
+        smallest = 2.0 ** -DEFAULT_SPATIAL_MAX_CELL_ZOOM
+        area = max(float(numpy.ptp(x)), smallest) * max(float(numpy.ptp(y)), smallest)
+        zoom = int(numpy.clip(numpy.log2(len(segments) / (DEFAULT_SPATIAL_CELL_SEGMENTS * area)) / 2, 0, limit))
+
+        while zoom < limit:
+            n = 2 ** zoom
+            cx = numpy.clip(numpy.floor(x * n), 0, n - 1).astype(numpy.int64)
+            cy = numpy.clip(numpy.floor(y * n), 0, n - 1).astype(numpy.int64)
+            occupied = len(numpy.unique(cx * n + cy))
+            step = round(numpy.log2(len(segments) / (occupied * DEFAULT_SPATIAL_CELL_SEGMENTS)) / 2)
+            if step <= 0:
+                break
+            zoom = min(zoom + step, limit)
+
+        return zoom
+
+
+    def _rebuild(self) -> None:
+        """ Drops the segments of removed features, chooses the grid again (unless it was given) and fills it. """
+        self._compact()
+        if not self.fixed_zoom:
+            self.cell_zoom = self.choose_cell_zoom()
+            self.cells_per_axis = 2 ** self.cell_zoom
+            self.chosen_count = self.count
+
+        self.cells = {}
+        self.large = []
+        self._assign(0, self.count)
+
+
+    def _compact(self) -> None:
+        """ Drops the segments of removed features and numbers the remaining features again. """
+        if self.dead == 0:
+            return
+
+        alive = self.alive[:self.count]
+        kept = numpy.flatnonzero(alive)
+        ## Where each remaining segment goes, the segments of a feature stay consecutive
+        positions = numpy.cumsum(alive) - 1
+
+        fids = sorted(self.ranges)
+        renumber = numpy.full(len(self.features), -1, dtype = numpy.int64)
+        renumber[fids] = numpy.arange(len(fids))
+
+        ranges = {}
+        for new, fid in enumerate(fids):
+            first, last = self.ranges[fid]
+            ranges[new] = (int(positions[first]), int(positions[first]) + last - first)
+            self.ids[id(self.features[fid])] = new
+        self.ranges = ranges
+
+        self.features = [self.features[fid] for fid in fids]
+        self.segments = self.segments[kept]
+        self.owners = renumber[self.owners[kept]]
+        self.alive = numpy.ones(len(kept), dtype = bool)
+        self.count = len(kept)
+        self.dead = 0
+
+
+    def _cell_ranges(self, x0, y0, x1, y1):
+        n = self.cells_per_axis
+        return (
+            numpy.clip(numpy.floor(x0 * n), 0, n - 1).astype(numpy.int64),
+            numpy.clip(numpy.floor(y0 * n), 0, n - 1).astype(numpy.int64),
+            numpy.clip(numpy.floor(x1 * n), 0, n - 1).astype(numpy.int64),
+            numpy.clip(numpy.floor(y1 * n), 0, n - 1).astype(numpy.int64)
+        )
+
+
+    def _assign(self, start: int, end: int) -> None:
+        """ Puts the segments start..end into the cells they cover. """
+        segments = self.segments[start:end]
+        n = self.cells_per_axis
+        cx0, cy0, cx1, cy1 = self._cell_ranges(
+            numpy.minimum(segments[:, 0], segments[:, 2]),
+            numpy.minimum(segments[:, 1], segments[:, 3]),
+            numpy.maximum(segments[:, 0], segments[:, 2]),
+            numpy.maximum(segments[:, 1], segments[:, 3])
+        )
+        indices = numpy.arange(start, end)
+
+        columns = cx1 - cx0 + 1
+        rows = cy1 - cy0 + 1
+        counts = columns * rows
+        large = counts > DEFAULT_SPATIAL_MAX_CELLS
+        if large.any():
+            self.large.append(indices[large])
+            small = ~large
+            cx0, cy0, rows, counts, indices = cx0[small], cy0[small], rows[small], counts[small], indices[small]
+
+        ## One entry per segment and cell it covers (most segments are in a single cell), grouped by cell with one sort
+        owner = numpy.repeat(numpy.arange(len(indices)), counts)
+        within = numpy.arange(len(owner)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        keys = (cx0[owner] + within // rows[owner]) * n + cy0[owner] + within % rows[owner]
+        if len(keys) == 0:
+            return
+
+        order = numpy.argsort(keys, kind = "stable")
+        keys, grouped = keys[order], indices[owner][order]
+        bounds = numpy.flatnonzero(numpy.diff(keys)) + 1
+        firsts = numpy.concatenate(([0], bounds)).tolist()
+        lasts = numpy.concatenate((bounds, [len(keys)])).tolist()
+
+        cells = self.cells
+        for key, first, last in zip(keys[firsts].tolist(), firsts, lasts):
+            cells.setdefault(key, []).append(grouped[first:last])
+
+
+    def _candidates(self, x0: float, y0: float, x1: float, y1: float) -> numpy.ndarray:
+        """ Returns the indices of the (not removed) segments in the cells overlapping the area. """
+        n = self.cells_per_axis
+        cx0, cy0, cx1, cy1 = (int(value) for value in self._cell_ranges(x0, y0, x1, y1))
+        found = list(self.large)
+
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            ## Big area (more cells than the ones which contain something), all the segments are candidates
+            return numpy.flatnonzero(self.alive[:self.count])
+
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                groups = self.cells.get(cx * n + cy)
+                if groups:
+                    found.extend(groups)
+
+        if not found:
+            return numpy.empty(0, dtype = numpy.int64)
+
+        candidates = numpy.concatenate(found)
+        return candidates[self.alive[candidates]]
+
+
+    def nearest(self, x: float, y: float, radius: float):
+        """
+            Returns the feature closest to a point.
+
+            :param x [float] -- The x position of the point in world coordinates (0..1)
+            :param y [float] -- The y position of the point in world coordinates (0..1)
+            :param radius [float] -- The maximum distance (world coordinates)
+
+            :returns feature, float -- The feature and its distance, (None, None) if no feature is close enough
+        """
+        candidates = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        if len(candidates) == 0:
+            return None, None
+
+        distances = segment_distances(self.segments[candidates], x, y)
+        best = int(numpy.argmin(distances))
+        if distances[best] > radius:
+            return None, None
+
+        return self.features[self.owners[candidates[best]]], float(distances[best])
+
+
+    def query_bbox(self, x0: float, y0: float, x1: float, y1: float) -> list:
+        """
+            Returns the features with at least one segment whose bounding box overlaps the area.
+
+            :param x0, y0, x1, y1 [float] -- The area in world coordinates (0..1), x0 <= x1 and y0 <= y1
+
+            :returns list
+        """
+        ## A segment in several cells is a candidate several times, the features are made unique below
+        candidates = self._candidates(x0, y0, x1, y1)
+        segments = self.segments[candidates]
+
+        overlap = (
+            (numpy.minimum(segments[:, 0], segments[:, 2]) <= x1) & (numpy.maximum(segments[:, 0], segments[:, 2]) >= x0) &
+            (numpy.minimum(segments[:, 1], segments[:, 3]) <= y1) & (numpy.maximum(segments[:, 1], segments[:, 3]) >= y0)
+        )
+
+        return [self.features[fid] for fid in numpy.unique(self.owners[candidates[overlap]]).tolist()]
+
+
+    def query_lonlat_bbox(self, min_longitude: float, min_latitude: float, max_longitude: float, max_latitude: float) -> list:
+        """ Same as 'query_bbox' with the area given as coordinates. """
+        (x0, y1), (x1, y0) = world_xy([[min_longitude, min_latitude], [max_longitude, max_latitude]])
+        return self.query_bbox(x0, y0, x1, y1)
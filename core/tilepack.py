@@ -0,0 +1,274 @@
+## Packs of tiles to copy the tiles of a region from one tile store into another (e.g. onto a laptop used offline).
+## A pack is an sqlite file holding the images of one layer; identical images (sea, desert, ...) are stored once.
+## It is either read on demand (TilePack, registered on a layer with LayerStack.add_pack) or imported at once into a
+## tile store (import_pack).
+##
+## Tables:
+##   meta  (name, value)          -- "version", "layer" (url or source and style, see 'layer_identity'), "tilesize"
+##   blobs (hash, data)           -- The PNG images, keyed by the sha1 of their pixels
+##   tiles (zoom, x, y, hash)     -- The image of every tile
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import weakref
+
+import pygame
+
+from core.models import Layer
+from core.tilestore import TileStore
+from core.utility import tile_xy_from_lonlat
+
+
+PACK_VERSION: str = "1"
+
+
+def layer_identity(layer: Layer) -> str:
+    """ Returns what the images of a layer are drawn from: its url, or the data and the style of its source. """
+    if layer.source is None:
+        return layer.url
+
+    source = layer.source
+    origin = getattr(source, "url", None) or getattr(source, "archive", None) or type(source).__name__
+    style = getattr(source, "style_hash", None)
+
+    return f"{origin}#{style}" if style else str(origin)
+
+
+def tile_range(zoom: int, bounds):
+    """
+        Returns the tiles of a zoom level covering a region.
+
+        :param bounds -- (west, south, east, north) in degrees, the whole world if None
+        :returns range, range -- The X and the Y values
+    """
+    n = 2 ** zoom
+    if bounds is None:
+        return range(n), range(n)
+
+    west, south, east, north = bounds
+    x0, y0 = tile_xy_from_lonlat(west, north, zoom)
+    x1, y1 = tile_xy_from_lonlat(east, south, zoom)
+
+    return range(max(0, x0), min(n, x1 + 1)), range(max(0, y0), min(n, y1 + 1))
+
+
+def _open(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, data BLOB);
+        CREATE TABLE IF NOT EXISTS tiles (zoom INTEGER, x INTEGER, y INTEGER, hash TEXT, PRIMARY KEY (zoom, x, y));
+    """)
+    return connection
+
+
+def _open_existing(path: str) -> sqlite3.Connection:
+    """ Opens a pack for reading, raises ValueError if there is none (sqlite would create an empty database). """
+    if not os.path.isfile(path):
+        raise ValueError(f"{path} is not a tile pack (no such file)")
+
+    return sqlite3.connect(path, check_same_thread = False)
+
+
+def _tile_filter(connection: sqlite3.Connection, zooms, bounds):
+    """
+        Returns the WHERE clause selecting the tiles of some zoom levels in a region, and its parameters.
+
+        :param zooms -- The zoom levels (all if None)
+        :param bounds -- (west, south, east, north) in degrees, the whole world if None
+        :returns str, list
+    """
+    if zooms is None:
+        if bounds is None:
+            return "1", []
+        zooms = [row[0] for row in connection.execute("SELECT DISTINCT zoom FROM tiles")]
+
+    if bounds is None:
+        zooms = list(zooms)
+        return f"zoom IN ({', '.join('?' * len(zooms))})" if zooms else "0", zooms
+
+    clauses, parameters = [], []
+    for zoom in zooms:
+        xs, ys = tile_range(zoom, bounds)
+        if xs and ys:
+            clauses.append("(zoom = ? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?)")
+            parameters += [zoom, xs[0], xs[-1], ys[0], ys[-1]]
+
+    return " OR ".join(clauses) or "0", parameters
+
+
+def _check(connection: sqlite3.Connection, path: str, layer: Layer, tilesize: int) -> bool:
+    """
+        Checks that a pack holds images of the layer.
+
+        :returns bool -- False if the pack is empty (it has no meta data yet)
+        :raises ValueError -- If it holds the images of another layer, tile size or version
+    """
+    meta = dict(connection.execute("SELECT name, value FROM meta"))
+    if not meta:
+        return False
+
+    if meta.get("version") != PACK_VERSION:
+        raise ValueError(f"{path} is a tile pack of an unknown version")
+    if (meta.get("layer"), meta.get("tilesize")) != (layer_identity(layer), str(tilesize)):
+        raise ValueError(f"{path} holds the tiles of {meta.get('layer')} ({meta.get('tilesize')} px), "
+                         f"not of the layer '{layer.name}' ({tilesize} px)")
+
+    return True
+
+
+def export_pack(path: str, tilestore: TileStore, layer: Layer, tilesize: int, zooms, bounds = None, store_name: str = None):
+    """
+        Writes the images of a layer which are in a tile store into a pack (added to it if it exists).
+        Only tiles already in the store are written, e.g. after browsing or prefetching the region.
+
+        :param path [str] -- The pack file
+        :param tilestore [TileStore] -- The store (keyed by (zoom, X, Y, store name), see core.layers.LayerStack)
+        :param layer [Layer] -- The layer
+        :param tilesize [int] -- The size of the tiles
+        :param zooms -- The zoom levels (e.g. range(8, 15))
+        :param bounds -- (west, south, east, north) in degrees, the whole world if None
+        :param store_name [str] -- The name the images of the layer are stored under (the layer's name if None)
+
+        :raises ValueError -- If the pack holds the images of another layer
+        :returns int, int -- The number of tiles and of distinct images written
+    """
+    store_name = layer.name if store_name is None else store_name
+    ranges = {zoom: tile_range(zoom, bounds) for zoom in zooms}
+    keys = [
+        key for key in tilestore.keys()
+        if len(key) == 4 and key[3] == store_name and key[0] in ranges and key[1] in ranges[key[0]][0] and key[2] in ranges[key[0]][1]
+    ]
+
+    connection = _open(path)
+    try:
+        with connection:
+            if not _check(connection, path, layer, tilesize):
+                connection.executemany("INSERT INTO meta VALUES (?, ?)", [
+                    ("version", PACK_VERSION), ("layer", layer_identity(layer)), ("tilesize", str(tilesize))
+                ])
+
+            known = {row[0] for row in connection.execute("SELECT hash FROM blobs")}
+            blobs, tiles = [], []
+
+            for key in keys:
+                image = tilestore.get(key)
+                if image is None:
+                    continue
+
+                digest = hashlib.sha1(pygame.image.tobytes(image, "RGBA")).hexdigest()
+                if digest not in known:
+                    known.add(digest)
+                    data = io.BytesIO()
+                    pygame.image.save(image, data, "tile.png")
+                    blobs.append((digest, data.getvalue()))
+                tiles.append((key[0], key[1], key[2], digest))
+
+            connection.executemany("INSERT INTO blobs VALUES (?, ?)", blobs)
+            connection.executemany("INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)", tiles)
+    finally:
+        connection.close()
+
+    return len(tiles), len(blobs)
+
+
+def import_pack(path: str, tilestore: TileStore, layer: Layer, tilesize: int, zooms = None, bounds = None, store_name: str = None) -> int:
+    """
+        Puts the images of a pack into a tile store, as if they had been fetched for the layer.
+        Only the tiles of the zoom levels and the region are read, each distinct image is decoded once and shared by
+        the tiles showing it (the store counts its memory once). Tiles beyond the budget of the store are evicted like
+        fetched ones, so import the region which is going to be used, or read the pack on demand (see TilePack).
+
+        :param path [str] -- The pack file
+        :param tilestore [TileStore] -- The store
+        :param layer [Layer] -- The layer the images are for
+        :param tilesize [int] -- The size of the tiles
+        :param zooms -- The zoom levels imported (all if None)
+        :param bounds -- (west, south, east, north) in degrees, the whole world if None
+        :param store_name [str] -- The name the images of the layer are stored under (the layer's name if None)
+
+        :raises ValueError -- If there is no pack at the path or it holds the images of another layer
+        :returns int -- The number of tiles imported
+    """
+    connection = _open_existing(path)
+    try:
+        if not _check(connection, path, layer, tilesize):
+            return 0
+
+        where, parameters = _tile_filter(connection, zooms, bounds)
+        tiles = connection.execute(f"SELECT zoom, x, y, hash FROM tiles WHERE {where}", parameters).fetchall()
+
+        ## Only the images of the selected tiles are read, each distinct one is decoded once
+        images: dict = {}
+        for zoom, x, y, digest in tiles:
+            image = images.get(digest)
+            if image is None:
+                data, = connection.execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+                image = images[digest] = pygame.image.load(io.BytesIO(data), "tile.png")
+            tilestore.put((zoom, x, y, layer.name if store_name is None else store_name), image)
+    finally:
+        connection.close()
+
+    return len(tiles)
+
+
+
+class TilePack():
+    def __init__(self, path: str, layer: Layer, tilesize: int) -> None:
+        """
+            A pack read on demand: the image of a tile is read and decoded when the tile store misses it, before it
+            would be fetched (see LayerStack.add_pack). Nothing is decoded ahead, so a pack larger than the budget of
+            the store is fine. The tiles showing the same image share it as long as one of them is stored.
+
+            :param path [str] -- The pack file
+            :param layer [Layer] -- The layer the images are for
+            :param tilesize [int] -- The size of the tiles
+
+            :raises ValueError -- If there is no pack at the path or it holds the images of another layer
+        """
+        self.path = path
+        self.connection = _open_existing(path)
+        try:
+            _check(self.connection, path, layer, tilesize)
+        except ValueError:
+            self.connection.close()
+            raise
+
+        ## The workers of the map read the pack at the same time, sqlite connections are not shared
+        self.lock = threading.Lock()
+        ## hash -> the decoded image, while a tile of the store still uses it
+        self.images = weakref.WeakValueDictionary()
+        self.closed: bool = False
+
+
+    def get(self, zoom: int, x: int, y: int):
+        """
+            Returns the image of a tile, None if it is not in the pack.
+
+            :returns pygame.Surface
+        """
+        with self.lock:
+            ## Workers may still ask after the map closed it
+            if self.closed:
+                return None
+            row = self.connection.execute("SELECT hash FROM tiles WHERE zoom = ? AND x = ? AND y = ?", (zoom, x, y)).fetchone()
+            if row is None:
+                return None
+            digest = row[0]
+            image = self.images.get(digest)
+            if image is not None:
+                return image
+            data, = self.connection.execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+
+        image = pygame.image.load(io.BytesIO(data), "tile.png")
+        with self.lock:
+            return self.images.setdefault(digest, image)
+
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+            self.connection.close()
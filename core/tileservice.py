@@ -0,0 +1,112 @@
+import threading
+from concurrent import futures
+
+from core.constants import DEFAULT_TILE_STORE_BUDGET, DEFAULT_FETCH_WORKERS, DEFAULT_DECODE_WORKERS
+from core.fetch import TileFetcher
+from core.tilestore import TileStore
+
+
+class TileService():
+    ## The process-wide service, see 'shared'
+    _shared = None
+    _shared_lock = threading.Lock()
+
+
+    def __init__(self, budget: int = DEFAULT_TILE_STORE_BUDGET, fetcher: TileFetcher = None, workers: int = DEFAULT_FETCH_WORKERS) -> None:
+        """
+            Tiles shared by several maps (e.g. a main map, a minimap and a split view): one tile store with one memory
+            budget, one fetcher and one queue of workers. Work on the same tile or url which is requested by several
+            maps at the same time is only done once (see 'once').
+            The maps subscribe to 'TileService.shared()' unless they are given another service.
+
+            The images of the layers are stored by what they show (url or source and tile size) and not by the name
+            of the layer, so layers of the same name can show other things in other maps (see 'register_layers').
+
+            :param budget [int] -- The memory (in bytes) the images of the tile store may use
+            :param fetcher [TileFetcher] -- The fetcher (TileFetcher() if None)
+            :param workers [int] -- The number of tiles (and of layer images) loaded at the same time
+        """
+        self.store = TileStore(budget)
+        self.fetcher = fetcher if fetcher is not None else TileFetcher()
+
+        ## Loading a tile waits for its layers, so they need separate workers
+        self.executor = futures.ThreadPoolExecutor(workers)
+        self.layer_executor = futures.ThreadPoolExecutor(workers)
+        ## The async maps decode their images here, not in the event loop (see LayerStack.load_layer_image_async)
+        self.decode_executor = futures.ThreadPoolExecutor(DEFAULT_DECODE_WORKERS)
+
+        ## key -> Future of the work running for it
+        self.inflight: dict = {}
+        ## (url or source, tile size) -> the name the images of the layer are stored under
+        self.layers: dict = {}
+        self.lock = threading.Lock()
+
+
+    @classmethod
+    def shared(cls) -> "TileService":
+        """ Returns the process-wide service (created on first use). """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+
+    def once(self, key, function, *args):
+        """
+            Calls function(*args), unless it is already running for the same key in another thread: then its result
+            is waited for and returned (or its exception raised) instead.
+
+            :param key -- Identifies the work, e.g. a url or a tile key
+        """
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = futures.Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            result = function(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self.lock:
+                del self.inflight[key]
+
+        return result
+
+
+    def fetch(self, url: str) -> bytes:
+        """ Fetches an url with the fetcher, an url already being fetched is not fetched twice. """
+        return self.once(url, self.fetcher.fetch, url)
+
+
+    def register_layers(self, layers: list, tilesize: int) -> dict:
+        """
+            Returns the names the images of layers are stored under in the tile store (the last value of their keys).
+            Layers showing the same (same url or source and tile size) get the same name whatever they are called, so
+            their images are shared. A layer whose name is already used for something else gets a new one, e.g. the
+            "base" layer of a satellite map next to a streets map is stored as "base#2".
+
+            :returns dict -- layer name -> store name
+        """
+        names = {}
+        with self.lock:
+            used = set(self.layers.values())
+            for layer in layers:
+                identity = (layer.url if layer.source is None else layer.source, tilesize)
+                name = self.layers.get(identity)
+                if name is None:
+                    name, n = layer.name, 2
+                    while name in used:
+                        name, n = f"{layer.name}#{n}", n + 1
+                    self.layers[identity] = name
+                    used.add(name)
+                names[layer.name] = name
+
+        return names
@@ -0,0 +1,174 @@
+import math
+import threading
+from typing import Callable, List
+
+from core.constants import DEFAULT_TILE_STORE_BUDGET, DEFAULT_TILE_STORE_LOW_WATERMARK
+
+
+## Tiles of another zoom level than the view count as this many tiles further away per zoom level
+ZOOM_LEVEL_DISTANCE: int = 4
+
+
+def surface_bytes(surface) -> int:
+    """ Returns the memory used by the pixels of a pygame surface. """
+    return surface.get_pitch() * surface.get_height()
+
+
+class TileStore():
+    def __init__(self, budget: int = DEFAULT_TILE_STORE_BUDGET) -> None:
+        """
+            Holds the images of the tiles of all zoom levels, keyed by (zoom, X, Y) (optionally followed by more
+            values, e.g. (zoom, X, Y, layer name) for the images of single layers).
+            Lookups are O(1). Once the images use more than 'budget' bytes, those furthest away from the views
+            are evicted (the tiles shown by a view or acquired by a map are never evicted). An image stored under
+            several keys (e.g. the sea of an imported tile pack) is counted once.
+
+            :param budget [int] -- The memory (in bytes) the images may use
+        """
+        self.budget = budget
+        self.images: dict = {}
+        self.sizes: dict = {}
+        self.size: int = 0
+        ## id(image) -> the number of keys the image is stored under, its memory is counted once
+        self.users: dict = {}
+        self.lock = threading.RLock()
+
+        ## Functions returning (zoom, center X, center Y, keys of the shown tiles) of a view, see 'add_view'
+        self.views: List[Callable] = []
+        ## (zoom, X, Y) -> the number of maps showing the tile, see 'acquire'
+        self.refs: dict = {}
+
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+
+    def __contains__(self, key) -> bool:
+        return key in self.images
+
+
+    def keys(self) -> list:
+        with self.lock:
+            return list(self.images)
+
+
+    def get(self, key, default = None):
+        return self.images.get(key, default)
+
+
+    def put(self, key, image) -> None:
+        """
+            Stores an image and evicts others if the budget is exceeded.
+
+            :param key [tuple] -- (zoom, X, Y, ...)
+            :param image [pygame.Surface] -- The image
+        """
+        with self.lock:
+            self._add(image)
+            if key in self.images:
+                self._remove(key)
+            self.images[key] = image
+            self.sizes[key] = surface_bytes(image)
+
+        if self.size > self.budget:
+            self.evict()
+
+
+    def discard(self, key) -> None:
+        """ Removes an image from the store (nothing happens if it is not stored). """
+        with self.lock:
+            if key in self.images:
+                self._remove(key)
+
+
+    def _add(self, image) -> None:
+        """ Counts one more key storing the image, and its memory if it is new to the store. """
+        users = self.users.get(id(image), 0)
+        if users == 0:
+            self.size += surface_bytes(image)
+        self.users[id(image)] = users + 1
+
+
+    def _remove(self, key) -> None:
+        """ Removes the image of a key, its memory is freed once no other key stores it. """
+        image = self.images.pop(key)
+        size = self.sizes.pop(key)
+        users = self.users[id(image)] - 1
+        if users:
+            self.users[id(image)] = users
+        else:
+            del self.users[id(image)]
+            self.size -= size
+
+
+    def add_view(self, view: Callable) -> None:
+        """
+            Registers a view whose tiles are kept, the eviction prefers the tiles far away from it.
+
+            :param view -- Function returning (zoom, center X, center Y, set of (zoom, X, Y) shown) or None,
+                           the center is in tiles of the zoom level (fractional)
+        """
+        self.views.append(view)
+
+
+    def remove_view(self, view: Callable) -> None:
+        if view in self.views:
+            self.views.remove(view)
+
+
+    def acquire(self, keys) -> None:
+        """
+            Keeps tiles resident until they are released as many times as they have been acquired (all images of
+            the tile are kept, whatever follows (zoom, X, Y) in their key).
+
+            :param keys -- The tiles (zoom, X, Y)
+        """
+        with self.lock:
+            for key in keys:
+                self.refs[key] = self.refs.get(key, 0) + 1
+
+
+    def release(self, keys) -> None:
+        """ Undoes 'acquire', the tiles can be evicted once no map holds them anymore. """
+        with self.lock:
+            for key in keys:
+                count = self.refs.get(key, 0) - 1
+                if count > 0:
+                    self.refs[key] = count
+                else:
+                    self.refs.pop(key, None)
+
+
+    def distance(self, key, views: list) -> float:
+        """ Returns the distance (in tiles) of a tile to the closest view. """
+        zoom, x, y = key[0], key[1], key[2]
+        best = math.inf
+
+        for view_zoom, center_x, center_y, shown in views:
+            factor = 2.0 ** (view_zoom - zoom)
+            d = math.hypot((x + 0.5) * factor - center_x, (y + 0.5) * factor - center_y)
+            best = min(best, d + abs(view_zoom - zoom) * ZOOM_LEVEL_DISTANCE)
+
+        return best
+
+
+    def evict(self) -> None:
+        """ Removes the images furthest away from the views until the store uses less than the low watermark. """
+        views = [view for view in (view() for view in list(self.views)) if view is not None]
+        shown = set()
+        for view in views:
+            shown |= view[3]
+
+        with self.lock:
+            if self.size <= self.budget:
+                return
+
+            candidates = [key for key in self.images if key[:3] not in shown and key[:3] not in self.refs]
+            if views:
+                candidates.sort(key = lambda key: self.distance(key, views), reverse = True)
+
+            target = self.budget * DEFAULT_TILE_STORE_LOW_WATERMARK
+            for key in candidates:
+                if self.size <= target:
+                    break
+                self._remove(key)
@@ -0,0 +1,165 @@
+## Recording of the input events driving a map, to replay real interactions (see tools/replay.py).
+##
+## File format (little endian):
+##   header: b"PGTRACE3", window width and height (uint16), the position on the world map (normalised to 0..1) shown at
+##           the top left corner of the window (float64, see TileMap.world_of_px), zoom (uint8), bearing (int16),
+##           tile size (uint16), scale (float64)
+##           -- b"PGTRACE2" files have the longitude and latitude of mapconfig.coordinates instead of the position and
+##              no scale, b"PGTRACE1" files have no tile size either
+##   then one record per event: time since the start (ms, uint32), kind (uint8), x, y, a, b (int16), value (int32)
+
+import struct
+import time
+from typing import NamedTuple
+
+import pygame
+
+from core.utility import tile_top_left_lon_lat_from_xy
+
+
+MAGIC = b"PGTRACE3"
+HEADER = struct.Struct("<8sHHddBhHd")
+## The header of the second version, with the coordinates the map started at and without the scale
+MAGIC_V2 = b"PGTRACE2"
+HEADER_V2 = struct.Struct("<8sHHddBhH")
+## The header of the first version, without the tile size
+MAGIC_V1 = b"PGTRACE1"
+HEADER_V1 = struct.Struct("<8sHHddBh")
+RECORD = struct.Struct("<IBhhhhi")
+
+## Kinds of records, FRAME marks the end of the events handled in one frame
+FRAME = 0
+QUIT = 1
+MOUSEBUTTONDOWN = 2
+MOUSEBUTTONUP = 3
+MOUSEMOTION = 4
+MOUSEWHEEL = 5
+VIDEORESIZE = 6
+KEYDOWN = 7
+
+
+class TraceEvent(NamedTuple):
+    time: float
+    kind: int
+    x: int
+    y: int
+    a: int
+    b: int
+    value: int
+
+
+class TraceHeader(NamedTuple):
+    size: tuple
+    ## Of the top left corner of the window (of mapconfig.coordinates for traces of the older versions)
+    longitude: float
+    latitude: float
+    zoom: int
+    bearing: int
+    ## None for traces recorded without it
+    tilesize: int = None
+    ## The position on the world map (normalised) shown at the top left corner of the window, None for traces of the
+    ## older versions
+    world: tuple = None
+    scale: float = 1.0
+
+
+def _clamp(value: int) -> int:
+    return max(-32768, min(32767, int(value)))
+
+
+
+class TraceRecorder():
+    def __init__(self, path: str, tilemap) -> None:
+        """
+            Writes the events of every frame to a trace file, together with the view of the map when the recording
+            started (what the window shows, the map may have been dragged and zoomed since it was created):
+
+                recorder = TraceRecorder("pan.trace", m)
+                while True:
+                    events = pygame.event.get()
+                    recorder.record(events)
+                    ...
+
+            :param path [str] -- The file to write
+            :param tilemap [TileMap] -- The map the events are for
+        """
+        config = tilemap.mapconfig
+        world = tilemap.world_of_px(0, 0)
+        if world is None:
+            ## No tile in the grid yet, the grid starts with the tile (mapconfig.x, mapconfig.y) in the corner
+            world = (config.x / 2 ** config.zoom, config.y / 2 ** config.zoom)
+
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, tilemap.w, tilemap.h, *world, config.zoom, config.bearing, config.tilesize, tilemap.scale))
+        self.start = time.perf_counter()
+
+
+    def write(self, kind: int, x: int = 0, y: int = 0, a: int = 0, b: int = 0, value: int = 0) -> None:
+        ms = round((time.perf_counter() - self.start) * 1000)
+        self.file.write(RECORD.pack(ms, kind, _clamp(x), _clamp(y), _clamp(a), _clamp(b), value))
+
+
+    def record(self, events: list) -> None:
+        """ Writes the events handled in one frame (other events are skipped) followed by the end of the frame. """
+        for event in events:
+            if event.type == pygame.QUIT:
+                self.write(QUIT)
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                self.write(MOUSEBUTTONDOWN, *event.pos, event.button)
+            elif event.type == pygame.MOUSEBUTTONUP:
+                self.write(MOUSEBUTTONUP, *event.pos, event.button)
+            elif event.type == pygame.MOUSEMOTION:
+                buttons = sum(pressed << i for i, pressed in enumerate(event.buttons))
+                self.write(MOUSEMOTION, *event.pos, *event.rel, buttons)
+            elif event.type == pygame.MOUSEWHEEL:
+                ## The replay has no mouse, the position is stored with the event
+                self.write(MOUSEWHEEL, *pygame.mouse.get_pos(), event.x, event.y)
+            elif event.type == pygame.VIDEORESIZE:
+                self.write(VIDEORESIZE, a = event.w, b = event.h)
+            elif event.type == pygame.KEYDOWN:
+                self.write(KEYDOWN, value = event.key)
+
+        self.write(FRAME)
+
+
+    def close(self) -> None:
+        self.file.close()
+
+
+
+def read_trace(path: str):
+    """
+        Reads a trace file.
+
+        :returns TraceHeader, list -- The header and the frames, each a list of TraceEvent ending with the FRAME event
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+
+    world, scale = None, 1.0
+    if data[:len(MAGIC)] == MAGIC:
+        _, w, h, world_x, world_y, zoom, bearing, tilesize, scale = HEADER.unpack_from(data)
+        header, world = HEADER, (world_x, world_y)
+        corner = tile_top_left_lon_lat_from_xy(world_x * 2 ** zoom, world_y * 2 ** zoom, zoom)
+        longitude, latitude = corner.longitude, corner.latitude
+    elif data[:len(MAGIC_V2)] == MAGIC_V2:
+        _, w, h, longitude, latitude, zoom, bearing, tilesize = HEADER_V2.unpack_from(data)
+        header = HEADER_V2
+    elif data[:len(MAGIC_V1)] == MAGIC_V1:
+        _, w, h, longitude, latitude, zoom, bearing = HEADER_V1.unpack_from(data)
+        header, tilesize = HEADER_V1, None
+    else:
+        raise ValueError(f"{path} is not a trace file")
+
+    frames, frame = [], []
+    count = (len(data) - header.size) // RECORD.size
+    for ms, kind, x, y, a, b, value in RECORD.iter_unpack(data[header.size:header.size + count * RECORD.size]):
+        frame.append(TraceEvent(ms / 1000, kind, x, y, a, b, value))
+        if kind == FRAME:
+            frames.append(frame)
+            frame = []
+
+    if frame:
+        frames.append(frame)
+
+    return TraceHeader((w, h), longitude, latitude, zoom, bearing, tilesize, world, scale), frames
@@ -0,0 +1,277 @@
+## Many tracks (e.g. days of fleet history) in one folder of float64 columns which are opened with numpy.memmap:
+## opening an archive reads nothing but its index, and only the pages of the tracks which are used are loaded.
+##
+## Folder layout:
+##   index.json      -- {"version": 1, "points": n, "names": [...]}
+##   coordinates.f8  -- [lon, lat] of every point (n, 2), the points of one track after the other
+##   times.f8        -- The time of every point (n,), seconds since the epoch, NaN if unknown
+##   offsets.i8      -- Where the tracks start (tracks + 1,), track i is offsets[i]..offsets[i + 1]
+
+import csv
+import datetime
+import json
+import os
+import xml.etree.ElementTree as ElementTree
+
+import numpy
+
+from core.constants import DEFAULT_ARCHIVE_CHUNK
+
+
+ARCHIVE_VERSION: int = 1
+
+
+def parse_time(value: str) -> float:
+    """ Returns the seconds since the epoch of a number or an ISO 8601 time (UTC if it has no time zone), NaN if empty. """
+    value = value.strip()
+    if not value:
+        return numpy.nan
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    time = datetime.datetime.fromisoformat(value)
+    if time.tzinfo is None:
+        time = time.replace(tzinfo = datetime.timezone.utc)
+    return time.timestamp()
+
+
+
+class TrackArchiveWriter():
+    def __init__(self, path: str, chunk: int = DEFAULT_ARCHIVE_CHUNK) -> None:
+        """
+            Writes a track archive point by point, without keeping more than 'chunk' points in memory:
+
+                with TrackArchiveWriter("fleet") as writer:
+                    writer.begin("truck 1")
+                    writer.add(6.13, 49.61, 1680000000)
+
+            The index is written last (by 'close'), an archive which was not closed can not be opened. If the block
+            raises, the partial archive is discarded (see 'abort').
+
+            :param path [str] -- The folder of the archive (created, an existing archive is replaced)
+            :param chunk [int] -- The number of points written at once
+        """
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        if os.path.exists(os.path.join(path, "index.json")):
+            os.remove(os.path.join(path, "index.json"))
+
+        self.coordinates = open(os.path.join(path, "coordinates.f8"), "wb")
+        self.times = open(os.path.join(path, "times.f8"), "wb")
+
+        self.chunk = numpy.empty((chunk, 3), dtype = "<f8")
+        self.buffered: int = 0
+        self.points: int = 0
+        self.names: list = []
+        self.offsets: list = []
+
+
+    def __enter__(self) -> "TrackArchiveWriter":
+        return self
+
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        if exception_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+    def begin(self, name: str) -> None:
+        """ Starts a new track, the points added from now on belong to it. """
+        self.names.append(name)
+        self.offsets.append(self.points + self.buffered)
+
+
+    def add(self, longitude: float, latitude: float, time: float = numpy.nan) -> None:
+        self.chunk[self.buffered] = (longitude, latitude, time)
+        self.buffered += 1
+        if self.buffered == len(self.chunk):
+            self.flush()
+
+
+    def flush(self) -> None:
+        chunk = self.chunk[:self.buffered]
+        self.coordinates.write(numpy.ascontiguousarray(chunk[:, :2]).tobytes())
+        self.times.write(numpy.ascontiguousarray(chunk[:, 2]).tobytes())
+        self.points += self.buffered
+        self.buffered = 0
+
+
+    def close(self) -> None:
+        if self.coordinates.closed:
+            return
+
+        self.flush()
+        self.coordinates.close()
+        self.times.close()
+        numpy.array(self.offsets + [self.points], dtype = "<i8").tofile(os.path.join(self.path, "offsets.i8"))
+
+        with open(os.path.join(self.path, "index.json"), "w") as file:
+            json.dump({"version": ARCHIVE_VERSION, "points": self.points, "names": self.names}, file)
+
+
+    def abort(self) -> None:
+        """ Closes the files and removes them without writing the index, what was written is not an archive. """
+        if self.coordinates.closed:
+            return
+
+        self.coordinates.close()
+        self.times.close()
+        for name in ("coordinates.f8", "times.f8", "offsets.i8"):
+            if os.path.exists(os.path.join(self.path, name)):
+                os.remove(os.path.join(self.path, name))
+
+
+
+class TrackArchive():
+    def __init__(self, path: str) -> None:
+        """
+            Opens a track archive (see 'import_gpx', 'import_csv' and TrackArchiveWriter), the columns are mapped and
+            not read:
+
+                archive = TrackArchive("fleet")
+                lines = [archive.line(i, tilemap = m) for i in range(len(archive))]
+
+            :param path [str] -- The folder of the archive
+            :raises ValueError -- If the folder is not a complete archive
+        """
+        self.path = path
+        try:
+            with open(os.path.join(path, "index.json")) as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            raise ValueError(f"{path} is not a track archive (or it was not closed)")
+
+        if index.get("version") != ARCHIVE_VERSION:
+            raise ValueError(f"{path} is a track archive of an unknown version")
+
+        self.names: list = index["names"]
+        points = index["points"]
+
+        ## numpy.memmap can not map empty files
+        if points:
+            self.coordinates = numpy.memmap(os.path.join(path, "coordinates.f8"), dtype = "<f8", mode = "r", shape = (points, 2))
+            self.times = numpy.memmap(os.path.join(path, "times.f8"), dtype = "<f8", mode = "r", shape = (points,))
+        else:
+            self.coordinates = numpy.empty((0, 2), dtype = "<f8")
+            self.times = numpy.empty(0, dtype = "<f8")
+        self.offsets = numpy.fromfile(os.path.join(path, "offsets.i8"), dtype = "<i8")
+
+        if len(self.offsets) != len(self.names) + 1:
+            raise ValueError(f"{path} is not a complete track archive")
+
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+    def points(self, index: int) -> numpy.ndarray:
+        """ Returns the coordinates [[lon, lat], ...] of a track (a view of the mapped column, not a copy). """
+        return self.coordinates[self.offsets[index]:self.offsets[index + 1]]
+
+
+    def point_times(self, index: int) -> numpy.ndarray:
+        """ Returns the times of the points of a track (a view of the mapped column, not a copy). """
+        return self.times[self.offsets[index]:self.offsets[index + 1]]
+
+
+    def line(self, index: int, **kwargs):
+        """
+            Returns a track as a features.line.Line whose points are a view of the mapped column.
+
+            :param kwargs -- Passed on to Line (color, width, visible, tilemap)
+        """
+        from features.line import Line
+
+        return Line(self.points(index), **kwargs)
+
+
+
+def _local(tag: str) -> str:
+    """ Returns a tag without its namespace ('{http://www.topografix.com/GPX/1/1}trkpt' -> 'trkpt'). """
+    return tag.rsplit("}", 1)[-1]
+
+
+def import_gpx(paths: list, archive: str, chunk: int = DEFAULT_ARCHIVE_CHUNK) -> TrackArchive:
+    """
+        Imports GPX files into a track archive, every track (<trk>) and route (<rte>) is a track of the archive.
+        The files are streamed, the points are never all in memory.
+
+        :param paths [list] -- The GPX files
+        :param archive [str] -- The folder of the archive (replaced if it exists)
+        :returns TrackArchive
+    """
+    with TrackArchiveWriter(archive, chunk) as writer:
+        for path in paths:
+            tracks = 0
+            ## The open elements: each parsed element is removed from its parent, a cleared one would stay attached and
+            ## the tree would grow with the file
+            parents = []
+            for event, element in ElementTree.iterparse(path, events = ("start", "end")):
+                tag = _local(element.tag)
+
+                if event == "start":
+                    parents.append(element)
+                    if tag in ("trk", "rte"):
+                        tracks += 1
+                        writer.begin(f"{os.path.basename(path)}:{tracks}")
+                    continue
+
+                parents.pop()
+                if tag in ("trkpt", "rtept"):
+                    time = numpy.nan
+                    for child in element:
+                        if _local(child.tag) == "time" and child.text:
+                            time = parse_time(child.text)
+                    writer.add(float(element.get("lon")), float(element.get("lat")), time)
+
+                ## The children of a point are read when it ends
+                if parents and _local(parents[-1].tag) not in ("trkpt", "rtept"):
+                    parents[-1].remove(element)
+
+    return TrackArchive(archive)
+
+
+def import_csv(paths: list, archive: str, longitude: str = "lon", latitude: str = "lat", time: str = "time",
+               track: str = None, delimiter: str = ",", chunk: int = DEFAULT_ARCHIVE_CHUNK) -> TrackArchive:
+    """
+        Imports CSV files with a header row into a track archive. The rows of a track have to be consecutive.
+
+        :param paths [list] -- The CSV files
+        :param archive [str] -- The folder of the archive (replaced if it exists)
+        :param longitude [str] -- The column of the longitudes
+        :param latitude [str] -- The column of the latitudes
+        :param time [str] -- The column of the times (seconds or ISO 8601), optional
+        :param track [str] -- The column naming the track of a row (e.g. a vehicle id), one track per file if None
+        :param delimiter [str] -- The delimiter of the columns
+        :returns TrackArchive
+        :raises ValueError -- If a file misses the longitude or latitude column
+    """
+    with TrackArchiveWriter(archive, chunk) as writer:
+        for path in paths:
+            with open(path, newline = "") as file:
+                reader = csv.reader(file, delimiter = delimiter)
+                header = next(reader, [])
+                if longitude not in header or latitude not in header:
+                    raise ValueError(f"{path} has no '{longitude}' or '{latitude}' column")
+
+                x, y = header.index(longitude), header.index(latitude)
+                t = header.index(time) if time in header else None
+                name = header.index(track) if track is not None and track in header else None
+
+                current = None
+                if name is None:
+                    writer.begin(os.path.basename(path))
+
+                for row in reader:
+                    if not row:
+                        continue
+                    if name is not None and row[name] != current:
+                        current = row[name]
+                        writer.begin(current)
+                    writer.add(float(row[x]), float(row[y]), numpy.nan if t is None else parse_time(row[t]))
+
+    return TrackArchive(archive)
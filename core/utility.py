@@ -126,11 +126,26 @@ def latlng_from_px(px: int, py: int, corner_coordinates: TileBox, tilesize: int)
 
 
 
-def px_from_latlng(lon: float, lat: float):
+def px_from_latlng(lon: float, lat: float, zoom: int, tilesize: int):
   """
-    Returns the position of a pixel on a tile from given longitude and latitude.
+    Returns the position of the pixel matching the longitude and latitude on the world map raster.
+    (The tile is X = x // tilesize, Y = y // tilesize and the position of the pixel on it x % tilesize, y % tilesize)
+    Works with floats or numpy arrays of longitudes and latitudes.
+
+    :param lon [float] -- The longitude of the point
+    :param lat [float] -- The latitude of the point
+    :param zoom [int] -- The zoom level of the world map raster
+    :param tilesize [int] -- The size of the tiles
+
+    :returns float, float
   """
-  ...
+  n = 2.0 ** zoom * tilesize
+  lat_rad = numpy.radians(lat)
+
+  x = (lon + 180.0) / 360.0 * n
+  y = (1.0 - numpy.arcsinh(numpy.tan(lat_rad)) / math.pi) / 2.0 * n
+
+  return x, y
 
 
 
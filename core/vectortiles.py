@@ -0,0 +1,263 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import pygame
+from collections import OrderedDict
+from concurrent import futures
+
+from core import mvt
+from core.fetch import TileFetcher
+from core.constants import (
+    DEFAULT_FETCH_WORKERS,
+    DEFAULT_VECTOR_DATA_CACHE_SIZE,
+    DEFAULT_VECTOR_RASTER_CACHE_SIZE,
+    DEFAULT_VECTOR_MAX_DATA_ZOOM
+)
+
+
+## A simple style for the Mapbox Streets v8 tileset.
+## The rules are drawn in order, each one draws the features of one source layer:
+##   "layer" [str] -- The name of the layer in the vector tile
+##   "fill" [str] -- The fill color of polygons
+##   "stroke" [str] -- The color of lines (and of the outline of polygons)
+##   "width" [int] -- The width of lines
+##   "radius" [int] -- The radius of points (points are not drawn without it)
+##   "filter" [dict] -- Only draw the features whose properties have these values
+##   "min_zoom", "max_zoom" [int] -- The zoom levels at which the rule is used
+DEFAULT_VECTOR_STYLE = {
+    "background": "#f2efe9",
+    "rules": [
+        {"layer": "landuse", "fill": "#d8e8c8"},
+        {"layer": "water", "fill": "#aad3df"},
+        {"layer": "waterway", "stroke": "#aad3df", "width": 2},
+        {"layer": "building", "fill": "#d9d0c9", "stroke": "#c4b6ab", "width": 1, "min_zoom": 14},
+        {"layer": "road", "stroke": "#ffffff", "width": 3},
+        {"layer": "admin", "stroke": "#9e9cab", "width": 1}
+    ]
+}
+
+
+def style_hash(style: dict) -> str:
+    """ Returns a short hash of a style, tiles rendered with the same style have the same hash. """
+    return hashlib.sha1(json.dumps(style, sort_keys = True).encode("utf-8")).hexdigest()[:16]
+
+
+def rasterise(layers: dict, style: dict, zoom: int, tilesize: int, scale: float = 1, offset = (0, 0)):
+    """
+        Draws the decoded layers of a vector tile on a pygame surface.
+
+        :param layers [dict] -- The layers returned by 'core.mvt.decode'
+        :param style [dict] -- The style (see DEFAULT_VECTOR_STYLE)
+        :param zoom [int] -- The zoom level of the tile which is drawn (for the min_zoom/max_zoom of the rules)
+        :param tilesize [int] -- The size of the surface
+        :param scale [float] -- Scale of the vector tile (> 1 when a tile of a lower zoom level is drawn bigger)
+        :param offset [tuple] -- Position of the surface on the scaled vector tile (in pixels)
+
+        :returns pygame.Surface
+    """
+    surface = pygame.Surface((tilesize, tilesize))
+    surface.fill(pygame.Color(style.get("background", "#000000")))
+    offset_x, offset_y = offset
+
+    for rule in style.get("rules", []):
+        if not rule.get("min_zoom", 0) <= zoom <= rule.get("max_zoom", zoom):
+            continue
+
+        layer = layers.get(rule["layer"])
+        if layer is None:
+            continue
+
+        factor = tilesize / layer["extent"] * scale
+        fill = pygame.Color(rule["fill"]) if "fill" in rule else None
+        stroke = pygame.Color(rule["stroke"]) if "stroke" in rule else None
+        width = rule.get("width", 1)
+        radius = rule.get("radius")
+        conditions = rule.get("filter", {})
+
+        def project(points):
+            return [(x * factor - offset_x, y * factor - offset_y) for x, y in points]
+
+        for feature in layer["features"]:
+            properties = feature["properties"]
+            if any(properties.get(key) != value for key, value in conditions.items()):
+                continue
+
+            if feature["type"] == mvt.GEOM_POLYGON:
+                for polygon in feature["geometry"]:
+                    exterior = project(polygon[0])
+                    if len(exterior) < 3:
+                        continue
+
+                    if fill is not None:
+                        if len(polygon) == 1:
+                            pygame.draw.polygon(surface, fill, exterior)
+                        else:
+                            _draw_polygon_with_holes(surface, fill, exterior, [project(hole) for hole in polygon[1:]])
+
+                    if stroke is not None:
+                        pygame.draw.lines(surface, stroke, True, exterior, width)
+
+            elif feature["type"] == mvt.GEOM_LINESTRING and stroke is not None:
+                for line in feature["geometry"]:
+                    if len(line) > 1:
+                        pygame.draw.lines(surface, stroke, False, project(line), width)
+
+            elif feature["type"] == mvt.GEOM_POINT and radius is not None:
+                for point in project(feature["geometry"]):
+                    pygame.draw.circle(surface, fill or stroke or pygame.Color("black"), point, radius)
+
+    return surface
+
+
+def _draw_polygon_with_holes(surface, color, exterior, holes) -> None:
+    """ Draws a polygon on a transparent surface, cuts the holes out of it and puts it on the tile. """
+    xs = [x for x, y in exterior]
+    ys = [y for x, y in exterior]
+    rect = pygame.Rect(int(min(xs)), int(min(ys)), int(max(xs) - min(xs)) + 2, int(max(ys) - min(ys)) + 2).clip(surface.get_rect())
+    if rect.width == 0 or rect.height == 0:
+        return
+
+    shape = pygame.Surface(rect.size, pygame.SRCALPHA)
+    pygame.draw.polygon(shape, color, [(x - rect.x, y - rect.y) for x, y in exterior])
+    for hole in holes:
+        if len(hole) > 2:
+            ## Drawing on a SRCALPHA surface replaces the pixels, so this makes them transparent again
+            pygame.draw.polygon(shape, (0, 0, 0, 0), [(x - rect.x, y - rect.y) for x, y in hole])
+
+    surface.blit(shape, rect)
+
+
+
+class VectorTileSource():
+    def __init__(self, url: str = None, archive: str = None, style: dict = None, token: str = None,
+                 max_data_zoom: int = DEFAULT_VECTOR_MAX_DATA_ZOOM, fetch = None) -> None:
+        """
+            Gets Mapbox Vector Tiles and draws them with a simple style, can be used as the source of a
+            'core.models.Layer' instead of an url.
+            The tiles are looked up in the cache, then in the archive and then fetched from the url.
+            The raw tiles are cached separately from the drawn ones, so changing the style does not fetch anything again.
+
+            :param url [str] -- Template of the url of the tiles with {z}, {x}, {y} (and {token}),
+                                e.g. "https://api.mapbox.com/v4/mapbox.mapbox-streets-v8/{z}/{x}/{y}.mvt?access_token={token}"
+            :param archive [str] -- Path to an MBTiles file (sqlite) containing the vector tiles
+            :param style [dict] -- The style (see DEFAULT_VECTOR_STYLE)
+            :param token [str] -- The access token, used in the url
+            :param max_data_zoom [int] -- The highest zoom level for which the source has tiles, higher zoom levels
+                                          are drawn from the tiles of this level
+            :param fetch -- Function returning the bytes of an url (core.fetch.TileFetcher().fetch if None)
+        """
+        self.url = url
+        self.archive = archive
+        self.token = token
+        self.max_data_zoom = max_data_zoom
+        self.fetch = fetch or TileFetcher().fetch
+        self.set_style(style or DEFAULT_VECTOR_STYLE)
+
+        ## Raw tiles keyed by (zoom, X, Y) and drawn tiles keyed by (zoom, X, Y, tilesize, style hash)
+        self.data: OrderedDict = OrderedDict()
+        self.data_size: int = DEFAULT_VECTOR_DATA_CACHE_SIZE
+        self.rasters: OrderedDict = OrderedDict()
+        self.rasters_size: int = DEFAULT_VECTOR_RASTER_CACHE_SIZE
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        self.executor = futures.ThreadPoolExecutor(DEFAULT_FETCH_WORKERS)
+
+
+    def set_style(self, style: dict) -> None:
+        """
+            Changes the style, the tiles already drawn with another style stay in the cache.
+
+            :param style [dict] -- The new style (see DEFAULT_VECTOR_STYLE)
+        """
+        self.style = style
+        self.style_hash = style_hash(style)
+
+
+    def tile_data(self, zoom: int, x: int, y: int) -> bytes:
+        """
+            Returns the raw vector tile, from the cache, the archive or the url.
+
+            :returns bytes -- None if the tile does not exist
+        """
+        key = (zoom, x, y)
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                return self.data[key]
+
+        data = None
+        if self.archive is not None:
+            data = self.archive_data(zoom, x, y)
+        if data is None and self.url is not None:
+            data = self.fetch(self.url.format(z = zoom, x = x, y = y, token = self.token))
+
+        with self.lock:
+            self.data[key] = data
+            while len(self.data) > self.data_size:
+                self.data.popitem(last = False)
+
+        return data
+
+
+    def archive_data(self, zoom: int, x: int, y: int) -> bytes:
+        """ Returns the tile from the MBTiles archive (rows are numbered from the bottom, TMS scheme). """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            ## sqlite connections can only be used in the thread which created them
+            connection = self.local.connection = sqlite3.connect(self.archive)
+
+        row = connection.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (zoom, x, (2 ** zoom - 1) - y)
+        ).fetchone()
+
+        return bytes(row[0]) if row is not None else None
+
+
+    def render(self, zoom: int, x: int, y: int, tilesize: int):
+        """
+            Returns the tile drawn with the current style, waits for 'render_async'.
+
+            :returns pygame.Surface
+        """
+        return self.render_async(zoom, x, y, tilesize).result()
+
+
+    def render_async(self, zoom: int, x: int, y: int, tilesize: int):
+        """
+            Draws the tile with the current style in the worker pool, or returns the cached one.
+
+            :returns concurrent.futures.Future -- Its result is a pygame.Surface
+        """
+        key = (zoom, x, y, tilesize, self.style_hash)
+        with self.lock:
+            if key in self.rasters:
+                self.rasters.move_to_end(key)
+                done = futures.Future()
+                done.set_result(self.rasters[key])
+                return done
+
+        return self.executor.submit(self._render, key, self.style)
+
+
+    def _render(self, key, style: dict):
+        zoom, x, y, tilesize, hash = key
+
+        ## Tiles above max_data_zoom are cut out of the tile of max_data_zoom containing them
+        data_zoom = min(zoom, self.max_data_zoom)
+        scale = 2 ** (zoom - data_zoom)
+        data_x, data_y = x // scale, y // scale
+        offset = ((x - data_x * scale) * tilesize, (y - data_y * scale) * tilesize)
+
+        data = self.tile_data(data_zoom, data_x, data_y)
+        layers = mvt.decode(data) if data else {}
+        surface = rasterise(layers, style, zoom, tilesize, scale, offset)
+
+        with self.lock:
+            self.rasters[key] = surface
+            while len(self.rasters) > self.rasters_size:
+                self.rasters.popitem(last = False)
+
+        return surface
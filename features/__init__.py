@@ -1,2 +1,4 @@
-
-from features.line import Line
\ No newline at end of file
+from features.line import Line
+from features.heatmap import Heatmap
+from features.track import Track
+from features.label import Labels, TextCache
@@ -0,0 +1,186 @@
+## A density heatmap of many points which is drawn as a map layer.
+
+import numpy
+import pygame
+import threading
+
+from core.constants import DEFAULT_HEATMAP_BINS, DEFAULT_HEATMAP_SATURATION
+from core.spatial import world_xy
+
+
+## Points are indexed by their Morton (Z-order) code at this zoom level, the points of any tile of a lower zoom level
+## then have consecutive codes (2 * 31 bits fit in an int64 and 2**31 cells are ~2cm at the equator)
+INDEX_ZOOM: int = 31
+
+## Color of the lowest density (0) to the highest (1) (RGBA)
+DEFAULT_HEATMAP_COLORS = [
+    (0.0, (0, 0, 255, 0)),
+    (0.2, (0, 0, 255, 110)),
+    (0.45, (0, 255, 255, 160)),
+    (0.65, (0, 255, 0, 190)),
+    (0.85, (255, 255, 0, 215)),
+    (1.0, (255, 0, 0, 235))
+]
+
+
+def _spread(v):
+    """ Spreads the bits of an int64 array so there is a 0 between each of them (1011 -> 1000101). """
+    v = v & 0x7fffffff
+    v = (v | (v << 16)) & 0x0000ffff0000ffff
+    v = (v | (v << 8)) & 0x00ff00ff00ff00ff
+    v = (v | (v << 4)) & 0x0f0f0f0f0f0f0f0f
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+
+def _compact(v):
+    """ Inverse of '_spread', keeps every other bit. """
+    v = v & 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0f0f0f0f0f0f0f0f
+    v = (v | (v >> 4)) & 0x00ff00ff00ff00ff
+    v = (v | (v >> 8)) & 0x0000ffff0000ffff
+    v = (v | (v >> 16)) & 0x00000000ffffffff
+    return v
+
+
+def morton(x, y):
+    """ Returns the Morton codes of cells (x, y) (int64 arrays). """
+    return (_spread(x) << 1) | _spread(y)
+
+
+
+class Heatmap():
+    def __init__(self, longitudes = None, latitudes = None, bins: int = DEFAULT_HEATMAP_BINS,
+                 saturation: float = DEFAULT_HEATMAP_SATURATION, colors: list = None) -> None:
+        """
+            A density heatmap of points (e.g. vehicle positions) which is drawn as the source of a map layer:
+
+                heatmap = Heatmap(longitudes, latitudes)
+                tilemap.add_layer(Layer(name = "heat", source = heatmap, opacity = 0.8))
+
+            Each tile is computed with one histogram of the points in it and then stored by the map like any other
+            layer, so panning only computes the tiles which become visible.
+            When points are added, only the tiles they fall in have to be computed again:
+
+                tilemap.update_tiles("heat", heatmap.append(longitudes, latitudes))
+
+            :param longitudes -- The longitudes of the points (numpy array)
+            :param latitudes -- The latitudes of the points (numpy array)
+            :param bins [int] -- The number of cells per row/column of a tile (power of 2, <= the tile size)
+            :param saturation [float] -- The number of points in a cell which is shown with the highest color
+            :param colors [list] -- The color map [(0..1, (r, g, b, a)), ...], see DEFAULT_HEATMAP_COLORS
+        """
+        self.bins = bins
+        self.bits = bins.bit_length() - 1
+        if 2 ** self.bits != bins:
+            raise ValueError("The number of bins has to be a power of 2")
+
+        self.saturation = saturation
+        self.set_colors(colors or DEFAULT_HEATMAP_COLORS)
+
+        ## Morton codes of all points, sorted
+        self.codes = numpy.empty(0, dtype = numpy.int64)
+        ## Tiles which have been computed, so 'append' knows which ones have to be computed again
+        self.rendered: set = set()
+        self.lock = threading.Lock()
+
+        ## Row and column of each cell of a tile, in the order of the Morton codes of the cells
+        cells = numpy.arange(bins * bins, dtype = numpy.int64)
+        self.cell_x = _compact(cells >> 1)
+        self.cell_y = _compact(cells)
+
+        if longitudes is not None:
+            self.append(longitudes, latitudes)
+
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+    def set_colors(self, colors: list) -> None:
+        """ Builds the lookup table from densities (0..255) to colors. """
+        stops = numpy.array([stop for stop, color in colors])
+        values = numpy.array([color for stop, color in colors], dtype = float)
+        levels = numpy.linspace(0, 1, 256)
+
+        self.colors = numpy.column_stack([numpy.interp(levels, stops, values[:, i]) for i in range(4)]).astype(numpy.uint8)
+
+
+    def append(self, longitudes, latitudes) -> set:
+        """
+            Adds points.
+
+            :param longitudes -- The longitudes of the points (numpy array)
+            :param latitudes -- The latitudes of the points (numpy array)
+
+            :returns set -- The tiles (zoom, X, Y) which have been computed before and now contain new points
+        """
+        points = world_xy(numpy.column_stack((numpy.ravel(longitudes), numpy.ravel(latitudes))))
+        cells = numpy.clip(numpy.floor(points * 2 ** INDEX_ZOOM), 0, 2 ** INDEX_ZOOM - 1).astype(numpy.int64)
+        codes = numpy.sort(morton(cells[:, 0], cells[:, 1]))
+
+        with self.lock:
+            ## Two sorted runs, the stable sort (timsort) merges them in linear time
+            self.codes = numpy.sort(numpy.concatenate((self.codes, codes)), kind = "stable")
+
+            dirty = set()
+            for zoom in {key[0] for key in self.rendered}:
+                tiles = numpy.unique(codes >> (2 * (INDEX_ZOOM - zoom)))
+                for x, y in zip(_compact(tiles >> 1).tolist(), _compact(tiles).tolist()):
+                    if (zoom, x, y) in self.rendered:
+                        dirty.add((zoom, x, y))
+
+            self.rendered -= dirty
+
+        return dirty
+
+
+    def counts(self, zoom: int, x: int, y: int) -> numpy.ndarray:
+        """
+            Returns the number of points in each cell of a tile.
+
+            :returns numpy.ndarray -- Shape (bins, bins), indexed [row, column]
+        """
+        shift = 2 * (INDEX_ZOOM - zoom)
+        first = int(morton(numpy.int64(x), numpy.int64(y))) << shift
+
+        with self.lock:
+            codes = self.codes
+        lo, hi = numpy.searchsorted(codes, [first, first + (1 << shift)])
+        local = codes[lo:hi] - first
+
+        ## The Morton code of the cell is the top bits of the code within the tile
+        cell_shift = 2 * (INDEX_ZOOM - zoom - self.bits)
+        if cell_shift >= 0:
+            cells = local >> cell_shift
+        else:
+            cells = local << -cell_shift
+
+        counts = numpy.bincount(cells, minlength = self.bins * self.bins)
+        grid = numpy.zeros((self.bins, self.bins), dtype = numpy.int64)
+        grid[self.cell_y, self.cell_x] = counts
+
+        return grid
+
+
+    def render(self, zoom: int, x: int, y: int, tilesize: int):
+        """
+            Draws the heatmap of a tile (used by core.layers.LayerStack).
+
+            :returns pygame.Surface
+        """
+        with self.lock:
+            self.rendered.add((zoom, x, y))
+
+        counts = self.counts(zoom, x, y)
+        levels = numpy.log1p(counts) / numpy.log1p(self.saturation)
+        rgba = self.colors[numpy.clip(levels * 255, 0, 255).astype(numpy.uint8)]
+
+        surface = pygame.Surface((self.bins, self.bins), pygame.SRCALPHA)
+        ## surfarray arrays are indexed [x, y]
+        pygame.surfarray.pixels3d(surface)[...] = rgba[:, :, :3].transpose(1, 0, 2)
+        pygame.surfarray.pixels_alpha(surface)[...] = rgba[:, :, 3].T
+
+        return pygame.transform.smoothscale(surface, (tilesize, tilesize))
@@ -0,0 +1,258 @@
+## Text labels on the map (markers, street names, coordinate readouts), the rendered text is cached so a label is
+## only rendered once and not every frame.
+
+import threading
+import numpy
+import pygame
+from collections import OrderedDict
+
+from core.constants import DEFAULT_LABEL_CACHE_SIZE, DEFAULT_LABEL_FONT_SIZE, DEFAULT_LABEL_PADDING
+from core.spatial import world_xy
+
+
+class TextCache():
+    ## The process-wide cache, see 'shared'
+    _shared = None
+    _shared_lock = threading.Lock()
+
+
+    def __init__(self, size: int = DEFAULT_LABEL_CACHE_SIZE) -> None:
+        """
+            Rendered text, keyed by (text, font, size, color), the least recently used surfaces are dropped once there
+            are more than 'size' of them.
+            Text which changes every frame (e.g. a coordinate readout) is drawn from cached glyphs instead, see
+            'draw_glyphs'.
+
+            :param size [int] -- The number of surfaces kept
+        """
+        self.size = size
+        self.surfaces: OrderedDict = OrderedDict()
+        ## (font, size) -> pygame.font.Font
+        self.fonts: dict = {}
+        ## (character, font, size, color) -> surface, the characters used are few so they are all kept
+        self.glyphs: dict = {}
+
+
+    @classmethod
+    def shared(cls) -> "TextCache":
+        """ Returns the process-wide cache (created on first use). """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+
+    def font(self, font: str = None, size: int = DEFAULT_LABEL_FONT_SIZE) -> pygame.font.Font:
+        """
+            :param font [str] -- The font file (pygame's default font if None)
+            :param size [int] -- The size of the font
+        """
+        key = (font, size)
+        loaded = self.fonts.get(key)
+        if loaded is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            loaded = self.fonts[key] = pygame.font.Font(font, size)
+
+        return loaded
+
+
+    def render(self, text: str, font: str = None, size: int = DEFAULT_LABEL_FONT_SIZE, color = "black") -> pygame.Surface:
+        """
+            Returns the text rendered (antialiased, transparent background), the surface is shared and must not be
+            drawn on.
+
+            :param color -- The color of the text (anything pygame.Color accepts)
+        """
+        key = (text, font, size, tuple(pygame.Color(color)))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+
+        surface = self.surfaces[key] = self.font(font, size).render(text, True, key[3])
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last = False)
+
+        return surface
+
+
+    def draw_glyphs(self, target: pygame.Surface, position, text: str, font: str = None, size: int = DEFAULT_LABEL_FONT_SIZE,
+                    color = "black") -> pygame.Rect:
+        """
+            Draws the text one cached character after the other (no kerning), for text which is rarely the same twice
+            and would only fill the cache of 'render', e.g. the coordinates under the mouse.
+
+            :param position -- The top left corner of the text on the target
+            :returns pygame.Rect -- The part of the target drawn on
+        """
+        color = tuple(pygame.Color(color))
+        x, y = position
+        sequence = []
+        for character in text:
+            key = (character, font, size, color)
+            glyph = self.glyphs.get(key)
+            if glyph is None:
+                glyph = self.glyphs[key] = self.font(font, size).render(character, True, color)
+            sequence.append((glyph, (x, y)))
+            x += glyph.get_width()
+
+        target.blits(sequence, doreturn = False)
+
+        return pygame.Rect(position[0], y, x - position[0], self.font(font, size).get_linesize())
+
+
+
+class Labels():
+    def __init__(self, tilemap, font: str = None, size: int = DEFAULT_LABEL_FONT_SIZE, color = "black",
+                 padding: int = DEFAULT_LABEL_PADDING, visible: bool = True, cache: TextCache = None) -> None:
+        """
+            Text labels centered on coordinates of the map:
+
+                labels = Labels(tilemap)
+                labels.add(6.13, 49.61, "Luxembourg", priority = 10)
+                ...
+                labels.draw()
+
+            Labels which would overlap are not drawn, the ones with the highest priority (then the ones added first)
+            are kept. Which labels are shown only depends on the zoom, the scale and the bearing of the map (dragging
+            it moves all of them alike), so it is worked out again when one of those changes or labels are added, and
+            not every frame. While the map is zooming the labels of the last level are kept until it settles.
+
+            :param tilemap [TileMap] -- The map the labels are drawn on
+            :param font [str] -- The font file (pygame's default font if None)
+            :param size [int] -- The size of the font
+            :param color -- The color of the labels added without one
+            :param padding [int] -- The space kept free around a label (pixels)
+            :param visible [bool] -- The visibility of the labels
+            :param cache [TextCache] -- The rendered text (TextCache.shared() if None)
+        """
+        self.tilemap = tilemap
+        self.font = font
+        self.size = size
+        self.color = color
+        self.padding = padding
+        self.visible = visible
+        self.cache: TextCache = cache if cache is not None else TextCache.shared()
+
+        self.texts: list = []
+        self.colors: list = []
+        self.priorities: list = []
+        self.coordinates: list = []
+        ## Positions of the labels on the world map (0..1), shape (n, 2), projected when they are drawn
+        self.world = numpy.empty((0, 2), dtype = float)
+
+        ## The labels shown (indices) and their surfaces, for the view 'shown_view' -> (zoom, scale, bearing, count)
+        self.shown = numpy.empty(0, dtype = int)
+        self.shown_surfaces: list = []
+        self.shown_view = None
+
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+    def add(self, longitude: float, latitude: float, text: str, color = None, priority: float = 0) -> int:
+        """
+            Adds a label.
+
+            :param color -- The color of the label (the color of the labels if None)
+            :param priority [float] -- Labels with a higher priority are kept when labels overlap
+            :returns int -- The index of the label
+        """
+        self.texts.append(text)
+        self.colors.append(self.color if color is None else color)
+        self.priorities.append(priority)
+        self.coordinates.append([longitude, latitude])
+
+        return len(self.texts) - 1
+
+
+    def clear(self) -> None:
+        self.texts, self.colors, self.priorities, self.coordinates = [], [], [], []
+        self.world = numpy.empty((0, 2), dtype = float)
+        self.invalidate()
+
+
+    def invalidate(self) -> None:
+        """ Works out the labels shown again on the next frame (e.g. after changing texts or colors). """
+        self.shown_view = None
+
+
+    def positions(self, indices: numpy.ndarray):
+        """
+            Returns the positions in the window of labels.
+
+            :returns numpy.ndarray, numpy.ndarray -- x and y, None if there is no tile in the grid yet
+        """
+        tilemap = self.tilemap
+        origin = tilemap.world_px_of_map_px(0, 0)
+        if origin is None:
+            return None
+
+        if len(self.world) != len(self.coordinates):
+            self.world = numpy.concatenate((self.world, world_xy(self.coordinates[len(self.world):])))
+
+        world = self.world[indices] * (2 ** tilemap.mapconfig.zoom * tilemap.mapconfig.tilesize)
+        return tilemap.px_of_map_px(world[:, 0] - origin[0], world[:, 1] - origin[1])
+
+
+    def cull(self, px: numpy.ndarray, py: numpy.ndarray) -> None:
+        """ Keeps the labels which do not overlap a label with a higher priority. """
+        order = sorted(range(len(self.texts)), key = lambda i: -self.priorities[i])
+        kept, rects, surfaces = [], [], []
+
+        for i in order:
+            surface = self.cache.render(self.texts[i], self.font, self.size, self.colors[i])
+            rect = surface.get_rect(center = (px[i], py[i])).inflate(2 * self.padding, 2 * self.padding)
+            if rect.collidelist(rects) == -1:
+                kept.append(i)
+                rects.append(rect)
+                surfaces.append(surface)
+
+        self.shown = numpy.array(kept, dtype = int)
+        self.shown_surfaces = surfaces
+
+
+    def draw(self) -> None:
+        if not self.visible or not self.texts:
+            return
+
+        tilemap = self.tilemap
+        view = (tilemap.mapconfig.zoom, tilemap.scale, tilemap.mapconfig.bearing % 360, len(self.texts))
+
+        if view != self.shown_view and not (tilemap.zooming and self.shown_view is not None):
+            positions = self.positions(numpy.arange(len(self.texts)))
+            if positions is None:
+                return
+            self.cull(*positions)
+            self.shown_view = view
+
+        positions = self.positions(self.shown)
+        if positions is None:
+            return
+
+        window = tilemap.window
+        bounds = window.get_rect()
+        sequence = []
+        for surface, x, y in zip(self.shown_surfaces, positions[0].tolist(), positions[1].tolist()):
+            rect = surface.get_rect(center = (x, y))
+            if bounds.colliderect(rect):
+                sequence.append((surface, rect))
+
+        window.blits(sequence, doreturn = False)
+
+
+    def to_geojson(self):
+        """ Returns a json object with the labels as geojson point features. """
+        return {
+            "type": "FeatureCollection",
+            "features": [
+                {
+                    "type": "Feature",
+                    "properties": {"name": text, "priority": priority},
+                    "geometry": {"coordinates": coordinates, "type": "Point"}
+                }
+                for text, priority, coordinates in zip(self.texts, self.priorities, self.coordinates)
+            ]
+        }
@@ -6,21 +6,25 @@
 
 ## A line feature which can be drawn on a map and saved as a geojson feature.
 
+import numpy
 import pygame
 from typing import List
 
 
 class Line():
-    def __init__(self, points: List[List[float]], color: str = "black", width: int = 2, visible: bool = True):
+    def __init__(self, points: List[List[float]], color: str = "black", width: int = 2, visible: bool = True, tilemap = None):
         """
             Draws a line on the map.
             The geojson representation can be called by the function 'to_geojson'.
 
-            :param points [List[list]] -- The points of the line [[P1x, P1y], [P2x, P2y]]
+            :param points [List[list]] -- The points of the line [[P1x, P1y], [P2x, P2y]] (or a numpy array of shape
+                                          (n, 2), e.g. a track of core.trackarchive.TrackArchive, which is not copied)
             :param color [str] -- The color of the line
             :param width [int] -- The width of the line as an integer
             
             :param visible [bool] -- The visibility of the line (False = invisible, True = visible)
+            :param tilemap [TileMap] -- If given, the points are coordinates [[lon, lat], ...] and the line is drawn
+                                        where they are on the map (following zoom and bearing), else they are positions in the window
 
             :return None
         """
@@ -31,6 +35,7 @@ class Line():
         self.width = width
         self.opacity: int = 1
         self.visible = visible
+        self.tilemap = tilemap
 
         self.feature_type = "LineString"
         self.window = pygame.display.get_surface()
@@ -38,7 +43,18 @@ class Line():
 
     def draw(self):
         if self.visible:
-            pygame.draw.lines(self.window, self.color, closed = False, points = self.points, width = self.width)
+            pygame.draw.lines(self.window, self.color, closed = False, points = self.window_points(), width = self.width)
+
+
+    def window_points(self):
+        """ Returns the points of the line as positions in the window. """
+        if self.tilemap is None:
+            return self.points.tolist() if isinstance(self.points, numpy.ndarray) else self.points
+
+        points = numpy.asarray(self.points, dtype = float)
+        px, py = self.tilemap.px_of_longitude_latitude(points[:, 0], points[:, 1])
+
+        return numpy.column_stack((px, py)).tolist()
             
 
     def to_geojson(self):
@@ -51,7 +67,7 @@ class Line():
                 "stroke-opacity": self.opacity
             },
             "geometry": {
-                "coordinates": self.points,
+                "coordinates": self.points.tolist() if isinstance(self.points, numpy.ndarray) else self.points,
                 "type": self.feature_type
             }
         }
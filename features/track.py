@@ -0,0 +1,266 @@
+## A live track (e.g. GPS fixes) which grows while it is shown, only the new segments are drawn each frame.
+
+import time
+import numpy
+import pygame
+
+from core.constants import DEFAULT_TRACK_CAPACITY, DEFAULT_TRACK_TRIM_SLACK
+from core.spatial import world_xy
+
+
+def draw_segments(surface, color, width: int, points: numpy.ndarray, area: pygame.Rect) -> None:
+    """
+        Draws a polyline, only the runs of segments overlapping the area.
+
+        :param points [numpy.ndarray] -- Shape (n, 2), the points in the coordinates of the surface
+        :param area [pygame.Rect] -- The part of the surface to draw (segments outside of it are skipped)
+    """
+    if len(points) < 2:
+        return
+
+    a, b = points[:-1], points[1:]
+    margin = width
+    keep = numpy.flatnonzero(
+        (numpy.minimum(a[:, 0], b[:, 0]) <= area.right + margin) & (numpy.maximum(a[:, 0], b[:, 0]) >= area.left - margin) &
+        (numpy.minimum(a[:, 1], b[:, 1]) <= area.bottom + margin) & (numpy.maximum(a[:, 1], b[:, 1]) >= area.top - margin)
+    )
+    if len(keep) == 0:
+        return
+
+    ## Consecutive segments are drawn as one polyline
+    breaks = numpy.flatnonzero(numpy.diff(keep) != 1) + 1
+    for first, last in zip(numpy.concatenate(([0], breaks)).tolist(), numpy.concatenate((breaks, [len(keep)])).tolist()):
+        run = points[keep[first]:keep[last - 1] + 2]
+        pygame.draw.lines(surface, color, False, run.tolist(), width)
+
+
+
+class Track():
+    def __init__(self, tilemap, color: str = "red", width: int = 2, visible: bool = True, max_age: float = None,
+                 capacity: int = DEFAULT_TRACK_CAPACITY) -> None:
+        """
+            A line on the map which is appended to, e.g. a GPS track with a new fix every second:
+
+                track = Track(tilemap, max_age = 3600)
+                track.append(longitude, latitude)
+                ...
+                track.draw()
+
+            The fixes are kept in numpy arrays which grow by doubling and their positions on the world map are
+            projected once per zoom level. The track is drawn on a transparent surface covering the window (and a
+            margin around it) which is kept between frames, each frame only draws the segments added since the last
+            one. The surface is drawn again when the zoom (level or scale) changes, when the map is dragged out of
+            it, or once enough old fixes have been trimmed (see 'trim').
+            While the map is zooming or rotated, the visible segments are drawn directly on the window instead.
+
+            :param tilemap [TileMap] -- The map the track is drawn on
+            :param color [str] -- The color of the line
+            :param width [int] -- The width of the line
+            :param visible [bool] -- The visibility of the line
+            :param max_age [float] -- If given, only the fixes of the last 'max_age' seconds are kept
+            :param capacity [int] -- The number of fixes the arrays have room for at first
+        """
+        self.tilemap = tilemap
+        self.color = pygame.Color(color)
+        self.width = width
+        self.visible = visible
+        self.max_age = max_age
+
+        ## The fixes start..end of the arrays: [lon, lat], time and position on the world map (0..1)
+        self.coordinates = numpy.empty((capacity, 2), dtype = float)
+        self.times = numpy.empty(capacity, dtype = float)
+        self.world = numpy.empty((capacity, 2), dtype = float)
+        self.start: int = 0
+        self.end: int = 0
+
+        ## Positions on the world map raster (pixels, scaled) of the fixes start..projected_end at projected_zoom
+        self.projected = numpy.empty((capacity, 2), dtype = float)
+        ## (zoom level, scale) of the map
+        self.projected_zoom = None
+        self.projected_end: int = 0
+
+        ## The persistent surface, the world raster position of its top left corner and the fixes drawn on it
+        self.overlay = None
+        self.overlay_origin = (0, 0)
+        self.drawn_start: int = 0
+        self.drawn_end: int = 0
+
+        self.feature_type = "LineString"
+
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+
+    @property
+    def points(self) -> numpy.ndarray:
+        """ The coordinates [[lon, lat], ...] of the fixes (a view, not a copy). """
+        return self.coordinates[self.start:self.end]
+
+
+    def _reserve(self, n: int) -> None:
+        """ Makes room for n more fixes, moving the kept fixes to the front or growing the arrays (doubling). """
+        if self.end + n <= len(self.times):
+            return
+
+        count = self.end - self.start
+        capacity = len(self.times)
+        if count + n > capacity // 2:
+            capacity = max(2 * capacity, count + n)
+
+        shift = self.start
+        for name in ("coordinates", "times", "world", "projected"):
+            old = getattr(self, name)
+            new = numpy.empty((capacity,) + old.shape[1:], dtype = float) if capacity != len(old) else old
+            new[:count] = old[self.start:self.end]
+            setattr(self, name, new)
+
+        self.start, self.end = 0, count
+        self.projected_end = max(0, self.projected_end - shift)
+        self.drawn_start = max(0, self.drawn_start - shift)
+        self.drawn_end = max(0, self.drawn_end - shift)
+
+
+    def append(self, longitude: float, latitude: float, timestamp: float = None) -> None:
+        """
+            Adds a fix at the end of the track (amortised O(1)).
+
+            :param longitude [float] -- The longitude of the fix
+            :param latitude [float] -- The latitude of the fix
+            :param timestamp [float] -- The time of the fix (seconds, time.time() if None)
+        """
+        self.extend([longitude], [latitude], None if timestamp is None else [timestamp])
+
+
+    def extend(self, longitudes, latitudes, timestamps = None) -> None:
+        """
+            Adds many fixes at the end of the track.
+
+            :param longitudes -- The longitudes of the fixes (list or numpy array)
+            :param latitudes -- The latitudes of the fixes
+            :param timestamps -- The times of the fixes, in increasing order (time.time() for all if None)
+        """
+        coordinates = numpy.column_stack((numpy.ravel(longitudes), numpy.ravel(latitudes))).astype(float)
+        n = len(coordinates)
+        if n == 0:
+            return
+
+        self._reserve(n)
+        end = self.end + n
+        self.coordinates[self.end:end] = coordinates
+        self.times[self.end:end] = time.time() if timestamps is None else numpy.ravel(timestamps)
+        self.world[self.end:end] = world_xy(coordinates)
+        self.end = end
+
+        if self.max_age is not None:
+            self.trim(self.times[end - 1] - self.max_age)
+
+
+    def trim(self, before: float) -> None:
+        """
+            Removes the fixes older than 'before' (the times have to be in increasing order).
+            They are removed from the drawn surface once they make up more than DEFAULT_TRACK_TRIM_SLACK of it, so it
+            is only drawn again after many fixes have been appended.
+
+            :param before [float] -- The time (seconds)
+        """
+        self.start += int(numpy.searchsorted(self.times[self.start:self.end], before, side = "left"))
+        self.projected_end = max(self.projected_end, self.start)
+
+        if self.overlay is not None and self.start - self.drawn_start > DEFAULT_TRACK_TRIM_SLACK * (self.drawn_end - self.drawn_start):
+            self.overlay = None
+
+
+    def invalidate(self) -> None:
+        """ Draws the whole track again on the next frame (e.g. after changing its color or width). """
+        self.overlay = None
+
+
+    def _project(self) -> None:
+        """ Projects the fixes which are not projected yet on the (scaled) world raster of the map's zoom level. """
+        zoom = (self.tilemap.mapconfig.zoom, self.tilemap.scale)
+        if zoom != self.projected_zoom:
+            self.projected_zoom = zoom
+            self.projected_end = self.start
+            self.overlay = None
+
+        if self.projected_end < self.end:
+            size = 2 ** zoom[0] * self.tilemap.mapconfig.tilesize * zoom[1]
+            self.projected[self.projected_end:self.end] = self.world[self.projected_end:self.end] * size
+            self.projected_end = self.end
+
+
+    def _view_origin(self):
+        """ Returns the (scaled) world raster position shown at the top left of the window, None if it can not be blitted. """
+        tilemap = self.tilemap
+        if tilemap.zooming or tilemap.mapconfig.bearing % 360 != 0:
+            return None
+
+        origin = tilemap.world_px_of_map_px(*tilemap.map_px_of_px(0, 0))
+        if origin is None:
+            return None
+
+        return origin[0] * tilemap.scale, origin[1] * tilemap.scale
+
+
+    def _render(self, origin) -> None:
+        """ Draws all fixes on a new surface covering the window and a margin of one tile around it. """
+        tilemap = self.tilemap
+        margin = tilemap.mapconfig.tilesize
+        self.overlay = pygame.Surface((tilemap.w + 2 * margin, tilemap.h + 2 * margin), pygame.SRCALPHA)
+        self.overlay_origin = (round(origin[0]) - margin, round(origin[1]) - margin)
+
+        points = self.projected[self.start:self.end] - self.overlay_origin
+        draw_segments(self.overlay, self.color, self.width, points, self.overlay.get_rect())
+        self.drawn_start, self.drawn_end = self.start, self.end
+
+
+    def draw(self) -> None:
+        if not self.visible or len(self) < 2:
+            return
+
+        window = self.tilemap.window
+        self._project()
+        origin = self._view_origin()
+
+        if origin is None:
+            ## Zooming or rotated: the segments in the window are drawn directly
+            map_origin = self.tilemap.world_px_of_map_px(0, 0)
+            if map_origin is None:
+                return
+            points = self.projected[self.start:self.end] / self.tilemap.scale
+            px, py = self.tilemap.px_of_map_px(points[:, 0] - map_origin[0], points[:, 1] - map_origin[1])
+            draw_segments(window, self.color, self.width, numpy.column_stack((px, py)), window.get_rect())
+            return
+
+        ox, oy = round(origin[0]), round(origin[1])
+        view = pygame.Rect(ox - self.overlay_origin[0], oy - self.overlay_origin[1], self.tilemap.w, self.tilemap.h)
+
+        if self.overlay is None or not self.overlay.get_rect().contains(view):
+            self._render(origin)
+            view.topleft = (ox - self.overlay_origin[0], oy - self.overlay_origin[1])
+
+        elif self.drawn_end < self.end:
+            ## Only the new segments (from the last drawn fix on)
+            first = max(self.drawn_end - 1, self.start)
+            points = self.projected[first:self.end] - self.overlay_origin
+            draw_segments(self.overlay, self.color, self.width, points, self.overlay.get_rect())
+            self.drawn_end = self.end
+
+        window.blit(self.overlay, (0, 0), view)
+
+
+    def to_geojson(self):
+        """ Returns a json object with itself in geojson format as feature. """
+        return {
+            "type": "Feature",
+            "properties": {
+                "stroke": "#%02x%02x%02x" % tuple(self.color)[:3],
+                "stroke-width": self.width,
+                "times": self.times[self.start:self.end].tolist()
+            },
+            "geometry": {
+                "coordinates": self.points.tolist(),
+                "type": self.feature_type
+            }
+        }
@@ -2,10 +2,12 @@ from tilemap import TileMap
 import pygame as pg
 import sys
 from core.models import *
+from core.constants import DEFAULT_ZOOM_STEP
+from core.trace import TraceRecorder
 
 pg.init()
 
-window = pg.display.set_mode((1500, 800))
+window = pg.display.set_mode((1500, 800), pg.RESIZABLE)
 
 m = TileMap(
     mapconfig = MapConfig(
@@ -21,11 +23,20 @@ m = TileMap(
 
 clock = pg.time.Clock()
 
+## python testfile.py pan.trace -- records the events to replay them with tools/replay.py
+RECORDER = TraceRecorder(sys.argv[1], m) if len(sys.argv) > 1 else None
+
 PRESSING = False
 
 while True:
-    for event in pg.event.get():
+    events = pg.event.get()
+    if RECORDER is not None:
+        RECORDER.record(events)
+
+    for event in events:
         if event.type == pg.QUIT:
+            if RECORDER is not None:
+                RECORDER.close()
             sys.exit(0)
             pg.quit()
 
@@ -37,6 +48,18 @@ while True:
         if event.type == pg.MOUSEBUTTONUP:
             PRESSING = False
 
+        elif event.type == pg.VIDEORESIZE:
+            m.on_resize(event.size)
+
+        elif event.type == pg.MOUSEWHEEL:
+            m.zoom_by(DEFAULT_ZOOM_STEP ** event.y, pg.mouse.get_pos())
+
+        elif event.type == pg.KEYDOWN:
+            if event.key == pg.K_q:
+                m.set_bearing(m.mapconfig.bearing - 15)
+            elif event.key == pg.K_e:
+                m.set_bearing(m.mapconfig.bearing + 15)
+
         elif event.type == pg.MOUSEMOTION:
             if PRESSING:
                 m.on_drag(event.rel)
@@ -0,0 +1,48 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pygame
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def tileserver():
+    """ Starts tools/tileserver.py with some options (e.g. tileserver("--flaky", "2")) and returns its url. """
+    servers = []
+
+    def start(*options) -> str:
+        port = free_port()
+        servers.append(subprocess.Popen([sys.executable, os.path.join(ROOT, "tools", "tileserver.py"), "--port", str(port), "--quiet", *options]))
+        for _ in range(200):
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout = 0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        return f"http://127.0.0.1:{port}"
+
+    yield start
+
+    for server in servers:
+        server.terminate()
+        server.wait()
+
+
+@pytest.fixture
+def window():
+    pygame.init()
+    yield pygame.display.set_mode((600, 400))
+    pygame.quit()
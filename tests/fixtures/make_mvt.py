@@ -0,0 +1,134 @@
+## Writes the vector tile fixtures of tests/test_mvt.py (python tests/fixtures/make_mvt.py).
+## A minimal encoder of the Mapbox Vector Tile spec 2.1, so the fixtures do not depend on other libraries.
+
+import gzip
+import os
+import struct
+
+
+def varint(n: int) -> bytes:
+    out = b""
+    while True:
+        byte, n = n & 0x7f, n >> 7
+        if not n:
+            return out + bytes([byte])
+        out += bytes([byte | 0x80])
+
+
+def zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def field(number: int, wire: int, payload) -> bytes:
+    key = varint(number << 3 | wire)
+    if wire == 0:
+        return key + varint(payload)
+    if wire == 1:
+        return key + payload
+    return key + varint(len(payload)) + payload
+
+
+def value(v) -> bytes:
+    if isinstance(v, bool):
+        return field(7, 0, int(v))
+    if isinstance(v, str):
+        return field(1, 2, v.encode("utf-8"))
+    if isinstance(v, float):
+        return field(3, 1, struct.pack("<d", v))
+    return field(6, 0, zigzag(v))
+
+
+def command(id: int, count: int) -> int:
+    return count << 3 | id
+
+
+def geometry(kind: int, parts: list) -> list:
+    """ Encodes points [(x, y), ...], lines [[(x, y), ...], ...] or polygon rings [[(x, y), ...], ...]. """
+    commands = []
+    x = y = 0
+
+    if kind == 1:
+        commands.append(command(1, len(parts)))
+        for px, py in parts:
+            commands += [zigzag(px - x), zigzag(py - y)]
+            x, y = px, py
+        return commands
+
+    for part in parts:
+        commands += [command(1, 1), zigzag(part[0][0] - x), zigzag(part[0][1] - y)]
+        x, y = part[0]
+        commands.append(command(2, len(part) - 1))
+        for px, py in part[1:]:
+            commands += [zigzag(px - x), zigzag(py - y)]
+            x, y = px, py
+        if kind == 3:
+            commands.append(command(7, 1))
+
+    return commands
+
+
+def layer(name: str, features: list, extent: int = 4096) -> bytes:
+    """ :param features -- (id, type, geometry parts, properties) """
+    keys, values, encoded = [], [], b""
+
+    for id, kind, parts, properties in features:
+        tags = []
+        for key, v in properties.items():
+            if key not in keys:
+                keys.append(key)
+            if v not in values or any(type(v) is not type(known) for known in values if known == v):
+                values.append(v)
+            tags += [keys.index(key), max(i for i, known in enumerate(values) if known == v and type(known) is type(v))]
+
+        message = field(1, 0, id) + field(2, 2, b"".join(varint(t) for t in tags)) + field(3, 0, kind)
+        message += field(4, 2, b"".join(varint(c) for c in geometry(kind, parts)))
+        encoded += field(2, 2, message)
+
+    message = field(15, 0, 2) + field(1, 2, name.encode("utf-8")) + encoded
+    message += b"".join(field(3, 2, key.encode("utf-8")) for key in keys)
+    message += b"".join(field(4, 2, value(v)) for v in values)
+    return message + field(5, 0, extent)
+
+
+def tile(*layers) -> bytes:
+    return b"".join(field(3, 2, l) for l in layers)
+
+
+POI = layer("poi", [
+    (1, 1, [(10, 20), (30, 40)], {"name": "a", "rank": -3, "height": 12.5, "open": True}),
+    (2, 1, [(2048, 2048)], {"name": "b"})
+])
+
+ROAD = layer("road", [
+    (1, 2, [[(0, 128), (256, 128)], [(128, 0), (128, 256)]], {"class": "primary"}),
+    (2, 2, [[(0, 0), (64, 64)]], {"class": "secondary"})
+], extent = 256)
+
+WATER = layer("water", [
+    (1, 3, [
+        [(0, 0), (2048, 0), (2048, 2048), (0, 2048)],
+        [(512, 512), (512, 1536), (1536, 1536), (1536, 512)],
+        [(2560, 2560), (4096, 2560), (4096, 4096), (2560, 4096)]
+    ], {"kind": "lake"})
+])
+
+## The top left quarter of the tile, to cut the tiles of the next zoom level out of
+QUARTER = layer("water", [(1, 3, [[(0, 0), (2048, 0), (2048, 2048), (0, 2048)]], {})])
+
+
+def main() -> None:
+    folder = os.path.dirname(os.path.abspath(__file__))
+    fixtures = {
+        "points.mvt": tile(POI),
+        "lines.mvt": tile(ROAD),
+        "polygons.mvt": tile(WATER),
+        "gzipped.mvt": gzip.compress(tile(WATER, ROAD), mtime = 0),
+        "quarter.mvt": tile(QUARTER)
+    }
+    for name, data in fixtures.items():
+        with open(os.path.join(folder, name), "wb") as file:
+            file.write(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+
+import pytest
+
+from asynctilemap import AsyncTileMap
+from core.models import MapConfig, Coordinate
+from core.tileservice import TileService
+
+
+pytestmark = pytest.mark.usefixtures("window")
+
+
+def new_map(url: str) -> AsyncTileMap:
+    return AsyncTileMap(
+        MapConfig(token = "", url = url, tilesize = 256, coordinates = Coordinate(longitude = 6.13, latitude = 49.61), zoom = 10),
+        service = TileService()
+    )
+
+
+def test_close_is_synchronous(tileserver):
+    url = tileserver()
+
+    async def main():
+        m = new_map(url)
+        for _ in range(500):
+            m.draw()
+            if all(tile.loaded for tile in m.narray.flat):
+                break
+            await asyncio.sleep(0.01)
+        assert all(tile.loaded for tile in m.narray.flat)
+
+        ## Like TileMap.close, so code closing any map keeps working
+        assert m.close() is None
+        assert m.store_view not in m.tilestore.views
+        assert not m.fetcher.idle
+
+    asyncio.run(main())
+
+
+def test_aclose_waits_for_the_loading_tiles(tileserver):
+    url = tileserver("--delay", "5")
+
+    async def main():
+        m = new_map(url)
+        m.draw()
+        await asyncio.sleep(0.1)
+        tasks = list(m.tasks)
+        assert tasks
+
+        await asyncio.wait_for(m.aclose(), 5)
+        assert all(task.done() for task in tasks)
+        assert not m.tasks and not m.loading
+        assert m.store_view not in m.tilestore.views
+
+    asyncio.run(main())
+
+
+def test_images_are_decoded_off_the_loop(tileserver):
+    url = tileserver()
+
+    async def main():
+        m = new_map(url)
+        loop_thread = threading.get_ident()
+        decoded_by = []
+        decode = m.layers.decode
+
+        def recording(*args):
+            decoded_by.append(threading.get_ident())
+            return decode(*args)
+        m.layers.decode = recording
+
+        for _ in range(500):
+            m.draw()
+            if all(tile.loaded for tile in m.narray.flat):
+                break
+            await asyncio.sleep(0.01)
+
+        assert all(tile.loaded for tile in m.narray.flat)
+        assert decoded_by and loop_thread not in decoded_by
+        await m.aclose()
+
+    asyncio.run(main())
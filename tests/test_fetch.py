@@ -0,0 +1,195 @@
+import asyncio
+import time
+from urllib.request import urlopen
+
+import pytest
+
+from core.aiofetch import AsyncTileFetcher
+from core.fetch import TileFetcher, TileFetchError
+
+
+class CountingOpener():
+    """ urlopen, counting the requests sent. """
+    def __init__(self) -> None:
+        self.urls = []
+
+    def __call__(self, url, timeout):
+        self.urls.append(url)
+        return urlopen(url, timeout = timeout)
+
+
+def tile(url: str, zoom: int = 3, x: int = 4, y: int = 2) -> str:
+    return f"{url}/256/{zoom}/{x}/{y}"
+
+
+def test_retries_until_the_server_answers(tileserver):
+    url = tileserver("--flaky", "2")
+    opener = CountingOpener()
+    fetcher = TileFetcher(retries = 2, backoff = 0.01, opener = opener)
+
+    assert fetcher.fetch(tile(url)).startswith(b"\x89PNG")
+    assert len(opener.urls) == 3
+    assert not fetcher.breaker(url).is_open
+
+
+def test_gives_up_after_the_retries(tileserver):
+    url = tileserver("--flaky", "5")
+    fetcher = TileFetcher(retries = 1, backoff = 0.01)
+
+    with pytest.raises(TileFetchError) as error:
+        fetcher.fetch(tile(url))
+    assert not error.value.permanent
+
+
+def test_missing_tiles_are_cached_negatively(tileserver):
+    url = tileserver("--missing", "*/5/*/*")
+    opener = CountingOpener()
+    fetcher = TileFetcher(retries = 2, backoff = 0.01, opener = opener)
+
+    for _ in range(3):
+        with pytest.raises(TileFetchError) as error:
+            fetcher.fetch(tile(url, 5))
+        assert error.value.permanent
+    assert len(opener.urls) == 1
+    assert not fetcher.available(tile(url, 5))
+
+    ## The host is fine
+    assert fetcher.fetch(tile(url, 4))
+    assert not fetcher.breaker(url).is_open
+
+
+def test_negative_cache_expires(tileserver):
+    url = tileserver("--missing", "*/5/*/*")
+    opener = CountingOpener()
+    fetcher = TileFetcher(retries = 0, negative_ttl = 0.1, opener = opener)
+
+    for _ in range(2):
+        with pytest.raises(TileFetchError):
+            fetcher.fetch(tile(url, 5))
+        time.sleep(0.15)
+    assert len(opener.urls) == 2
+
+
+def test_breaker_opens_and_closes(tileserver):
+    url = tileserver("--flaky", "3")
+    opener = CountingOpener()
+    fetcher = TileFetcher(retries = 0, breaker_threshold = 2, breaker_cooldown = 0.2, opener = opener)
+
+    for _ in range(2):
+        with pytest.raises(TileFetchError):
+            fetcher.fetch(tile(url))
+    assert fetcher.breaker(url).is_open
+
+    ## Fails right away
+    with pytest.raises(TileFetchError, match = "circuit open"):
+        fetcher.fetch(tile(url))
+    assert len(opener.urls) == 2
+
+    ## The trial request fails (third 503), the breaker stays open for another cooldown
+    time.sleep(0.25)
+    with pytest.raises(TileFetchError):
+        fetcher.fetch(tile(url))
+    with pytest.raises(TileFetchError, match = "circuit open"):
+        fetcher.fetch(tile(url))
+
+    ## The next trial succeeds and closes it
+    time.sleep(0.25)
+    assert fetcher.fetch(tile(url))
+    assert not fetcher.breaker(url).is_open
+    assert len(opener.urls) == 4
+
+
+def test_truncated_answers_are_transient_failures(tileserver):
+    url = tileserver("--truncate-rate", "1")
+    fetcher = TileFetcher(retries = 1, backoff = 0.01, breaker_threshold = 1, breaker_cooldown = 0.1)
+
+    with pytest.raises(TileFetchError) as error:
+        fetcher.fetch(tile(url))
+    assert not error.value.permanent
+    assert "IncompleteRead" in str(error.value)
+
+    breaker = fetcher.breaker(url)
+    assert breaker.is_open
+
+    ## A trial request cut short leaves the breaker open, not stuck half open
+    time.sleep(0.15)
+    with pytest.raises(TileFetchError, match = "IncompleteRead"):
+        fetcher.fetch(tile(url))
+    assert not breaker.trial
+
+    time.sleep(0.15)
+    assert breaker.allow()
+
+
+def test_unexpected_opener_errors_clear_the_trial():
+    def opener(url, timeout):
+        raise RuntimeError("broken")
+
+    fetcher = TileFetcher(retries = 0, breaker_threshold = 1, breaker_cooldown = 0, opener = opener)
+    for _ in range(3):
+        with pytest.raises(TileFetchError, match = "broken"):
+            fetcher.fetch("http://example.invalid/0/0/0")
+        assert not fetcher.breaker("http://example.invalid").trial
+
+
+def test_async_fetcher_paths(tileserver):
+    flaky = tileserver("--flaky", "1", "--missing", "*/5/*/*")
+    truncating = tileserver("--truncate-rate", "1")
+
+    async def main():
+        fetcher = AsyncTileFetcher(retries = 1, backoff = 0.01, breaker_threshold = 1, breaker_cooldown = 0.1)
+        try:
+            assert (await fetcher.fetch_async(tile(flaky))).startswith(b"\x89PNG")
+
+            with pytest.raises(TileFetchError) as error:
+                await fetcher.fetch_async(tile(flaky, 5))
+            assert error.value.permanent
+
+            with pytest.raises(TileFetchError):
+                await fetcher.fetch_async(tile(truncating))
+            breaker = fetcher.breaker(truncating)
+            assert breaker.is_open
+
+            await asyncio.sleep(0.15)
+            with pytest.raises(TileFetchError):
+                await fetcher.fetch_async(tile(truncating))
+            assert not breaker.trial
+        finally:
+            fetcher.close()
+
+    asyncio.run(main())
+
+
+def test_cancelled_fetches_are_not_failures(tileserver):
+    url = tileserver("--delay", "1")
+
+    async def main():
+        fetcher = AsyncTileFetcher(retries = 0, breaker_threshold = 2, breaker_cooldown = 10)
+        try:
+            breaker = fetcher.breaker(url)
+            tasks = [asyncio.create_task(fetcher.fetch_async(tile(url, 3, x))) for x in range(6)]
+            await asyncio.sleep(0.05)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions = True)
+
+            ## Closing the map cancels its fetches, that says nothing about the host
+            assert breaker.failures == 0
+            assert not breaker.is_open
+            assert (await fetcher.fetch_async(tile(url))).startswith(b"\x89PNG")
+
+            ## A cancelled trial request ends the trial, the next request is the new trial
+            breaker.failures = 2
+            breaker.opened_at = time.monotonic() - 10
+            task = asyncio.create_task(fetcher.fetch_async(tile(url)))
+            await asyncio.sleep(0.05)
+            assert breaker.trial or task.done()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions = True)
+            assert not breaker.trial
+            assert (await fetcher.fetch_async(tile(url))).startswith(b"\x89PNG")
+            assert not breaker.is_open
+        finally:
+            fetcher.close()
+
+    asyncio.run(main())
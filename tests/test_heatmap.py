@@ -0,0 +1,77 @@
+import numpy
+import pygame
+import pytest
+
+from core.spatial import world_xy
+from core.utility import tile_xy_from_lonlat
+from features.heatmap import Heatmap, INDEX_ZOOM
+
+
+def random_points(count: int, seed: int = 1):
+    """ Points around Luxembourg, half of them in a small cluster. """
+    rng = numpy.random.default_rng(seed)
+    longitudes = numpy.concatenate((rng.uniform(5.7, 6.6, count // 2), rng.normal(6.13, 0.01, count - count // 2)))
+    latitudes = numpy.concatenate((rng.uniform(49.4, 50.2, count // 2), rng.normal(49.61, 0.01, count - count // 2)))
+    return longitudes, latitudes
+
+
+def expected_counts(longitudes, latitudes, zoom: int, x: int, y: int, bins: int) -> numpy.ndarray:
+    """ Counts the points in the cells of a tile one by one. """
+    cells = numpy.floor(world_xy(numpy.column_stack((longitudes, latitudes))) * 2 ** INDEX_ZOOM).astype(numpy.int64)
+    tile = cells >> (INDEX_ZOOM - zoom)
+    inside = (tile[:, 0] == x) & (tile[:, 1] == y)
+    cell = (cells[inside] >> (INDEX_ZOOM - zoom - (bins.bit_length() - 1))) & (bins - 1)
+
+    grid = numpy.zeros((bins, bins), dtype = numpy.int64)
+    numpy.add.at(grid, (cell[:, 1], cell[:, 0]), 1)
+    return grid
+
+
+def test_counts_match_the_points_of_each_cell():
+    longitudes, latitudes = random_points(20000)
+    heatmap = Heatmap(longitudes, latitudes, bins = 64)
+    assert len(heatmap) == 20000
+
+    for zoom in (4, 8, 12, 16):
+        x, y = tile_xy_from_lonlat(6.13, 49.61, zoom)
+        counts = heatmap.counts(zoom, x, y)
+        assert counts.shape == (64, 64)
+        assert numpy.array_equal(counts, expected_counts(longitudes, latitudes, zoom, x, y, 64))
+
+    ## Every point is in one tile of a zoom level
+    total = sum(heatmap.counts(3, x, y).sum() for x in range(8) for y in range(8))
+    assert total == 20000
+
+
+def test_append_returns_the_computed_tiles_with_new_points():
+    heatmap = Heatmap(*random_points(1000), bins = 32)
+    luxembourg = (10,) + tile_xy_from_lonlat(6.131, 49.58, 10)
+    paris = (10,) + tile_xy_from_lonlat(2.35, 48.85, 10)
+    region = (5,) + tile_xy_from_lonlat(6.131, 49.58, 5)
+
+    for key in (luxembourg, paris, region):
+        heatmap.render(*key, 256)
+
+    ## A point in Luxembourg and one in Berlin, where no tile has been computed
+    dirty = heatmap.append(numpy.array([6.131, 13.4]), numpy.array([49.58, 52.52]))
+    assert dirty == {luxembourg, region}
+    assert len(heatmap) == 1002
+
+    ## Not computed again since, so nothing has to be updated
+    assert heatmap.append(numpy.array([6.131]), numpy.array([49.58])) == set()
+    assert heatmap.counts(*luxembourg).sum() == expected_counts(*random_points(1000), *luxembourg, 32).sum() + 2
+
+
+def test_render_colors_the_density():
+    heatmap = Heatmap(numpy.full(100, 6.13), numpy.full(100, 49.61), bins = 16)
+    zoom, (x, y) = 12, tile_xy_from_lonlat(6.13, 49.61, 12)
+
+    surface = heatmap.render(zoom, x, y, 256)
+
+    assert surface.get_size() == (256, 256)
+    assert surface.get_flags() & pygame.SRCALPHA
+    alpha = pygame.surfarray.array_alpha(surface)
+    ## All points are in one cell (16 px), the saturated color is red, the empty cells are transparent
+    assert alpha.max() > 200 and (alpha == 0).mean() > 0.9
+    peak = numpy.unravel_index(alpha.argmax(), alpha.shape)
+    assert tuple(surface.get_at(peak))[:3] == pytest.approx((255, 0, 0), abs = 8)
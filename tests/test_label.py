@@ -0,0 +1,74 @@
+import pygame
+import pytest
+
+from core.models import MapConfig, Coordinate
+from core.tileservice import TileService
+from features.label import Labels, TextCache
+from tilemap import TileMap
+
+
+pytestmark = pytest.mark.usefixtures("window")
+
+
+def new_map(url: str) -> TileMap:
+    return TileMap(
+        MapConfig(token = "", url = url, tilesize = 256, coordinates = Coordinate(longitude = 6.13, latitude = 49.61), zoom = 12),
+        service = TileService()
+    )
+
+
+def test_text_cache_keeps_the_recently_used_surfaces():
+    cache = TextCache(size = 2)
+
+    a = cache.render("a", color = "red")
+    assert cache.render("a", color = (255, 0, 0)) is a
+    b = cache.render("b")
+    ## "a" is used again, so "b" is the least recently used one
+    cache.render("a", color = "red")
+    cache.render("c")
+
+    assert len(cache.surfaces) == 2
+    assert cache.render("a", color = "red") is a
+    assert cache.render("b") is not b
+
+
+def test_glyphs_are_rendered_once():
+    cache = TextCache()
+    target = pygame.Surface((200, 40), pygame.SRCALPHA)
+
+    rect = cache.draw_glyphs(target, (5, 5), "49.611, 6.130")
+    assert len(cache.glyphs) == len(set("49.611, 6.130"))
+    assert rect.topleft == (5, 5) and rect.width == sum(cache.glyphs[(c, None, 16, (0, 0, 0, 255))].get_width() for c in "49.611, 6.130")
+
+    cache.draw_glyphs(target, (5, 5), "49.116, 6.013")
+    assert len(cache.glyphs) == len(set("49.611, 6.130"))
+
+
+def test_overlapping_labels_are_culled_once_per_view(tileserver, monkeypatch):
+    m = new_map(tileserver())
+    labels = Labels(m, cache = TextCache())
+    low = labels.add(6.13, 49.61, "Luxembourg")
+    high = labels.add(6.1301, 49.6101, "Ville", priority = 10)
+    apart = labels.add(6.2, 49.58, "Sandweiler")
+
+    culled = []
+    cull = labels.cull
+    monkeypatch.setattr(labels, "cull", lambda px, py: culled.append(len(px)) or cull(px, py))
+
+    labels.draw()
+    assert sorted(labels.shown.tolist()) == sorted([high, apart])
+    assert low not in labels.shown
+
+    ## Dragging moves all labels alike, what is shown is kept
+    for _ in range(5):
+        m.on_drag((13, 7))
+        labels.draw()
+    assert culled == [3]
+
+    ## Zoomed in far enough, the labels do not overlap anymore
+    m.zoom_by(2 ** 6, (m.w / 2, m.h / 2))
+    m.settle_zoom()
+    labels.draw()
+    assert culled == [3, 3]
+    assert sorted(labels.shown.tolist()) == [low, high, apart]
+    m.close()
@@ -0,0 +1,115 @@
+import io
+import threading
+import time
+
+import pygame
+import pytest
+
+from core.layers import LayerStack
+from core.models import MapConfig, Coordinate, Layer, Tile
+from core.tilestore import TileStore
+from core.tileservice import TileService
+from tilemap import TileMap
+
+
+COLORS = {"base.test": (255, 0, 0), "weather.test": (0, 0, 255), "hillshade.test": (0, 255, 0)}
+
+LAYERS = [
+    Layer(name = "base", url = "http://base.test/{z}/{x}/{y}.png"),
+    Layer(name = "weather", url = "http://weather.test/{z}/{x}/{y}.png", opacity = 0.5),
+    Layer(name = "hillshade", url = "http://hillshade.test/{z}/{x}/{y}.png", opacity = 0.5, min_zoom = 8)
+]
+
+
+def png(color) -> bytes:
+    surface = pygame.Surface((256, 256))
+    surface.fill(color)
+    data = io.BytesIO()
+    pygame.image.save(surface, data, "tile.png")
+    return data.getvalue()
+
+
+class FakeServer():
+    """ Answers every url with a tile of the color of its host, counting the requests. """
+    def __init__(self, parallel: int = 1) -> None:
+        self.urls = []
+        ## The layers of a tile have to be fetched at the same time to get past it
+        self.barrier = threading.Barrier(parallel, timeout = 5) if parallel > 1 else None
+
+    def __call__(self, url: str):
+        self.urls.append(url)
+        if self.barrier is not None:
+            self.barrier.wait()
+        return io.BytesIO(png(COLORS[url.split("/")[2]]))
+
+
+def assert_color(surface, expected) -> None:
+    assert tuple(surface.get_at((128, 128)))[:3] == pytest.approx(expected, abs = 2)
+
+
+def test_layers_are_fetched_in_parallel_and_composed():
+    server = FakeServer(parallel = 3)
+    store = TileStore()
+    stack = LayerStack(LAYERS, store, server, 256, "token")
+    try:
+        tile = stack.compose(10, 530, 349)
+        ## Red, half covered by blue, half covered by green
+        assert_color(tile, (64, 128, 64))
+        assert len(server.urls) == 3
+
+        ## The hillshade is not shown below zoom level 8
+        server.barrier = threading.Barrier(2, timeout = 5)
+        assert_color(stack.compose(5, 16, 10), (128, 0, 128))
+        assert len(server.urls) == 5
+
+        ## The images of the layers are stored, composing the tile again fetches nothing
+        assert {key[3] for key in store.keys() if key[:3] == (10, 530, 349)} == {"base", "weather", "hillshade"}
+        assert_color(stack.compose(10, 530, 349), (64, 128, 64))
+        assert len(server.urls) == 5
+    finally:
+        stack.executor.shutdown()
+
+
+def test_invalidated_layer_is_the_only_one_fetched_again():
+    server = FakeServer()
+    stack = LayerStack(LAYERS[:2], TileStore(), server, 256, "token")
+    try:
+        stack.compose(10, 530, 349)
+        stack.compose(10, 530, 349)
+        assert len(server.urls) == 2
+
+        stack.invalidate("weather")
+        stack.compose(10, 530, 349)
+        assert server.urls[2:] == ["http://weather.test/10/530/349.png"]
+    finally:
+        stack.executor.shutdown()
+
+
+@pytest.mark.usefixtures("window")
+def test_update_layer_fetches_and_recomposes_only_that_layer(tileserver):
+    url = tileserver()
+    m = TileMap(
+        MapConfig(token = "", url = url, tilesize = 256, coordinates = Coordinate(longitude = 6.13, latitude = 49.61), zoom = 10),
+        layers = [Layer(name = "overlay", url = url + "/256/{z}/{x}/{y}?overlay", opacity = 0.5)],
+        service = TileService()
+    )
+    fetched = []
+    fetch_tile = m.fetch_tile
+    m.fetch_tile = lambda tile_url: fetched.append(tile_url) or fetch_tile(tile_url)
+
+    end = time.monotonic() + 10
+    while not all(isinstance(tile, Tile) and tile.loaded for tile in m.narray.flat) and time.monotonic() < end:
+        m.draw()
+        time.sleep(0.01)
+    tiles = list(m.narray.flat)
+    images = {id(tile): tile.image for tile in tiles}
+    fetched.clear()
+
+    m.update_layer("overlay")
+    while any(tile.image is images[id(tile)] for tile in tiles) and time.monotonic() < end:
+        m.draw()
+        time.sleep(0.01)
+
+    assert all(tile.image is not images[id(tile)] for tile in tiles)
+    assert sorted(fetched) == sorted(f"{url}/256/{tile.zoom}/{tile.x}/{tile.y}?overlay" for tile in tiles)
+    m.close()
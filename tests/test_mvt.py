@@ -0,0 +1,138 @@
+import os
+
+from core import mvt
+from core.vectortiles import VectorTileSource, rasterise
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+BACKGROUND = (0, 0, 0, 255)
+BLUE = (0, 0, 255, 255)
+RED = (255, 0, 0, 255)
+GREEN = (0, 255, 0, 255)
+
+STYLE = {
+    "background": "#000000",
+    "rules": [
+        {"layer": "water", "fill": "#0000ff"},
+        {"layer": "road", "stroke": "#ff0000", "width": 3, "filter": {"class": "primary"}},
+        {"layer": "poi", "fill": "#00ff00", "radius": 4}
+    ]
+}
+
+
+def fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES, name), "rb") as file:
+        return file.read()
+
+
+def test_decode_points():
+    layers = mvt.decode(fixture("points.mvt"))
+
+    assert list(layers) == ["poi"]
+    poi = layers["poi"]
+    assert poi["extent"] == 4096
+    assert [feature["id"] for feature in poi["features"]] == [1, 2]
+
+    multipoint, point = poi["features"]
+    assert multipoint["type"] == mvt.GEOM_POINT
+    assert multipoint["geometry"] == [(10, 20), (30, 40)]
+    assert multipoint["properties"] == {"name": "a", "rank": -3, "height": 12.5, "open": True}
+    assert point["geometry"] == [(2048, 2048)]
+    assert point["properties"] == {"name": "b"}
+
+
+def test_decode_lines():
+    road = mvt.decode(fixture("lines.mvt"))["road"]
+
+    assert road["extent"] == 256
+    primary, secondary = road["features"]
+    assert primary["type"] == mvt.GEOM_LINESTRING
+    assert primary["geometry"] == [[(0, 128), (256, 128)], [(128, 0), (128, 256)]]
+    assert primary["properties"] == {"class": "primary"}
+    assert secondary["geometry"] == [[(0, 0), (64, 64)]]
+
+
+def test_decode_polygons_with_holes():
+    water = mvt.decode(fixture("polygons.mvt"))["water"]
+
+    feature, = water["features"]
+    assert feature["type"] == mvt.GEOM_POLYGON
+    assert feature["properties"] == {"kind": "lake"}
+    ## The hole belongs to the first polygon, the third ring starts a second polygon
+    assert feature["geometry"] == [
+        [[(0, 0), (2048, 0), (2048, 2048), (0, 2048)], [(512, 512), (512, 1536), (1536, 1536), (1536, 512)]],
+        [[(2560, 2560), (4096, 2560), (4096, 4096), (2560, 4096)]]
+    ]
+
+
+def test_decode_gzipped():
+    layers = mvt.decode(fixture("gzipped.mvt"))
+
+    assert fixture("gzipped.mvt")[:2] == b"\x1f\x8b"
+    assert layers["water"] == mvt.decode(fixture("polygons.mvt"))["water"]
+    assert layers["road"] == mvt.decode(fixture("lines.mvt"))["road"]
+
+
+def test_rasterise_polygons_with_holes():
+    surface = rasterise(mvt.decode(fixture("polygons.mvt")), STYLE, 14, 256)
+
+    assert surface.get_size() == (256, 256)
+    assert surface.get_at((16, 16)) == BLUE
+    assert surface.get_at((64, 64)) == BACKGROUND
+    assert surface.get_at((200, 200)) == BLUE
+    assert surface.get_at((200, 50)) == BACKGROUND
+
+
+def test_rasterise_lines_and_points():
+    layers = mvt.decode(fixture("gzipped.mvt"))
+    layers.update(mvt.decode(fixture("points.mvt")))
+    surface = rasterise(layers, STYLE, 14, 256)
+
+    ## The primary road crosses the tile (extent 256, so one unit is one pixel), the secondary one is filtered out
+    assert surface.get_at((220, 128)) == RED
+    assert surface.get_at((128, 220)) == RED
+    assert surface.get_at((180, 60)) == BACKGROUND
+    ## The lake of the water layer is drawn first, the roads over it
+    assert surface.get_at((50, 128)) == RED
+    assert surface.get_at((16, 16)) == BLUE
+    ## (2048, 2048) is the center, (10, 20) and (30, 40) are drawn at (0.6, 1.25) and (1.9, 2.5)
+    assert surface.get_at((130, 130)) == GREEN
+    assert surface.get_at((1, 1)) == GREEN
+
+
+def test_rasterise_respects_zoom_limits():
+    style = {"background": "#000000", "rules": [{"layer": "water", "fill": "#0000ff", "min_zoom": 15}]}
+    surface = rasterise(mvt.decode(fixture("polygons.mvt")), style, 14, 256)
+
+    assert surface.get_at((16, 16)) == BACKGROUND
+
+
+def test_overzoomed_tiles_are_cut_out_of_the_data_tile():
+    requested = []
+
+    def fetch(url: str) -> bytes:
+        requested.append(url)
+        return fixture("quarter.mvt")
+
+    source = VectorTileSource(url = "vector/{z}/{x}/{y}", style = STYLE, max_data_zoom = 2, fetch = fetch)
+    try:
+        ## The water fills the top left quarter of tile 2/1/1, so the top left child at zoom 3 is all water
+        inside = source.render(3, 2, 2, 256)
+        assert inside.get_at((0, 0)) == BLUE
+        assert inside.get_at((255, 255)) == BLUE
+
+        right = source.render(3, 3, 2, 256)
+        assert right.get_at((128, 128)) == BACKGROUND
+
+        ## At zoom 4 the quarter is the tiles 4..5 of 4..7 (in both directions)
+        edge = source.render(4, 5, 5, 256)
+        assert edge.get_at((0, 0)) == BLUE
+        assert edge.get_at((250, 250)) == BLUE
+        assert source.render(4, 6, 5, 256).get_at((5, 5)) == BACKGROUND
+    finally:
+        source.executor.shutdown(wait = True)
+
+    ## Every tile was cut out of the data tile (fetched once, then cached)
+    assert requested == ["vector/2/1/1"]
+
@@ -0,0 +1,113 @@
+import numpy
+import pytest
+
+from core.spatial import SpatialIndex, segment_distances, world_xy
+
+
+class Feature():
+    def __init__(self, points) -> None:
+        self.points = points
+
+
+def random_lines(count: int, seed: int = 1, west: float = 6.0, south: float = 49.5, size: float = 0.2) -> list:
+    rng = numpy.random.default_rng(seed)
+    starts = rng.uniform([west, south], [west + size, south + size], (count, 2))
+    steps = rng.normal(0, size / 400, (count, 5, 2))
+    return [Feature(points) for points in numpy.concatenate((starts[:, None], starts[:, None] + numpy.cumsum(steps, axis = 1)), axis = 1)]
+
+
+def scan(features: list):
+    """ Returns the segments of the features and the feature of each segment, to check the index against. """
+    segments, owners = [], []
+    for i, feature in enumerate(features):
+        points = world_xy(feature.points)
+        segments.append(numpy.hstack((points[:-1], points[1:])))
+        owners += [i] * (len(points) - 1)
+    return numpy.concatenate(segments), numpy.array(owners)
+
+
+def brute_nearest(features: list, x: float, y: float, radius: float):
+    segments, owners = scan(features)
+    distances = segment_distances(segments, x, y)
+    best = int(numpy.argmin(distances))
+    return features[owners[best]] if distances[best] <= radius else None
+
+
+def test_empty_features_are_not_indexed():
+    empty = Feature([])
+    assert len(SpatialIndex([empty])) == 0
+
+    line = Feature([[6.1, 49.6], [6.2, 49.7]])
+    index = SpatialIndex([empty, line, Feature(numpy.empty((0, 2)))])
+    assert len(index) == 1 and line in index and empty not in index
+
+    index.remove(empty)
+    index.update(empty)
+    assert len(index) == 1
+    (x, y), = world_xy([[6.1, 49.6]])
+    assert index.nearest(x, y, 1e-6)[0] is line
+
+
+def test_nearest_and_query_match_a_scan():
+    features = random_lines(1000)
+    index = SpatialIndex(features)
+    rng = numpy.random.default_rng(2)
+    radius = 1e-5
+
+    found = 0
+    for x, y in world_xy(rng.uniform([6.0, 49.5], [6.2, 49.7], (100, 2))):
+        feature = brute_nearest(features, x, y, radius)
+        assert index.nearest(x, y, radius)[0] is feature
+        found += feature is not None
+    assert found > 10
+
+    (x0, y1), (x1, y0) = world_xy([[6.05, 49.55], [6.1, 49.6]])
+    inside = {id(feature) for feature in index.query_bbox(x0, y0, x1, y1)}
+    segments, owners = scan(features)
+    overlap = (
+        (numpy.minimum(segments[:, 0], segments[:, 2]) <= x1) & (numpy.maximum(segments[:, 0], segments[:, 2]) >= x0) &
+        (numpy.minimum(segments[:, 1], segments[:, 3]) <= y1) & (numpy.maximum(segments[:, 1], segments[:, 3]) >= y0)
+    )
+    expected = {id(features[i]) for i in owners[overlap]}
+    assert 0 < len(inside) < len(features)
+    assert inside == expected
+
+
+def test_cells_follow_the_density():
+    sparse = SpatialIndex(random_lines(200, size = 20))
+    dense = SpatialIndex(random_lines(20000, size = 0.2))
+
+    assert dense.cell_zoom > sparse.cell_zoom
+    ## About DEFAULT_SPATIAL_CELL_SEGMENTS segments per cell, not thousands
+    assert dense.count / len(dense.cells) < 64
+
+    fixed = SpatialIndex(random_lines(200), cell_zoom = 12)
+    fixed.load(random_lines(2000, seed = 3))
+    assert fixed.cell_zoom == 12
+
+
+@pytest.mark.parametrize("cell_zoom", [None, 14])
+def test_removed_segments_are_compacted(cell_zoom):
+    features = random_lines(1000)
+    index = SpatialIndex(features, cell_zoom = cell_zoom)
+    segments = index.count
+
+    for feature in features[:900]:
+        index.remove(feature)
+    for feature in features[900:950]:
+        feature.points = feature.points + 0.01
+        index.update(feature)
+
+    assert len(index) == 100
+    assert index.count < segments / 2
+    assert index.count - index.dead == 100 * 5
+    ## The removed features were dropped with their segments
+    assert len(index.features) < 1000
+
+    rng = numpy.random.default_rng(4)
+    for x, y in world_xy(rng.uniform([6.0, 49.5], [6.2, 49.7], (100, 2))):
+        assert index.nearest(x, y, 1e-5)[0] is brute_nearest(features[900:], x, y, 1e-5)
+
+    for feature in features[900:]:
+        index.remove(feature)
+    assert len(index) == 0 and index.nearest(0.5, 0.5, 1)[0] is None
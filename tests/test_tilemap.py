@@ -0,0 +1,170 @@
+import math
+import time
+
+import pygame
+import pytest
+
+from core.models import MapConfig, Coordinate, Tile
+from core.tileservice import TileService
+from tilemap import TileMap
+
+
+pytestmark = pytest.mark.usefixtures("window")
+
+
+def new_map(url: str, tilesize: int = 256, **config) -> TileMap:
+    return TileMap(
+        MapConfig(token = "", url = url, tilesize = tilesize, coordinates = Coordinate(longitude = 6.13, latitude = 49.61), zoom = 10, **config),
+        service = TileService()
+    )
+
+
+def settle(m: TileMap, timeout: float = 10) -> None:
+    """ Draws frames until every tile of the grid has its image. """
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        m.draw()
+        if all(isinstance(tile, Tile) and tile.loaded for tile in m.narray.flat):
+            return
+        time.sleep(0.01)
+    raise AssertionError("the tiles were not loaded")
+
+
+def uncovered(m: TileMap, step: int = 50) -> list:
+    """ Returns the points of the window (sampled every 'step' pixels) which no loaded tile covers. """
+    rects = [
+        pygame.Rect(round(tile.position.x * m.scale), round(tile.position.y * m.scale), round(tile.size * m.scale), round(tile.size * m.scale))
+        for tile in m.narray.flat if isinstance(tile, Tile) and tile.loaded
+    ]
+    return [
+        (x, y) for x in range(0, m.w, step) for y in range(0, m.h, step)
+        if not any(rect.collidepoint(x, y) for rect in rects)
+    ]
+
+
+def test_drag_after_growing_the_window(tileserver):
+    m = new_map(tileserver())
+    settle(m)
+
+    pygame.display.set_mode((1300, 900))
+    settle(m)
+    assert m.narray.shape == (6, 8)
+
+    for _ in range(30):
+        m.on_drag((-20, -15))
+        m.draw()
+    settle(m)
+
+    assert uncovered(m) == []
+    m.close()
+
+
+def test_resize_keeps_the_tiles_in_place(tileserver):
+    m = new_map(tileserver())
+    settle(m)
+    before = m.narray.copy()
+
+    pygame.display.set_mode((300, 200))
+    m.draw()
+    assert m.narray.shape == (3, 4)
+    assert all(m.narray[row, col] is before[row, col] for row in range(3) for col in range(4))
+
+    pygame.display.set_mode((600, 400))
+    settle(m)
+    assert m.narray.shape == before.shape
+    ## The tiles which came back are at the same place as before, the ones kept are the same objects
+    assert [(tile.x, tile.y, tile.position.x, tile.position.y) for tile in m.narray.flat] == \
+           [(tile.x, tile.y, tile.position.x, tile.position.y) for tile in before.flat]
+    assert m.narray[0, 0] is before[0, 0]
+    assert uncovered(m) == []
+    m.close()
+
+
+def test_idle_frames_at_a_fractional_scale_scale_nothing(tileserver, monkeypatch):
+    pygame.display.set_mode((1920, 1080))
+    m = new_map(tileserver())
+    m.zoom_by(0.72, (960, 540))
+    m.zoom_ticks -= 1000
+    settle(m)
+
+    ## Level 9.53 is shown with the tiles of level 10 at scale 0.72, more tiles than DEFAULT_SCALED_CACHE_SIZE
+    assert m.mapconfig.zoom == 10 and m.scale == pytest.approx(0.72)
+    assert m.narray.size == 104
+    m.draw()
+
+    calls = []
+    smoothscale = pygame.transform.smoothscale
+    monkeypatch.setattr(pygame.transform, "smoothscale", lambda *args: calls.append(args) or smoothscale(*args))
+    for _ in range(20):
+        m.draw()
+
+    assert calls == []
+    assert uncovered(m) == []
+    m.close()
+
+
+@pytest.mark.parametrize("factor", [1.3, 0.6, 2.5])
+def test_settled_zoom_keeps_the_anchor_in_place(tileserver, factor):
+    m = new_map(tileserver())
+    settle(m)
+    anchor = (400, 150)
+    coordinates = m.longitude_latitude_of_px(*anchor)
+
+    m.zoom_by(factor, anchor)
+    m.zoom_ticks -= 1000
+    settle(m)
+
+    level = 10 + math.log2(factor)
+    assert m.mapconfig.zoom == round(level)
+    assert m.scale == pytest.approx(2 ** (level - round(level)))
+    px, py = m.px_of_longitude_latitude(coordinates.longitude, coordinates.latitude)
+    assert (px, py) == (pytest.approx(anchor[0], abs = 1), pytest.approx(anchor[1], abs = 1))
+    assert uncovered(m) == []
+    m.close()
+
+
+def test_rotated_map_is_rotated_once_while_panning(tileserver, monkeypatch):
+    m = new_map(tileserver(), bearing = 30)
+    settle(m)
+
+    rotations = []
+    rotate = pygame.transform.rotate
+    monkeypatch.setattr(pygame.transform, "rotate", lambda surface, angle: rotations.append(angle) or rotate(surface, angle))
+
+    ## Panned by less than the margin around the composed surface
+    for _ in range(10):
+        m.on_drag((7, -5))
+        m.draw()
+    assert rotations == []
+
+    m.set_bearing(45)
+    settle(m)
+    m.draw()
+    assert rotations and set(rotations) == {45}
+    m.close()
+
+
+def test_rotation_turns_the_map_around_the_center(tileserver):
+    m = new_map(tileserver())
+    settle(m)
+    cx, cy = m.w // 2, m.h // 2
+    offsets = [(50, 30), (-120, 80), (150, -150), (-7, -33)]
+
+    m.window.fill((0, 0, 0))
+    m.draw()
+    before = m.window.copy()
+    coordinates = [m.longitude_latitude_of_px(cx + dx, cy + dy) for dx, dy in offsets]
+    center = m.world_of_px(cx, cy)
+
+    ## East is at the top of the window
+    m.set_bearing(90)
+    settle(m)
+    m.window.fill((0, 0, 0))
+    m.draw()
+
+    assert m.world_of_px(cx, cy) == pytest.approx(center, abs = 1e-9)
+    for (dx, dy), coordinate in zip(offsets, coordinates):
+        assert m.window.get_at((cx + dy, cy - dx)) == before.get_at((cx + dx, cy + dy))
+        px, py = m.px_of_longitude_latitude(coordinate.longitude, coordinate.latitude)
+        assert (px, py) == pytest.approx((cx + dy, cy - dx), abs = 1.5)
+    m.close()
@@ -0,0 +1,141 @@
+import io
+import threading
+import time
+
+import pygame
+import pytest
+
+from core.models import MapConfig, Coordinate, Tile, TileKey
+from core.tileservice import TileService
+from tilemap import TileMap
+from tools.tileserver import tile_png
+
+pytestmark = pytest.mark.usefixtures("window")
+
+
+def new_map(url: str) -> TileMap:
+    return TileMap(
+        MapConfig(token = "t{k}", url = url, coordinates = Coordinate(longitude = 6.13, latitude = 49.61), zoom = 10),
+        service = TileService()
+    )
+
+
+def run_threads(count: int, target) -> list:
+    """ Runs target(i) in 'count' threads at once, returns the exceptions they raised. """
+    errors = []
+    start = threading.Barrier(count)
+
+    def run(i):
+        start.wait()
+        try:
+            target(i)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target = run, args = (i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return errors
+
+
+def test_create_tile_is_reentrant(tileserver):
+    m = new_map(tileserver())
+    config = m.mapconfig
+    before = (config.x, config.y)
+    stop = threading.Event()
+    wrong = []
+
+    def settle():
+        ## The zoom level changes while the workers are creating tiles
+        while not stop.is_set():
+            config.zoom = 21 - config.zoom
+
+    def create(i):
+        for j in range(6):
+            key = TileKey(10 + (i + j) % 2, 500 + i, 300 + j)
+            tile = m.create_tile(0, 0, key)
+            ## The image which was fetched and stored is the one of the tile's key (it shows zoom/X/Y)
+            expected = pygame.image.load(io.BytesIO(tile_png(config.tilesize, *key)), "tile.png")
+            if (tile.zoom, tile.x, tile.y) != key or tile.image is not m.tilestore.get(m.layers.composite_key(*key)) \
+                    or pygame.image.tobytes(tile.image, "RGB") != pygame.image.tobytes(expected, "RGB"):
+                wrong.append(key)
+
+    toggler = threading.Thread(target = settle)
+    toggler.start()
+    try:
+        assert run_threads(16, create) == []
+    finally:
+        stop.set()
+        toggler.join()
+
+    assert wrong == []
+    assert (config.x, config.y) == before
+    m.close()
+
+
+def test_grid_tiles_keep_the_zoom_they_were_requested_for(tileserver):
+    m = new_map(tileserver())
+    x, y = m.mapconfig.x + 7, m.mapconfig.y + 7
+
+    ## The zoom level settles while the worker is loading the tile
+    m.mapconfig.zoom = 11
+    m.load_tile_thread(x, y, 10)
+
+    ## The workers loading the grid publish their images too
+    published = [m.finished.get(timeout = 10) for _ in range(m.finished.qsize())]
+    (tile, zoom), = [args for function, args in published if function == m.place_tile]
+    assert (tile.zoom, tile.x, tile.y, zoom) == (10, x, y, 10)
+    assert tile.image is m.tilestore.get(m.layers.composite_key(10, x, y))
+    assert m.layers.composite_key(11, x, y) not in m.tilestore
+    m.close()
+
+
+def test_workers_only_publish_changes(tileserver):
+    """ Workers loading and composing tiles while the map is drawn rotated and zooming. """
+    m = new_map(tileserver())
+    main = threading.get_ident()
+    changed_by = set()
+
+    ## Everything changing what the frames read must run on the thread drawing them
+    for name in ("place_tile", "set_tile_image", "forget_drawn"):
+        function = getattr(m, name)
+        def wrapped(*args, function = function):
+            changed_by.add(threading.get_ident())
+            return function(*args)
+        setattr(m, name, wrapped)
+
+    m.set_bearing(30)
+    stop = threading.Event()
+
+    def work(i):
+        while not stop.is_set():
+            for tile in list(m.narray.flat):
+                if isinstance(tile, Tile):
+                    m.recompose_tile_thread(tile)
+                    m.load_pending_tile_thread(tile)
+                    m.load_tile_thread(tile.x, tile.y, tile.zoom)
+            time.sleep(0.001)
+
+    workers = threading.Thread(target = lambda: errors.extend(run_threads(8, work)))
+    errors = []
+    workers.start()
+
+    end = time.monotonic() + 2
+    frame = 0
+    while time.monotonic() < end:
+        if frame % 20 == 0:
+            m.zoom_by(1.02 if frame % 40 else 1 / 1.02, (300, 200))
+        m.draw()
+        frame += 1
+
+    stop.set()
+    workers.join()
+    m.publish_tiles()
+
+    assert errors == []
+    assert changed_by == {main}
+    assert all(isinstance(tile, Tile) and tile.loaded for tile in m.narray.flat)
+    m.close()
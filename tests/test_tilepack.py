@@ -0,0 +1,146 @@
+import io
+
+import pygame
+import pytest
+
+from core.layers import LayerStack
+from core.models import Layer
+from core.tilepack import TilePack, export_pack, import_pack
+from core.tilestore import TileStore, surface_bytes
+
+
+LAYER = Layer(name = "base", url = "http://tiles.test/{z}/{x}/{y}.png")
+
+
+def tile(color) -> pygame.Surface:
+    surface = pygame.Surface((256, 256))
+    surface.fill(color)
+    return surface
+
+
+def png(surface) -> bytes:
+    data = io.BytesIO()
+    pygame.image.save(surface, data, "tile.png")
+    return data.getvalue()
+
+
+def test_shared_images_are_counted_once(tmp_path):
+    source = TileStore()
+    sea = tile("blue")
+    for x in range(8):
+        source.put((3, x, 0, "base"), sea.copy())
+    source.put((3, 0, 1, "base"), tile("green"))
+
+    path = str(tmp_path / "region.pack")
+    assert export_pack(path, source, LAYER, 256, [3]) == (9, 2)
+
+    store = TileStore()
+    assert import_pack(path, store, LAYER, 256) == 9
+    assert len(store) == 9
+    sea, land = store.get((3, 0, 0, "base")), store.get((3, 0, 1, "base"))
+    assert store.get((3, 7, 0, "base")) is sea
+    assert store.size == surface_bytes(sea) + surface_bytes(land)
+
+    ## The memory of the sea is freed with its last tile
+    for x in range(7):
+        store.discard((3, x, 0, "base"))
+    assert store.size == surface_bytes(sea) + surface_bytes(land)
+    store.put((3, 7, 0, "base"), land)
+    assert store.size == surface_bytes(land)
+    store.discard((3, 0, 1, "base"))
+    assert store.size == surface_bytes(land)
+    store.discard((3, 7, 0, "base"))
+    assert store.size == 0
+
+
+def test_shared_images_fit_the_budget(tmp_path):
+    source = TileStore()
+    for x in range(64):
+        source.put((6, x, 0, "base"), tile("blue"))
+
+    path = str(tmp_path / "sea.pack")
+    export_pack(path, source, LAYER, 256, [6])
+
+    ## 64 tiles of one image fit a budget of two images
+    store = TileStore(budget = 2 * surface_bytes(tile("blue")))
+    assert import_pack(path, store, LAYER, 256) == 64
+    assert len(store) == 64
+
+
+def test_missing_pack(tmp_path):
+    path = tmp_path / "missing.pack"
+
+    with pytest.raises(ValueError):
+        import_pack(str(path), TileStore(), LAYER, 256)
+    assert not path.exists()
+
+
+def test_pack_of_another_layer(tmp_path):
+    source = TileStore()
+    source.put((0, 0, 0, "base"), tile("blue"))
+    path = str(tmp_path / "base.pack")
+    export_pack(path, source, LAYER, 256, [0])
+
+    with pytest.raises(ValueError):
+        import_pack(path, TileStore(), LAYER, 512)
+    with pytest.raises(ValueError):
+        import_pack(path, TileStore(), Layer(name = "base", url = "http://other.test/{z}/{x}/{y}.png"), 256)
+
+
+def test_import_only_reads_the_region(tmp_path):
+    source = TileStore()
+    for zoom in (4, 5):
+        for x in range(2 ** zoom):
+            source.put((zoom, x, 5 * 2 ** (zoom - 4), "base"), tile((zoom, x, 0)))
+
+    path = str(tmp_path / "strip.pack")
+    export_pack(path, source, LAYER, 256, [4, 5])
+
+    store = TileStore()
+    ## Luxembourg is in the tile 8/5 of zoom level 4 and 16/10 of zoom level 5
+    assert import_pack(path, store, LAYER, 256, zooms = [5], bounds = (5.8, 49.4, 6.5, 50.2)) == 1
+    assert store.keys() == [(5, 16, 10, "base")]
+    assert store.get((5, 16, 10, "base")).get_at((0, 0))[:3] == (5, 16, 0)
+
+    assert import_pack(path, TileStore(), LAYER, 256, bounds = (5.8, 49.4, 6.5, 50.2)) == 2
+    assert import_pack(path, TileStore(), LAYER, 256, zooms = [4]) == 16
+    assert import_pack(path, TileStore(), LAYER, 256, zooms = [7]) == 0
+
+
+def test_pack_is_read_before_fetching(tmp_path):
+    source = TileStore()
+    sea = tile("blue")
+    for x in range(4):
+        source.put((2, x, 0, "base"), sea)
+    path = str(tmp_path / "sea.pack")
+    export_pack(path, source, LAYER, 256, [2])
+
+    fetched = []
+    def fetch(url):
+        fetched.append(url)
+        return io.BytesIO(png(tile("red")))
+
+    store = TileStore()
+    stack = LayerStack([LAYER], store, fetch, 256, "token")
+    pack = TilePack(path, LAYER, 256)
+    stack.add_pack("base", pack)
+    try:
+        ## Nothing is read ahead
+        assert len(store) == 0
+
+        first, second = stack.compose(2, 0, 0), stack.compose(2, 1, 0)
+        assert first.get_at((0, 0)) == pygame.Color("blue")
+        ## The tiles showing the same image share it
+        assert second is first
+        assert store.size == surface_bytes(first)
+        assert fetched == []
+
+        ## A tile which is not in the pack is fetched
+        assert stack.compose(2, 0, 1).get_at((0, 0)) == pygame.Color("red")
+        assert fetched == ["http://tiles.test/2/0/1.png"]
+    finally:
+        pack.close()
+        stack.executor.shutdown()
+
+    with pytest.raises(ValueError):
+        TilePack(path, LAYER, 512)
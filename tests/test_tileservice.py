@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from core.models import MapConfig, Coordinate, Layer
+from core.tileservice import TileService
+from tilemap import TileMap
+
+
+pytestmark = pytest.mark.usefixtures("window")
+
+
+def new_map(url: str, service: TileService, tilesize: int = 512, layers: list = None) -> TileMap:
+    return TileMap(
+        MapConfig(token = "", url = url, tilesize = tilesize, coordinates = Coordinate(longitude = 6.13, latitude = 49.61), zoom = 10),
+        layers = layers,
+        service = service
+    )
+
+
+def wait_loaded(tilemap: TileMap, timeout: float = 10) -> None:
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        tilemap.draw()
+        if all(tile.loaded for tile in tilemap.narray.flat):
+            return
+        time.sleep(0.02)
+    raise AssertionError("the tiles were not loaded")
+
+
+def test_maps_with_other_base_urls_share_a_service(tileserver):
+    streets, satellite = tileserver(), tileserver()
+    service = TileService()
+
+    a = new_map(streets, service)
+    b = new_map(satellite, service)
+    wait_loaded(a)
+    wait_loaded(b)
+
+    tile_a, tile_b = a.narray[1, 1], b.narray[1, 1]
+    key_a = a.layers.composite_key(tile_a.zoom, tile_a.x, tile_a.y)
+    key_b = b.layers.composite_key(tile_b.zoom, tile_b.x, tile_b.y)
+    assert key_a[:3] == key_b[:3] and key_a != key_b
+    assert service.store.get(key_a) is tile_a.image
+    assert service.store.get(key_b) is tile_b.image
+
+    a.close()
+    b.close()
+
+
+def test_maps_with_other_tile_sizes_share_a_service(tileserver):
+    url = tileserver()
+    service = TileService()
+
+    a = new_map(url, service, 512)
+    b = new_map(url, service, 256)
+    wait_loaded(a)
+    wait_loaded(b)
+
+    for tilemap, size in ((a, 512), (b, 256)):
+        for tile in tilemap.narray.flat:
+            assert tile.image.get_size() == (size, size)
+
+    a.close()
+    b.close()
+
+
+def test_layers_showing_the_same_share_their_images(tileserver):
+    url, overlay = tileserver(), tileserver()
+    service = TileService()
+
+    a = new_map(url, service, layers = [Layer(name = "weather", url = overlay, opacity = 0.5)])
+    b = new_map(url, service, layers = [Layer(name = "clouds", url = overlay, opacity = 0.5)])
+
+    weather, clouds = a.layers.get_layer("weather"), b.layers.get_layer("clouds")
+    assert a.layers.store_name(weather) == b.layers.store_name(clouds)
+    assert a.layers.store_name(a.layers.get_layer("base")) == b.layers.store_name(b.layers.get_layer("base"))
+
+    a.close()
+    b.close()
+
+
+def test_store_names_are_unique_per_url_and_tile_size():
+    service = TileService()
+    names = [service.register_layers([Layer(name = "base", url = url)], size)["base"]
+             for url, size in (("a", 512), ("b", 512), ("a", 256), ("a", 512))]
+
+    assert names == ["base", "base#2", "base#3", "base"]
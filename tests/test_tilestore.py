@@ -0,0 +1,78 @@
+import pygame
+
+from core.tilestore import TileStore, surface_bytes
+
+
+def image() -> pygame.Surface:
+    return pygame.Surface((16, 16))
+
+
+TILE = surface_bytes(image())
+
+
+def test_budget_and_low_watermark():
+    store = TileStore(budget = 10 * TILE)
+    for x in range(10):
+        store.put((5, x, 0), image())
+    assert len(store) == 10 and store.size == 10 * TILE
+
+    ## Going over the budget evicts down to the low watermark (90%), not just one tile
+    store.put((5, 10, 0), image())
+    assert store.size <= 9 * TILE
+    assert len(store) == 9
+    assert (5, 10, 0) in store
+
+
+def test_tiles_far_from_the_view_are_evicted_first():
+    store = TileStore(budget = 8 * TILE)
+    ## Zoom level 5, centered on the tile (2, 0) and showing it
+    store.add_view(lambda: (5, 2.5, 0.5, {(5, 2, 0)}))
+
+    for x in range(8):
+        store.put((5, x, 0), image())
+    ## Right at the center, but a zoom level away counts as 4 tiles further
+    store.put((6, 5, 1), image())
+
+    ## Two tiles are evicted (down to 90% of the budget): the tile 7 (5 tiles away) and the one of zoom level 6
+    ## (4.35), the tile 6 (4 tiles away) is kept
+    assert sorted(key[1] for key in store.keys() if key[0] == 5) == [0, 1, 2, 3, 4, 5, 6]
+    assert (6, 5, 1) not in store
+
+    ## The shown tile is kept even if it is the furthest one
+    store = TileStore(budget = 2 * TILE)
+    store.add_view(lambda: (5, 9.5, 0.5, {(5, 0, 0)}))
+    for x in range(4):
+        store.put((5, x, 0), image())
+    assert (5, 0, 0) in store and (5, 3, 0) in store
+
+
+def test_acquired_tiles_are_kept_until_released():
+    store = TileStore(budget = 2 * TILE)
+    store.acquire([(5, 0, 0)])
+    store.acquire([(5, 0, 0)])
+    store.put((5, 0, 0, "base"), image())
+    store.put((5, 0, 0, "weather"), image())
+    store.put((5, 1, 0, "base"), image())
+
+    ## All images of the acquired tile are kept, whatever follows (zoom, X, Y) in their key
+    assert store.keys() == [(5, 0, 0, "base"), (5, 0, 0, "weather")]
+
+    store.release([(5, 0, 0)])
+    store.put((5, 2, 0, "base"), image())
+    assert (5, 0, 0, "base") in store
+
+    store.release([(5, 0, 0)])
+    store.put((5, 3, 0, "base"), image())
+    assert store.size <= 2 * TILE
+    assert len(store) < 3
+
+
+def test_replacing_and_discarding_keep_the_size():
+    store = TileStore()
+    store.put((3, 1, 1), image())
+    store.put((3, 1, 1), pygame.Surface((32, 32)))
+    assert store.size == surface_bytes(pygame.Surface((32, 32)))
+
+    store.discard((3, 1, 1))
+    store.discard((3, 1, 1))
+    assert store.size == 0 and len(store) == 0
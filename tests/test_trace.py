@@ -0,0 +1,92 @@
+import types
+
+import pygame
+import pytest
+
+from core import trace
+from core.models import MapConfig, Coordinate
+from core.tileservice import TileService
+from tilemap import TileMap
+
+
+def recorded_map(tilesize: int):
+    config = MapConfig(token = "", tilesize = tilesize, coordinates = Coordinate(longitude = 6.13, latitude = 49.61), zoom = 12, bearing = -30)
+    return types.SimpleNamespace(w = 640, h = 480, mapconfig = config, scale = 0.75, world_of_px = lambda px, py: (0.5, 0.25))
+
+
+def test_trace_records_the_map(tmp_path):
+    path = str(tmp_path / "pan.trace")
+    recorder = trace.TraceRecorder(path, recorded_map(512))
+    recorder.record([pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos = (10, 20), button = 1)])
+    recorder.record([pygame.event.Event(pygame.KEYDOWN, key = pygame.K_PLUS)])
+    recorder.close()
+
+    header, frames = trace.read_trace(path)
+
+    assert (header.size, header.zoom, header.bearing, header.tilesize) == ((640, 480), 12, -30, 512)
+    assert header.world == (0.5, 0.25) and header.scale == 0.75
+    assert header.longitude == 0 and header.latitude == pytest.approx(66.5132604)
+    assert [[event.kind for event in frame] for frame in frames] == [[trace.MOUSEBUTTONDOWN, trace.FRAME], [trace.KEYDOWN, trace.FRAME]]
+    assert frames[0][0][2:5] == (10, 20, 1)
+    assert frames[1][0].value == pygame.K_PLUS
+
+
+def test_traces_without_tile_size(tmp_path):
+    path = tmp_path / "old.trace"
+    path.write_bytes(trace.HEADER_V1.pack(trace.MAGIC_V1, 800, 600, 2.35, 48.85, 10, 0) + trace.RECORD.pack(5, trace.FRAME, 0, 0, 0, 0, 0))
+
+    header, frames = trace.read_trace(str(path))
+
+    assert header.size == (800, 600) and header.tilesize is None
+    assert len(frames) == 1
+
+
+def test_traces_with_the_start_coordinates(tmp_path):
+    path = tmp_path / "v2.trace"
+    path.write_bytes(trace.HEADER_V2.pack(trace.MAGIC_V2, 800, 600, 2.35, 48.85, 10, 0, 256) + trace.RECORD.pack(5, trace.FRAME, 0, 0, 0, 0, 0))
+
+    header, frames = trace.read_trace(str(path))
+
+    assert header == trace.TraceHeader((800, 600), 2.35, 48.85, 10, 0, 256)
+    assert header.world is None and header.scale == 1.0
+
+
+@pytest.mark.usefixtures("window")
+@pytest.mark.parametrize("bearing", [0, 30])
+def test_replay_starts_where_the_recording_did(tmp_path, tileserver, bearing):
+    from tools.replay import Replay
+
+    url = tileserver()
+    m = TileMap(MapConfig(token = "", url = url, tilesize = 256, coordinates = Coordinate(longitude = 6.13, latitude = 49.61), zoom = 10, bearing = bearing), service = TileService())
+    ## Moved away from mapconfig.coordinates, which only says where the map was created
+    m.on_drag((-170, 95))
+    m.zoom_by(1.3, (200, 150))
+    m.settle_zoom()
+
+    path = str(tmp_path / "moved.trace")
+    trace.TraceRecorder(path, m).close()
+    header, frames = trace.read_trace(path)
+    replay = Replay(header, url)
+
+    assert replay.map.mapconfig.zoom == m.mapconfig.zoom
+    assert replay.map.scale == pytest.approx(m.scale)
+    size = 2 ** m.mapconfig.zoom * 256
+    for px, py in [(0, 0), (300, 200), (599, 399)]:
+        assert replay.map.world_of_px(px, py) == pytest.approx(m.world_of_px(px, py), abs = 1 / size)
+    m.close()
+    replay.map.close()
+
+
+@pytest.mark.usefixtures("window")
+def test_replay_times_the_fetches(tileserver):
+    from tools.replay import Replay
+
+    replay = Replay(trace.TraceHeader((600, 400), 6.13, 49.61, 10, 0, 256), tileserver())
+    replay.profiler.take()
+
+    ## Dragged beyond the grid, the new tiles are fetched by the frame
+    replay.map.on_drag((-900, 0))
+
+    stages = replay.profiler.take()
+    assert stages.get("fetch_tile", 0) > 0
+    replay.map.close()
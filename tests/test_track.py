@@ -0,0 +1,70 @@
+import pygame
+import pytest
+
+from core.models import MapConfig, Coordinate
+from core.tileservice import TileService
+from features import track as track_module
+from features.track import Track
+from tilemap import TileMap
+
+
+pytestmark = pytest.mark.usefixtures("window")
+
+
+def new_map(url: str) -> TileMap:
+    return TileMap(
+        MapConfig(token = "", url = url, tilesize = 256, coordinates = Coordinate(longitude = 6.13, latitude = 49.61), zoom = 14),
+        service = TileService()
+    )
+
+
+def test_append_grows_the_arrays_and_trims_old_fixes(tileserver):
+    m = new_map(tileserver())
+    track = Track(m, max_age = 10, capacity = 4)
+
+    for i in range(100):
+        track.append(6.13 + i * 1e-4, 49.61, timestamp = i)
+
+    ## The fixes of the last 10 seconds (89..99)
+    assert len(track) == 11
+    assert track.times[track.start:track.end].tolist() == list(range(89, 100))
+    assert track.points[0].tolist() == pytest.approx([6.13 + 89e-4, 49.61])
+    ## The kept fixes are moved to the front instead of growing the arrays forever
+    assert len(track.times) <= 32
+    m.close()
+
+
+def test_only_new_segments_are_drawn(tileserver, monkeypatch):
+    m = new_map(tileserver())
+    track = Track(m, color = "magenta", width = 3)
+    drawn = []
+    draw_segments = track_module.draw_segments
+    monkeypatch.setattr(track_module, "draw_segments", lambda surface, color, width, points, area: drawn.append(len(points)) or draw_segments(surface, color, width, points, area))
+
+    track.extend([6.125, 6.13, 6.135], [49.61, 49.611, 49.61], [0, 1, 2])
+    m.draw()
+    track.draw()
+    assert drawn == [3]
+
+    ## Nothing new, the overlay is only blitted
+    track.draw()
+    assert drawn == [3]
+
+    ## From the last drawn fix to the new one
+    track.append(6.135, 49.608, 3)
+    m.draw()
+    track.draw()
+    assert drawn == [3, 2]
+
+    ## The new segment is on the window, where the map puts its fixes
+    a = m.px_of_longitude_latitude(6.135, 49.61)
+    b = m.px_of_longitude_latitude(6.135, 49.608)
+    middle = (round((a[0] + b[0]) / 2), round((a[1] + b[1]) / 2))
+    assert m.window.get_at(middle) == pygame.Color("magenta")
+
+    ## A new zoom level draws everything again
+    m.zoom_by(2, (m.w / 2, m.h / 2))
+    m.settle_zoom()
+    track.draw()
+    assert drawn == [3, 2, 4]
+    m.close()
@@ -0,0 +1,55 @@
+import os
+import tracemalloc
+
+import numpy
+import pytest
+
+from core.trackarchive import TrackArchive, import_csv, import_gpx
+
+
+def write_gpx(path, points: int) -> None:
+    with open(path, "w") as file:
+        file.write('<?xml version="1.0"?>\n<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">\n')
+        file.write('<metadata><name>test</name></metadata>\n<trk><name>a</name><trkseg>\n')
+        for i in range(points):
+            file.write(f'<trkpt lat="{49 + i * 1e-6:.6f}" lon="{6 + i * 1e-6:.6f}"><ele>300</ele>'
+                       f'<time>2024-01-01T00:00:{i % 60:02d}Z</time></trkpt>\n')
+        file.write('</trkseg></trk>\n<rte><rtept lat="49.5" lon="6.5"/><rtept lat="49.6" lon="6.6"/></rte>\n</gpx>\n')
+
+
+def test_import_gpx(tmp_path):
+    write_gpx(tmp_path / "day.gpx", 3)
+    archive = import_gpx([str(tmp_path / "day.gpx")], str(tmp_path / "archive"))
+
+    assert archive.names == ["day.gpx:1", "day.gpx:2"]
+    assert numpy.allclose(archive.points(0), [[6, 49], [6.000001, 49.000001], [6.000002, 49.000002]])
+    assert numpy.allclose(archive.point_times(0) - 1704067200, [0, 1, 2])
+    assert numpy.allclose(archive.points(1), [[6.5, 49.5], [6.6, 49.6]])
+    assert numpy.isnan(archive.point_times(1)).all()
+
+
+def test_import_gpx_streams(tmp_path):
+    write_gpx(tmp_path / "long.gpx", 50000)
+
+    tracemalloc.start()
+    try:
+        archive = import_gpx([str(tmp_path / "long.gpx")], str(tmp_path / "archive"), chunk = 1024)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert len(archive.points(0)) == 50000
+    ## The parsed points are dropped, keeping them would take several MB
+    assert peak < 2_000_000
+
+
+def test_failed_import_leaves_no_archive(tmp_path):
+    with open(tmp_path / "bad.csv", "w") as file:
+        file.write("lon,lat\n6.1,49.6\n6.2,49.7\nsix,49.8\n")
+
+    with pytest.raises(ValueError):
+        import_csv([str(tmp_path / "bad.csv")], str(tmp_path / "archive"))
+
+    assert not os.path.exists(tmp_path / "archive" / "coordinates.f8")
+    with pytest.raises(ValueError, match = "not a track archive"):
+        TrackArchive(str(tmp_path / "archive"))
@@ -1,29 +1,33 @@
 import numpy
 import pygame
 import math
-from urllib.request import urlopen
 import io
+import queue
+from typing import List
+from collections import OrderedDict
+
+from core.constants import (
+    DEFAULT_SCALED_CACHE_SIZE,
+    DEFAULT_ZOOM_SETTLE_MS,
+    DEFAULT_ROTATION_MARGIN,
+    DEFAULT_HIT_TOLERANCE,
+    DEFAULT_FAILED_RETRY_MS,
+    DEFAULT_FALLBACK_LEVELS,
+    MAX_ZOOM
+)
+from core.models import MapConfig, Tile, TileKey, Coordinate, Position, Layer
+from core.layers import LayerStack
+from core.tilestore import TileStore
+from core.fetch import TileFetcher, TileFetchError
+from core.tileservice import TileService
+from core import tilepack
+from core.utility import tile_xy_from_lonlat, tile_top_left_lon_lat_from_xy, tile_corner_coordinates, latlng_from_px, px_from_latlng, shift
 
-from core.models import MapConfig, Tile, Coordinate, Position
-from core.utility import tile_xy_from_lonlat, tile_corner_coordinates, latlng_from_px, shift
-
-from concurrent import futures
 
 
 class TileMap():
-    def __init__(self, mapconfig: MapConfig, debug_tileraster: bool = False) -> None:
+    def __init__(self, mapconfig: MapConfig, debug_tileraster: bool = False, layers: List[Layer] = None, tilestore: TileStore = None, fetcher: TileFetcher = None, service: TileService = None) -> None:
         self.mapconfig: MapConfig = mapconfig
-        self.mapconfig.tilesarray = numpy.zeros(
-                (
-                self.mapconfig.tilesarray_size,
-                self.mapconfig.tilesarray_size
-                ),
-                dtype= Tile
-            )
-
-        ## +- center of the array minus loss by starting at the top left corner of the window
-        self.mapconfig.array_x = int(self.mapconfig.tilesarray_size / 1.8)
-        self.mapconfig.array_y = int(self.mapconfig.tilesarray_size / 1.8)
         
         self.mapconfig.x, self.mapconfig.y = tile_xy_from_lonlat(self.mapconfig.coordinates.longitude, self.mapconfig.coordinates.latitude, self.mapconfig.zoom)
 
@@ -32,9 +36,65 @@ class TileMap():
         self.mx, self.my = math.ceil(self.w / self.mapconfig.tilesize), math.ceil(self.h / self.mapconfig.tilesize)
 
         self.narray = numpy.zeros((self.my+2, self.mx+2), dtype = Tile) # +2 to cover if one tile is a bit over the edge and we already have to draw the next one
+
+        ## All maps share the tile store, the fetcher and the workers of one service (TileService.shared() by default)
+        self.service: TileService = service if service is not None else TileService.shared()
+        ## Images of the tiles of all zoom levels, keyed by (zoom, X, Y, ...), the grid only refers to those it shows
+        self.tilestore: TileStore = tilestore if tilestore is not None else self.service.store
+        ## The tiles (zoom, X, Y) of the grid, acquired in the tile store so they are not evicted
+        self.resident: set = set()
+        self.executor = self.service.executor
+
+        self.fetcher: TileFetcher = fetcher if fetcher is not None else self.service.fetcher
+        ## The url of the tiles, formatted with (zoom, X, Y) so the workers never touch the map config
+        self.url_template: str = self.mapconfig.url_template()
+        ## Changes made by the workers (new tiles and images), applied by the thread drawing the map (see 'publish')
+        self.finished = queue.SimpleQueue()
+        ## Tiles (zoom, X, Y) shown with a placeholder because they could not be fetched, they are tried again later
+        self.failed: set = set()
+        self.failed_ticks: int = 0
+        self.placeholder = None
+
+        ## The map (mapconfig.url) is the bottom layer, the other layers are composed on top of it
+        ## A layer named "base" replaces it (e.g. to draw the map from vector tiles)
+        layers = list(layers or [])
+        if not any(layer.name == "base" for layer in layers):
+            layers.insert(0, Layer(name = "base", url = self.mapconfig.url))
+
+        ## 'fetch_tile' is looked up when it is called, so it can be replaced on the map (e.g. timed by tools/replay.py)
+        self.layers = LayerStack(
+            layers,
+            self.tilestore,
+            lambda url: self.fetch_tile(url),
+            self.mapconfig.tilesize,
+            self.mapconfig.token,
+            self.service
+        )
+
+        ## Fractional zoom: the window shows the tiles of the (integer) zoom level scaled by 'self.scale'
+        ## A window pixel p shows the map pixel (p - self.scale_offset) / self.scale (the offset is only used while zooming)
+        self.scale: float = 1.0
+        self.scale_offset = (0.0, 0.0)
+        self.zooming: bool = False
+        self.zoom_ticks: int = 0
+        ## Smoothscaled tile images for the current fractional level, keyed by (zoom, X, Y, size)
+        ## It holds twice the grid (the grid and the tiles dragged out of it), see 'rebuild_map'
+        self.scaledcache: OrderedDict = OrderedDict()
+        self.scaledcache_size: int = DEFAULT_SCALED_CACHE_SIZE
+        ## Last frame of a zoom animation, shown below the tiles which are still loading -> (surface, (x, y))
+        self.backdrop = None
+        self.drag_remainder = (0.0, 0.0)
+
+        ## Rotation (mapconfig.bearing): the visible tiles are composed into one surface which is rotated once
+        ## -> (key, rotated surface, (reference tile, its x position, its y position) when it was composed)
+        self.rotated = None
         
 
-        self.build_map()
+        ## Registered once the map is set up, the store may ask for the view from another map's thread
+        self.tilestore.add_view(self.store_view)
+
+        size = self.mapconfig.tilesize
+        self.rebuild_map(self.mapconfig.x * size, self.mapconfig.y * size)
 
         self.debug_tileraster = debug_tileraster
 
@@ -46,71 +106,307 @@ class TileMap():
     
 
 
-    def build_map(self):
-        x = 0
-        y = 0
-        
-        array_x = 0
-        array_y = 0
+    def build_map(self, offset_x: int = 0, offset_y: int = 0):
+        """
+            Fills the whole grid, starting with the tile (mapconfig.x, mapconfig.y) at (offset_x, offset_y).
+            The tiles are put into the grid right away and their images are loaded in the background, so the
+            user can already move the map around while they are loading.
 
-        tile_x = self.mapconfig.x
-        tile_y = self.mapconfig.y
+            :param offset_x [int] -- The x position of the top left tile (left of the visible part of the map)
+            :param offset_y [int] -- The y position of the top left tile (above the visible part of the map)
+        """
+        size = self.mapconfig.tilesize
 
-        th = {}
+        for (array_y, array_x), t in numpy.ndenumerate(self.narray):
+            tile = self.create_tile(
+                offset_x + array_x * size, offset_y + array_y * size,
+                TileKey(self.mapconfig.zoom, self.mapconfig.x + array_x, self.mapconfig.y + array_y), load = False
+            )
+            self.narray[array_y, array_x] = tile
 
-        #for i in range(self.my):
-        for row in self.narray:
-            for t in self.narray[0]:
-            #for n in range(self.mx):
-                #self.narray[array_y, array_x] = self.create_tile(posx = x, posy = y, lx = tile_x, ly = tile_y)
-                th[(array_y, array_x)] = [x, y, tile_x, tile_y]
-                x += self.mapconfig.tilesize
-                array_x += 1
-                tile_x += 1
-
-            x = 0
-            array_x = 1
-            tile_x = self.mapconfig.x
-            tile_y += 1
-            array_y += 1
-            y += self.mapconfig.tilesize
-
-
-        for i in range(len(th)):
-            executor = futures.ThreadPoolExecutor(20)
-            fut = [executor.submit(self.create_tile_thread, tile[0], tile[1], th[tile][0], th[tile][1], th[tile][2], th[tile][3]) for tile in th]
-            
+            if not tile.loaded:
+                self.request_tile_image(tile)
+
+
+    def request_tile_image(self, tile: Tile) -> None:
+        """ Loads the image of a tile created with 'load = False' in the background. """
+        self.executor.submit(self.load_pending_tile_thread, tile)
+
+
+    def request_recompose(self, tile: Tile) -> None:
+        """ Composes the image of a tile again in the background. """
+        self.executor.submit(self.recompose_tile_thread, tile)
+
+
+    def request_grid_tile(self, lx: int, ly: int, zoom: int) -> None:
+        """ Loads the tile (lx, ly) in the background and puts it into the grid once it is ready. """
+        self.executor.submit(self.load_tile_thread, lx, ly, zoom)
+
+
+    def load_pending_tile_thread(self, tile: Tile) -> None:
+        """
+            Loads the image of a tile which has been created with 'load = False'.
+
+            :param tile [Tile] -- The tile without an image
+        """
+        self.publish(self.set_tile_image, tile, self.load_tile_image(tile.x, tile.y, tile.zoom))
+
+
+    def load_tile_image(self, lx: int, ly: int, zoom: int):
+        """
+            Returns the image of a tile, from the tile store if possible, otherwise its layers are fetched and composed.
+
+            :param lx [int] -- The X value of the tile
+            :param ly [int] -- The Y value of the tile
+            :param zoom [int] -- The zoom level of the tile
+
+            :returns pygame.Surface
+        """
+        tile_image = self.tilestore.get(self.layers.composite_key(zoom, lx, ly))
+        if tile_image is None:
+            tile_image = self.compose_tile_image(lx, ly, zoom)
+
+        return tile_image
+
+
+    def compose_tile_image(self, lx: int, ly: int, zoom: int):
+        """
+            Fetches and composes the layers of a tile and puts the result into the tile store.
+            If a layer can not be fetched, the tile is composed without it (or a fallback image is used if the map
+            itself is missing) and it is tried again later (see 'retry_failed_tiles').
+
+            :returns pygame.Surface
+        """
+        key = (zoom, lx, ly)
+        store_key = self.layers.composite_key(zoom, lx, ly)
+
+        try:
+            ## Maps of the same service composing the tile at the same time get the same image
+            tile_image = self.service.once(("composite",) + store_key, self.layers.compose, zoom, lx, ly)
+        except TileFetchError as e:
+            self.failed.add(key)
+            return e.partial if e.partial is not None else self.fallback_image(lx, ly, zoom)
+
+        self.failed.discard(key)
+        self.tilestore.put(store_key, tile_image)
+
+        return tile_image
 
-    def create_tile_thread(self, array_y, array_x, posx, posy, lx = None, ly = None):
-        self.narray[array_y, array_x] = self.create_tile(posx, posy, lx, ly)
 
+    def fallback_image(self, lx: int, ly: int, zoom: int):
+        """
+            Returns an image to show instead of a tile which could not be fetched: the part of a stored tile of a lower
+            zoom level covering it (scaled up), or a placeholder.
+
+            :returns pygame.Surface
+        """
+        size = self.mapconfig.tilesize
+
+        for levels in range(1, DEFAULT_FALLBACK_LEVELS + 1):
+            part = size >> levels
+            if zoom - levels < 0 or part == 0:
+                break
+
+            parent = self.tilestore.get(self.layers.composite_key(zoom - levels, lx >> levels, ly >> levels))
+            if parent is not None:
+                rect = pygame.Rect((lx - ((lx >> levels) << levels)) * part, (ly - ((ly >> levels) << levels)) * part, part, part)
+                return pygame.transform.smoothscale(parent.subsurface(rect), (size, size))
+
+        if self.placeholder is None:
+            self.placeholder = pygame.Surface((size, size))
+            self.placeholder.fill(pygame.Color(224, 224, 224))
+            for i in range(0, size, size // 8):
+                pygame.draw.line(self.placeholder, pygame.Color(200, 200, 200), (i, 0), (i, size))
+                pygame.draw.line(self.placeholder, pygame.Color(200, 200, 200), (0, i), (size, i))
+
+        return self.placeholder
+
+
+    def retry_failed_tiles(self) -> None:
+        """
+            Tries again to fetch the tiles in the grid which could not be fetched.
+            The fetcher fails fast for hosts which are still down, so this costs nothing until they are back.
+        """
+        self.failed_ticks = pygame.time.get_ticks()
+        shown = set()
+
+        for tile in self.narray.flat:
+            if isinstance(tile, Tile) and tile.loaded:
+                key = (tile.zoom, tile.x, tile.y)
+                shown.add(key)
+                if key in self.failed:
+                    self.request_recompose(tile)
+
+        self.failed.intersection_update(shown)
+
+
+    def add_layer(self, layer: Layer) -> None:
+        """
+            Adds a layer on top of the others.
+
+            :param layer [Layer] -- The layer to add
+        """
+        self.layers.add(layer)
+        self.recompose_layer(layer.name)
+
+
+    def update_layer(self, name: str) -> None:
+        """
+            Fetches the tiles of one layer again (for example when the weather overlay has been updated).
+            Only that layer is fetched, the tiles are composed again with the cached images of the other layers.
 
-    def create_tile(self, posx, posy, lx = None, ly = None):
+            :param name [str] -- The name of the layer
+        """
+        self.layers.invalidate(name)
+        self.recompose_layer(name)
+
+
+    def set_layer_opacity(self, name: str, opacity: float) -> None:
+        """
+            Changes the opacity of a layer, the tiles are composed again without fetching anything.
+
+            :param name [str] -- The name of the layer
+            :param opacity [float] -- The new opacity (0 = invisible, 1 = opaque)
+        """
+        self.layers.get_layer(name).opacity = opacity
+        self.recompose_layer(name)
+
+
+    def update_tiles(self, name: str, keys) -> None:
+        """
+            Fetches some tiles of one layer again, for example the tiles of a heatmap in which points have been added.
+
+            :param name [str] -- The name of the layer
+            :param keys -- The tiles (zoom, X, Y) to update
+        """
+        keys = set(keys)
+        layer = self.layers.get_layer(name)
+        for key in keys:
+            self.tilestore.discard(self.layers.image_key(layer, *key))
+
+        self.recompose_layer(name, keys)
+
+
+    def export_pack(self, path: str, zooms, bounds = None, name: str = "base"):
+        """
+            Writes the tiles of a layer which are in the tile store into a pack file (see core.tilepack).
+
+            :param path [str] -- The pack file
+            :param zooms -- The zoom levels (e.g. range(8, 15))
+            :param bounds -- (west, south, east, north) in degrees, the whole world if None
+            :param name [str] -- The name of the layer
+
+            :returns int, int -- The number of tiles and of distinct images written
+        """
+        layer = self.layers.get_layer(name)
+        return tilepack.export_pack(path, self.tilestore, layer, self.mapconfig.tilesize, zooms, bounds, self.layers.store_name(layer))
+
+
+    def import_pack(self, path: str, name: str = "base", zooms = None, bounds = None) -> int:
+        """
+            Puts the tiles of a pack file into the tile store and shows them (see core.tilepack).
+
+            :param path [str] -- The pack file
+            :param name [str] -- The name of the layer the tiles are for
+
+            :raises ValueError -- If the pack holds the tiles of another url, style or tile size
+            :returns int -- The number of tiles imported
+        """
+        layer = self.layers.get_layer(name)
+        count = tilepack.import_pack(path, self.tilestore, layer, self.mapconfig.tilesize, zooms, bounds, self.layers.store_name(layer))
+        self.recompose_layer(name)
+
+        return count
+
+
+    def add_pack(self, path: str, name: str = "base") -> tilepack.TilePack:
+        """
+            Reads the tiles of a layer from a pack file when they are not in the tile store, before fetching them
+            (see core.tilepack.TilePack). Unlike 'import_pack' nothing is loaded ahead.
+
+            :param path [str] -- The pack file
+            :param name [str] -- The name of the layer the tiles are for
+
+            :raises ValueError -- If there is no pack at the path or it holds the tiles of another url, style or tile size
+            :returns core.tilepack.TilePack
+        """
+        pack = tilepack.TilePack(path, self.layers.get_layer(name), self.mapconfig.tilesize)
+        self.layers.add_pack(name, pack)
+
+        return pack
+
+
+    def recompose_layer(self, name: str, keys: set = None) -> None:
+        """
+            Composes the tiles in which the layer is shown again, the tiles in the grid in the background and the
+            others only when they are needed again.
+
+            :param name [str] -- The name of the layer which changed
+            :param keys [set] -- Only compose these tiles (zoom, X, Y) again (all if None)
+        """
+        layer = self.layers.get_layer(name)
+
+        shown = set()
+        for tile in self.narray.flat:
+            if isinstance(tile, Tile) and tile.loaded and layer.shown_at(tile.zoom):
+                key = (tile.zoom, tile.x, tile.y)
+                if keys is None or key in keys:
+                    shown.add(key)
+                    self.request_recompose(tile)
+
+        for key in ({key[:3] for key in self.tilestore.keys()} if keys is None else keys):
+            if layer.shown_at(key[0]) and key not in shown:
+                store_key = self.layers.composite_key(*key)
+                ## Composed tiles only, a tile showing a single layer is the image of that layer
+                if isinstance(store_key[3], tuple):
+                    self.tilestore.discard(store_key)
+
+
+    def recompose_tile_thread(self, tile: Tile) -> None:
+        """
+            Replaces the image of a tile by a newly composed one.
+
+            :param tile [Tile] -- The tile to compose again
+        """
+        self.publish(self.set_tile_image, tile, self.compose_tile_image(tile.x, tile.y, tile.zoom))
+
+
+    def set_tile_image(self, tile: Tile, image) -> None:
+        """ Shows a new image for a tile, on the thread drawing the map (see 'publish'). """
+        tile.image = image
+        tile.loaded = True
+        self.forget_drawn(tile)
+
+
+    def forget_drawn(self, tile: Tile) -> None:
+        """ Drops the scaled and rotated images made from the previous image of a tile. """
+        self.scaledcache.pop((tile.zoom, tile.x, tile.y, math.ceil(tile.size * self.scale)), None)
+        self.rotated = None
+
+
+    def create_tile(self, posx, posy, key: TileKey = None, load: bool = True):
         """
         :param posx -- The x position in the window
         :param posy -- The y position in the window
-        :param lx -- The X value for the tile (in the url)
-        :param ly -- The Y value for the tile (int the url)
+        :param key [TileKey] -- The zoom level, X and Y of the tile (in the url), the tile (mapconfig.x, mapconfig.y)
+                                of the current zoom level if None. The workers always pass it: the map may change zoom
+                                level while they are creating the tile
+        :param load -- Load the image right away, else only a cached image is used and the tile is returned without
+                       an image ('tile.loaded' is False) if it is not in the tile store
         """
-        
-        if lx == None:
-            lx = self.mapconfig.x
-        if ly == None:
-            ly = self.mapconfig.y
-
-        
-        zoom = self.mapconfig.zoom
+        if key is None:
+            key = TileKey(self.mapconfig.zoom, self.mapconfig.x, self.mapconfig.y)
+        zoom, lx, ly = key
 
-        x, y = self.mapconfig.x, self.mapconfig.y
-        self.mapconfig.x, self.mapconfig.y = lx, ly
-        url_call = self.mapconfig.build_url()
-        self.mapconfig.x, self.mapconfig.y = x, y
+        url_call = self.url_template.format(z = key.zoom, x = key.x, y = key.y)
 
-        image = self.fetch_tile(url_call)
-        tile_image = pygame.image.load(image)
-        tile_rect = pygame.Rect(posx, posy, tile_image.get_width(), tile_image.get_height())
+        if load:
+            tile_image = self.load_tile_image(key.x, key.y, key.zoom)
+        else:
+            tile_image = self.tilestore.get(self.layers.composite_key(*key))
+        tile_rect = pygame.Rect(posx, posy, self.mapconfig.tilesize, self.mapconfig.tilesize)
 
-        corner_coordinates = tile_corner_coordinates(lx, ly, self.mapconfig.zoom)
+        corner_coordinates = tile_corner_coordinates(lx, ly, zoom)
 
         new_tile = Tile(
             coordinates = Coordinate(
@@ -128,7 +424,8 @@ class TileMap():
             image = tile_image,
             rect = tile_rect,
             x = lx,
-            y = ly
+            y = ly,
+            loaded = tile_image is not None
         )
 
 
@@ -137,16 +434,227 @@ class TileMap():
 
     
     def fetch_tile(self, url):
-        tile_str = urlopen(url).read()
+        """
+            :raises core.fetch.TileFetchError -- If the tile could not be fetched
+        """
+        ## An url fetched by another map at the same time is not fetched twice
+        tile_str = self.service.once(url, self.fetcher.fetch, url)
         tile_image = io.BytesIO(tile_str)
 
         return tile_image
 
 
+    def store_view(self):
+        """
+            Tells the tile store what the map shows, so it keeps those tiles and evicts the ones far away first.
+
+            :returns int, float, float, set -- The zoom level, the center of the window (in tiles) and the shown tiles
+        """
+        center = self.world_px_of_map_px(*self.map_px_of_px(self.w / 2, self.h / 2))
+        if center is None:
+            return None
+
+        size = self.mapconfig.tilesize
+
+        return self.mapconfig.zoom, center[0] / size, center[1] / size, set(self.resident)
+
+
+    def update_residency(self) -> None:
+        """ Acquires the tiles which came into the grid in the tile store and releases those which left it. """
+        shown = {(tile.zoom, tile.x, tile.y) for tile in self.narray.flat if isinstance(tile, Tile)}
+
+        if shown != self.resident:
+            self.tilestore.acquire(shown - self.resident)
+            self.tilestore.release(self.resident - shown)
+            self.resident = shown
+
+
+    def close(self) -> None:
+        """ Unsubscribes the map from its tile store, its tiles can then be evicted. Closes the packs of its layers. """
+        self.tilestore.remove_view(self.store_view)
+        self.tilestore.release(self.resident)
+        self.resident = set()
+
+        for packs in self.layers.packs.values():
+            for pack in packs:
+                pack.close()
+        self.layers.packs = {}
+
+
+    def grid_anchor(self):
+        """
+            Returns any tile of the grid together with its position in the array.
+            As all tiles of the grid move together, every other slot can be derived from it.
+
+            :returns int, int, Tile -- The row, the column and the tile (None, None, None if the grid is empty)
+        """
+        for (row, col), tile in numpy.ndenumerate(self.narray):
+            if isinstance(tile, Tile):
+                return row, col, tile
+
+        return None, None, None
+
+
+    def on_resize(self, size) -> None:
+        """
+            This function is called on a pygame.VIDEORESIZE event.
+
+            :param size [tuple] -- The new size of the window Tuple(w, h)
+        """
+        self.resize(size[0], size[1])
+
+
+    def resize(self, w: int, h: int) -> None:
+        """
+            Grows or shrinks the grid in place to match a new window size.
+            Tiles which are still part of the grid are kept, tiles which fall out of it stay in the tile store
+            and only the newly exposed tiles are fetched (in the background so the window does not freeze, the
+            slots show their tile once its image is loaded).
+
+            :param w [int] -- The new width of the window
+            :param h [int] -- The new height of the window
+
+            :return None
+        """
+        self.window = pygame.display.get_surface()
+        self.w, self.h = w, h
+
+        if self.mapconfig.bearing % 360 != 0:
+            ## The rotated view grows on all sides, the grid is rebuilt from the images in the tile store
+            world = self.world_px_of_map_px(0, 0)
+            if world is not None:
+                self.rebuild_map(*world)
+            return
+
+        view = self.viewport_rect()
+        self.mx, self.my = math.ceil(view.width / self.mapconfig.tilesize), math.ceil(view.height / self.mapconfig.tilesize)
+
+        rows, cols = self.my + 2, self.mx + 2
+        old_rows, old_cols = self.narray.shape
+        keep_rows, keep_cols = min(rows, old_rows), min(cols, old_cols)
+
+        anchor_row, anchor_col, anchor = self.grid_anchor()
+
+        narray = numpy.zeros((rows, cols), dtype = Tile)
+        narray[:keep_rows, :keep_cols] = self.narray[:keep_rows, :keep_cols]
+        self.narray = narray
+        self.scaledcache_size = max(DEFAULT_SCALED_CACHE_SIZE, 2 * self.narray.size)
+
+        if anchor is None or anchor_row >= keep_rows or anchor_col >= keep_cols:
+            ## Nothing left to derive the new tiles from
+            return
+
+        size = self.mapconfig.tilesize
+
+        ## Every new slot gets its tile right away, the margin too: 'on_drag' extends the grid from the tiles there
+        for (row, col), tile in numpy.ndenumerate(self.narray):
+            if isinstance(tile, Tile):
+                continue
+
+            posx = anchor.position.x + (col - anchor_col) * size
+            posy = anchor.position.y + (row - anchor_row) * size
+            tile = self.create_tile(posx, posy, TileKey(anchor.zoom, anchor.x + (col - anchor_col), anchor.y + (row - anchor_row)), load = False)
+            self.narray[row, col] = tile
+
+            if not tile.loaded:
+                self.request_tile_image(tile)
+
+
+    def load_tile_thread(self, lx: int, ly: int, zoom: int) -> None:
+        """
+            Loads the tile (lx, ly) in the background and hands it to the thread drawing the map, which puts it into
+            the grid on its next frame (see 'publish_tiles').
+            The slot and the position of the tile are derived from the grid when the tile is published and not when it
+            was requested, as the user may have dragged the map around in the meantime.
+
+            :param lx [int] -- The X value of the tile
+            :param ly [int] -- The Y value of the tile
+            :param zoom [int] -- The zoom level the tile was requested for
+        """
+        self.publish(self.place_tile, self.create_tile(0, 0, TileKey(zoom, lx, ly)), zoom)
+
+
+    def publish(self, function, *args) -> None:
+        """
+            Has 'function(*args)' called by the thread drawing the map, at the start of its next frame.
+            The workers only load and compose images, everything the frames read (the grid, the images of its tiles,
+            the scaled and rotated images) is only changed by that thread, so a frame never sees it half changed.
+        """
+        self.finished.put((function, args))
+
+
+    def publish_tiles(self) -> None:
+        """
+            Applies the changes published by the workers (see 'publish'), only those published before the frame started
+            so a frame is not held up by workers publishing faster than it applies.
+        """
+        for _ in range(self.finished.qsize()):
+            function, args = self.finished.get_nowait()
+            function(*args)
+
+
+    def place_tile(self, tile: Tile, zoom: int) -> None:
+        """
+            Puts a tile loaded in the background into its empty slot of the grid (nothing happens if the grid has
+            moved on to another zoom level or the slot is not part of it anymore).
+
+            :param tile [Tile] -- The tile
+            :param zoom [int] -- The zoom level the tile was requested for
+        """
+        lx, ly = tile.x, tile.y
+        anchor_row, anchor_col, anchor = self.grid_anchor()
+
+        if anchor is None or anchor.zoom != zoom:
+            return
+
+        row, col = anchor_row + (ly - anchor.y), anchor_col + (lx - anchor.x)
+        rows, cols = self.narray.shape
+
+        if 0 <= row < rows and 0 <= col < cols and not isinstance(self.narray[row, col], Tile):
+            size = self.mapconfig.tilesize
+            tile.set_position(anchor.position.x + (lx - anchor.x) * size, anchor.position.y + (ly - anchor.y) * size)
+            self.narray[row, col] = tile
+
+
     def draw(self):
         window = self.window
-        # XXX Check for window resize
 
+        if window.get_size() != (self.w, self.h):
+            self.resize(window.get_width(), window.get_height())
+
+        self.update_residency()
+        self.publish_tiles()
+
+        if self.zooming:
+            if pygame.time.get_ticks() - self.zoom_ticks < DEFAULT_ZOOM_SETTLE_MS:
+                self.draw_zooming()
+                return
+
+            self.settle_zoom()
+
+        if self.failed and pygame.time.get_ticks() - self.failed_ticks > DEFAULT_FAILED_RETRY_MS:
+            self.retry_failed_tiles()
+
+        if self.backdrop is not None:
+            if any(isinstance(tile, Tile) and not tile.loaded for tile in self.narray.flat):
+                window.blit(self.backdrop[0], self.backdrop[1])
+            else:
+                self.backdrop = None
+
+        if self.mapconfig.bearing % 360 != 0:
+            self.draw_rotated()
+        else:
+            self.draw_tiles(window, 0, 0)
+
+
+    def draw_tiles(self, target, offset_x: int, offset_y: int) -> None:
+        """
+            Draws the loaded tiles of the grid (not rotated).
+
+            :param target [pygame.Surface] -- The surface to draw on
+            :param offset_x [int] -- Added to the x position of every tile (position of the window on the target)
+            :param offset_y [int] -- Added to the y position of every tile
+        """
         current_tilex = 0
         current_tiley = 0
 
@@ -154,14 +662,21 @@ class TileMap():
         for row in self.narray:
             for t in self.narray[0]:
                 new_tile = self.narray[current_tiley, current_tilex]
-                if isinstance(new_tile, Tile):
+                if isinstance(new_tile, Tile) and new_tile.loaded:
                     tile = new_tile
                     tile.rect = pygame.Rect(tile.position.x, tile.position.y, tile.size, tile.size)
                     self.narray[current_tiley, current_tilex] = tile
-                    window.blit(tile.image, (tile.position.x, tile.position.y))
+
+                    if self.scale == 1:
+                        image = tile.image
+                        debug_rect = tile.rect.move(offset_x, offset_y)
+                    else:
+                        image = self.scaled_tile_image(tile)
+                        debug_rect = pygame.Rect(round(tile.position.x * self.scale) + offset_x, round(tile.position.y * self.scale) + offset_y, image.get_width(), image.get_height())
+                    target.blit(image, debug_rect)
 
                     if self.debug_tileraster:
-                        pygame.draw.rect(window, pygame.Color("black"), tile.rect, 1)
+                        pygame.draw.rect(target, pygame.Color("black"), debug_rect, 1)
             
                 else:
                     #raise TypeError("Received integer to draw instead of Tile")
@@ -176,22 +691,412 @@ class TileMap():
 
 
 
+
+    def draw_rotated(self) -> None:
+        """
+            Draws the map rotated by mapconfig.bearing around the center of the window.
+            The tiles are composed into one surface (bigger than the window, see 'self.rotation_view') which is
+            rotated once. As long as the map is only panned by less than DEFAULT_ROTATION_MARGIN pixels, the
+            rotated surface is reused and only moved.
+        """
+        anchor_row, anchor_col, anchor = self.grid_anchor()
+        if anchor is None:
+            return
+
+        key = (self.mapconfig.bearing, self.scale, tuple((id(tile), tile.loaded) for tile in self.narray.flat if isinstance(tile, Tile)))
+
+        if self.rotated is not None and self.rotated[0] == key and self.rotated[2][0] is anchor:
+            pan_x = (anchor.position.x - self.rotated[2][1]) * self.scale
+            pan_y = (anchor.position.y - self.rotated[2][2]) * self.scale
+        else:
+            pan_x, pan_y = None, None
+
+        if pan_x is None or max(abs(pan_x), abs(pan_y)) > DEFAULT_ROTATION_MARGIN:
+            view = self.rotation_view()
+            surface = pygame.Surface(view.size, pygame.SRCALPHA)
+            self.draw_tiles(surface, -view.x, -view.y)
+
+            self.rotated = (key, pygame.transform.rotate(surface, self.mapconfig.bearing), (anchor, anchor.position.x, anchor.position.y))
+            pan_x, pan_y = 0, 0
+
+        pan_x, pan_y = self.rotate_vector(pan_x, pan_y)
+        rotated = self.rotated[1]
+        self.window.blit(rotated, rotated.get_rect(center = (self.w / 2 + pan_x, self.h / 2 + pan_y)))
+
+
+    def rotation_view(self):
+        """
+            Returns the part of the (not rotated) map which has to be composed to fill the window once rotated,
+            in window pixels. It is a square around the center of the window as big as the diagonal of the window plus
+            a margin on each side so the map can be panned a bit without composing it again.
+
+            :returns pygame.Rect
+        """
+        side = math.ceil(math.hypot(self.w, self.h)) + 2 * DEFAULT_ROTATION_MARGIN
+        return pygame.Rect(self.w // 2 - side // 2, self.h // 2 - side // 2, side, side)
+
+
+    def rotate_vector(self, x: float, y: float, inverse: bool = False):
+        """
+            Rotates a vector by mapconfig.bearing the same way pygame.transform.rotate rotates a surface
+            (counterclockwise on the screen, so the bearing ends up pointing up).
+
+            :param x [float] -- The x component of the vector (floats or numpy arrays)
+            :param y [float] -- The y component of the vector
+            :param inverse [bool] -- Rotate in the other direction (window -> map)
+
+            :returns float, float
+        """
+        angle = math.radians(-self.mapconfig.bearing if inverse else self.mapconfig.bearing)
+        cos, sin = math.cos(angle), math.sin(angle)
+
+        return x * cos + y * sin, -x * sin + y * cos
+
+
+    def set_bearing(self, bearing: int) -> None:
+        """
+            Rotates the map, the center of the window stays in place.
+
+            :param bearing [int] -- The direction (degrees clockwise from north) which is shown at the top of the window
+        """
+        view = self.viewport_rect()
+        self.mapconfig.bearing = bearing % 360
+
+        if self.viewport_rect() != view:
+            ## The grid has to cover a different part of the map (when going from and to a bearing of 0)
+            world = self.world_px_of_map_px(0, 0)
+            if world is not None:
+                self.rebuild_map(*world)
+
+
+    def map_px_of_px(self, px: float, py: float):
+        """
+            Returns the position on the (not scaled, not rotated) map, in the same pixels as the tile positions,
+            which is shown at the position px, py in the window.
+
+            :param px [float] -- The x position in the window
+            :param py [float] -- The y position in the window
+
+            :returns float, float
+        """
+        cx, cy = self.w / 2, self.h / 2
+        px, py = self.rotate_vector(px - cx, py - cy, inverse = True)
+        offset_x, offset_y = self.scale_offset
+
+        return (px + cx - offset_x) / self.scale, (py + cy - offset_y) / self.scale
+
+
+    def px_of_map_px(self, mx, my):
+        """
+            Inverse of 'self.map_px_of_px', returns the position in the window of a position on the map.
+            Works with floats or numpy arrays.
+
+            :param mx -- The x position on the map
+            :param my -- The y position on the map
+
+            :returns float, float
+        """
+        cx, cy = self.w / 2, self.h / 2
+        offset_x, offset_y = self.scale_offset
+        px, py = self.rotate_vector(mx * self.scale + offset_x - cx, my * self.scale + offset_y - cy)
+
+        return px + cx, py + cy
+
+
+    def world_px_of_map_px(self, mx: float, my: float):
+        """
+            Returns the position of a map position on the world map raster of the current zoom level (in pixels).
+
+            :param mx [float] -- The x position on the map
+            :param my [float] -- The y position on the map
+
+            :returns float, float -- None if there is no tile in the grid yet
+        """
+        anchor_row, anchor_col, anchor = self.grid_anchor()
+        if anchor is None:
+            return None
+
+        size = self.mapconfig.tilesize
+        return anchor.x * size + mx - anchor.position.x, anchor.y * size + my - anchor.position.y
+
+
+    def px_of_longitude_latitude(self, longitude, latitude):
+        """
+            Returns the position in the window of a coordinate (takes the zoom, the scale and the bearing into account).
+            Works with floats or numpy arrays of longitudes and latitudes.
+
+            :param longitude -- The longitude
+            :param latitude -- The latitude
+
+            :returns float, float -- None if there is no tile in the grid yet
+        """
+        origin = self.world_px_of_map_px(0, 0)
+        if origin is None:
+            return None
+
+        world_x, world_y = px_from_latlng(longitude, latitude, self.mapconfig.zoom, self.mapconfig.tilesize)
+        return self.px_of_map_px(world_x - origin[0], world_y - origin[1])
+
+
+    def world_of_px(self, px: float, py: float):
+        """
+            Returns the position on the world map, normalised to 0..1 (see core.spatial), shown at px, py in the window.
+
+            :returns float, float -- None if there is no tile in the grid yet
+        """
+        world = self.world_px_of_map_px(*self.map_px_of_px(px, py))
+        if world is None:
+            return None
+
+        size = 2 ** self.mapconfig.zoom * self.mapconfig.tilesize
+        return world[0] / size, world[1] / size
+
+
+    def feature_at_px(self, index, px: int, py: int, tolerance: int = DEFAULT_HIT_TOLERANCE):
+        """
+            Returns the feature under the cursor.
+
+            :param index [core.spatial.SpatialIndex] -- The index of the features
+            :param px [int] -- The x position in the window
+            :param py [int] -- The y position in the window
+            :param tolerance [int] -- How far away (in pixels) the feature can be
+
+            :returns The closest feature, None if there is none within the tolerance
+        """
+        world = self.world_of_px(px, py)
+        if world is None:
+            return None
+
+        radius = tolerance / (2 ** self.mapconfig.zoom * self.mapconfig.tilesize * self.scale)
+        feature, distance = index.nearest(world[0], world[1], radius)
+
+        return feature
+
+
+    def visible_features(self, index) -> list:
+        """
+            Returns the features of the index which are (at least partly) in the window, to only draw those.
+
+            :param index [core.spatial.SpatialIndex] -- The index of the features
+
+            :returns list
+        """
+        corners = [self.world_of_px(px, py) for px, py in ((0, 0), (self.w, 0), (0, self.h), (self.w, self.h))]
+        if corners[0] is None:
+            return []
+
+        xs = [corner[0] for corner in corners]
+        ys = [corner[1] for corner in corners]
+
+        return index.query_bbox(min(xs), min(ys), max(xs), max(ys))
+
+
+    def scaled_tile_image(self, tile: Tile):
+        """
+            Returns the image of the tile smoothscaled to the current fractional zoom level.
+            The scaled images are cached, so they are only computed once per tile and level.
+
+            :param tile [Tile] -- The tile to scale
+
+            :returns pygame.Surface
+        """
+        size = math.ceil(tile.size * self.scale)
+        key = (tile.zoom, tile.x, tile.y, size)
+
+        image = self.scaledcache.get(key)
+        if image is None:
+            image = pygame.transform.smoothscale(tile.image, (size, size))
+            self.scaledcache[key] = image
+
+            while len(self.scaledcache) > self.scaledcache_size:
+                self.scaledcache.popitem(last = False)
+        else:
+            self.scaledcache.move_to_end(key)
+
+        return image
+
+
+    def draw_zooming(self) -> None:
+        """
+            Draws a frame of a zoom animation.
+            The visible part of the grid is composed once and the result is scaled, instead of scaling every tile.
+        """
+        scale = self.scale
+        offset_x, offset_y = self.scale_offset
+
+        grid_rect = None
+        for tile in self.narray.flat:
+            if isinstance(tile, Tile):
+                tile_rect = pygame.Rect(tile.position.x, tile.position.y, tile.size, tile.size)
+                grid_rect = tile_rect if grid_rect is None else grid_rect.union(tile_rect)
+
+        if grid_rect is None:
+            return
+
+        if self.mapconfig.bearing % 360 != 0:
+            window_view = self.rotation_view()
+            target = pygame.Surface(window_view.size, pygame.SRCALPHA)
+        else:
+            window_view = pygame.Rect(0, 0, self.w, self.h)
+            target = self.window
+
+        ## The part of the map (in unscaled map pixels) which is visible in the window
+        view = pygame.Rect(math.floor((window_view.x - offset_x) / scale), math.floor((window_view.y - offset_y) / scale), math.ceil(window_view.width / scale) + 1, math.ceil(window_view.height / scale) + 1)
+        view = view.clip(grid_rect)
+        if view.width == 0 or view.height == 0:
+            return
+
+        frame = pygame.Surface(view.size)
+        for tile in self.narray.flat:
+            if isinstance(tile, Tile) and tile.loaded:
+                frame.blit(tile.image, (tile.position.x - view.x, tile.position.y - view.y))
+
+        scaled = pygame.transform.scale(frame, (max(1, round(view.width * scale)), max(1, round(view.height * scale))))
+        position = (round(view.x * scale + offset_x), round(view.y * scale + offset_y))
+
+        if target is not self.window:
+            target.blit(scaled, (position[0] - window_view.x, position[1] - window_view.y))
+            scaled = pygame.transform.rotate(target, self.mapconfig.bearing)
+            position = scaled.get_rect(center = (self.w / 2, self.h / 2)).topleft
+
+        self.window.blit(scaled, position)
+        self.backdrop = (scaled, position)
+
+
+    def zoom_by(self, factor: float, anchor) -> None:
+        """
+            Zooms the map continuously (mouse wheel, pinch), the point below the anchor stays where it is.
+            The zoom is animated by scaling the current tiles, once no more zoom input has been received for
+            'DEFAULT_ZOOM_SETTLE_MS' milliseconds, the tiles of the nearest zoom level are loaded.
+
+            :param factor [float] -- The factor by which to zoom (> 1 = zoom in, < 1 = zoom out)
+            :param anchor [tuple] -- The position in the window which stays in place Tuple(x, y)
+        """
+        scale = self.scale * factor
+        level = self.mapconfig.zoom + math.log2(scale)
+        if level < 0 or level > MAX_ZOOM:
+            return
+
+        ## The anchor on the not rotated map
+        cx, cy = self.w / 2, self.h / 2
+        anchor_x, anchor_y = self.rotate_vector(anchor[0] - cx, anchor[1] - cy, inverse = True)
+        anchor_x, anchor_y = anchor_x + cx, anchor_y + cy
+
+        offset_x, offset_y = self.scale_offset
+        self.scale_offset = (anchor_x - (anchor_x - offset_x) * factor, anchor_y - (anchor_y - offset_y) * factor)
+        self.scale = scale
+        self.zooming = True
+        self.zoom_ticks = pygame.time.get_ticks()
+
+
+    def settle_zoom(self) -> None:
+        """
+            Ends a zoom animation: the grid is rebuilt with the tiles of the zoom level nearest to the current scale.
+            The remaining fractional part is kept in 'self.scale' so the map does not jump.
+        """
+        self.zooming = False
+        anchor_row, anchor_col, anchor = self.grid_anchor()
+
+        if anchor is None:
+            self.scale, self.scale_offset = 1.0, (0.0, 0.0)
+            return
+
+        size = self.mapconfig.tilesize
+        scale = self.scale
+        offset_x, offset_y = self.scale_offset
+
+        level = self.mapconfig.zoom + math.log2(scale)
+        zoom = min(max(round(level), 0), MAX_ZOOM)
+        factor = 2 ** (zoom - self.mapconfig.zoom)
+
+        ## Position of the top left corner of the window in pixels of the whole world map at the new zoom level
+        world_x = (anchor.x * size - offset_x / scale - anchor.position.x) * factor
+        world_y = (anchor.y * size - offset_y / scale - anchor.position.y) * factor
+
+        self.scale = scale / factor
+        self.scale_offset = (0.0, 0.0)
+        self.scaledcache.clear()
+        self.mapconfig.zoom = zoom
+        self.mapconfig.coordinates = tile_top_left_lon_lat_from_xy(world_x / size, world_y / size, zoom)
+
+        self.rebuild_map(world_x, world_y)
+
+
+    def set_view(self, world_x: float, world_y: float, scale: float = 1.0) -> None:
+        """
+            Moves the map so the top left corner of the window shows a position on the world map, at a scale of the
+            current zoom level (the inverse of 'world_of_px(0, 0)', e.g. to replay a trace where it was recorded).
+
+            :param world_x [float] -- The x position on the world map, normalised to 0..1
+            :param world_y [float] -- The y position on the world map, normalised to 0..1
+            :param scale [float] -- The scale of the tiles
+        """
+        size = self.mapconfig.tilesize
+        self.zooming = False
+        self.scale, self.scale_offset = scale, (0.0, 0.0)
+        self.scaledcache.clear()
+
+        ## The map pixel shown in the corner depends on the scale and the bearing
+        corner_x, corner_y = self.map_px_of_px(0, 0)
+        world_x = world_x * 2 ** self.mapconfig.zoom * size - corner_x
+        world_y = world_y * 2 ** self.mapconfig.zoom * size - corner_y
+
+        self.mapconfig.coordinates = tile_top_left_lon_lat_from_xy(world_x / size, world_y / size, self.mapconfig.zoom)
+        self.rebuild_map(world_x, world_y)
+
+
+    def rebuild_map(self, world_x: float, world_y: float) -> None:
+        """
+            Replaces the grid by a new one covering the visible part of the map, the images which are already in the
+            tile store are reused.
+
+            :param world_x [float] -- The x position on the world map raster (current zoom) of the top left corner of the window
+            :param world_y [float] -- The y position on the world map raster (current zoom) of the top left corner of the window
+        """
+        size = self.mapconfig.tilesize
+        view = self.viewport_rect()
+
+        self.mapconfig.x, self.mapconfig.y = math.floor((world_x + view.x) / size), math.floor((world_y + view.y) / size)
+        self.mx, self.my = math.ceil(view.width / size), math.ceil(view.height / size)
+        self.narray = numpy.zeros((self.my+2, self.mx+2), dtype = Tile)
+        self.rotated = None
+        ## The scaled images of the whole grid have to fit, or an idle frame would scale every tile again
+        self.scaledcache_size = max(DEFAULT_SCALED_CACHE_SIZE, 2 * self.narray.size)
+
+        self.build_map(round(self.mapconfig.x * size - world_x), round(self.mapconfig.y * size - world_y))
+
+
+    def viewport_rect(self):
+        """
+            Returns the part of the map which has to be covered by tiles, in (unscaled) map pixels.
+            That is the window, or the square returned by 'self.rotation_view' if the map is rotated.
+
+            :returns pygame.Rect
+        """
+        if self.mapconfig.bearing % 360 != 0:
+            view = self.rotation_view()
+        else:
+            view = pygame.Rect(0, 0, self.w, self.h)
+
+        return pygame.Rect(
+            math.floor(view.x / self.scale),
+            math.floor(view.y / self.scale),
+            math.ceil(view.width / self.scale),
+            math.ceil(view.height / self.scale)
+        )
+
     
     def longitude_latitude_of_px(self, px: int, py: int):
-        x, y = 0, 0
+        px, py = self.map_px_of_px(px, py)
+        px, py = math.floor(px), math.floor(py)
         X, Y = None, None
-        for row in self.narray:
-            for obj in self.narray:
-                tile = self.narray[y, x]
-                if isinstance(tile, Tile):
-                    if tile.rect.collidepoint(px, py):
-                        X = tile.x
-                        Y = tile.y
-                        px, py = px - tile.position.x, py - tile.position.y
-                        break
-                x += 1
-            x = 0
-            y += 1
+        for tile in self.narray.flat:
+            if isinstance(tile, Tile):
+                if pygame.Rect(tile.position.x, tile.position.y, tile.size, tile.size).collidepoint(px, py):
+                    X = tile.x
+                    Y = tile.y
+                    px, py = px - tile.position.x, py - tile.position.y
+                    break
 
         if X == None or Y == None:
             raise ValueError("No value found for X and Y! Did the user click on a tile?")
@@ -214,9 +1119,24 @@ class TileMap():
 
             :return None -- updates the position of the tiles and loads new ones if necessary
         """
-        relx, rely = event_rel[0], event_rel[1]
-        window = pygame.display.get_surface()
-        window_w, window_h = window.get_width(), window.get_height()
+        ## The movement on the not rotated map
+        map_relx, map_rely = self.rotate_vector(event_rel[0], event_rel[1], inverse = True)
+
+        if self.zooming:
+            offset_x, offset_y = self.scale_offset
+            self.scale_offset = (offset_x + map_relx, offset_y + map_rely)
+            return
+
+        if self.backdrop is not None:
+            self.backdrop = (self.backdrop[0], (self.backdrop[1][0] + event_rel[0], self.backdrop[1][1] + event_rel[1]))
+
+        ## The tiles are moved in map pixels, keep what is lost by rounding for the next call
+        relx = map_relx / self.scale + self.drag_remainder[0]
+        rely = map_rely / self.scale + self.drag_remainder[1]
+        self.drag_remainder = (relx - round(relx), rely - round(rely))
+        relx, rely = round(relx), round(rely)
+
+        view = self.viewport_rect()
 
         #new_tiles = {} usage not possible -> see relx < 0 -> if not isinstance(..., Tile)
 
@@ -235,13 +1155,13 @@ class TileMap():
                 reftile = self.narray[nay, nax]
                 if isinstance(reftile, Tile):
                     ## If the tile does not cover the entire window
-                    if reftile.position.x + self.mapconfig.tilesize < window_w:
+                    if reftile.position.x + self.mapconfig.tilesize < view.right:
                         i = -1 ## This differs from the elif statement under this one as here we want to add a tile to the top right corner too, which is already done in the
                         ## next statement so there we draw based on that top tile (we are always drawing based on the most upper tile in the array)
                         topx, topy = len(self.narray[0])-1, 0
 
                         for row in self.narray:
-                            self.narray[topy, topx] = self.create_tile(reftile.position.x + self.mapconfig.tilesize, reftile.position.y + (i * self.mapconfig.tilesize), reftile.x + 1, reftile.y + i)
+                            self.narray[topy, topx] = self.create_tile(reftile.position.x + self.mapconfig.tilesize, reftile.position.y + (i * self.mapconfig.tilesize), TileKey(reftile.zoom, reftile.x + 1, reftile.y + i))
                             ## We cannot use the futures.ThreadPoolExecutor as this would allow moving around the map while images are being loaded
                             ## problem with this is that we would load an image and during the loading time, the user continues moving around so that the position
                             ## at which the tile is then displayed does no longer match the position it should be because the user continued moving so we would have
@@ -257,13 +1177,13 @@ class TileMap():
                 nax, nay = len(self.narray[0]) - 1, 0
                 reftile = self.narray[nay, nax]
                 
-                if reftile.position.x + self.mapconfig.tilesize < window_w:
+                if reftile.position.x + self.mapconfig.tilesize < view.right:
                     self.narray = shift(self.narray, -1, fill=0)
                     i = 0
                     topx, topy = len(self.narray[0])-1, 0
 
                     for row in self.narray:
-                        self.narray[topy, topx] = self.create_tile(reftile.position.x + self.mapconfig.tilesize, reftile.position.y + (i * self.mapconfig.tilesize), reftile.x + 1, reftile.y + i)
+                        self.narray[topy, topx] = self.create_tile(reftile.position.x + self.mapconfig.tilesize, reftile.position.y + (i * self.mapconfig.tilesize), TileKey(reftile.zoom, reftile.x + 1, reftile.y + i))
                         ## See above to know why the next line is commented out
                         #new_tiles[(topy, topx)] = [reftile.position.x + self.mapconfig.tilesize + relx, reftile.position.y + (i * self.mapconfig.tilesize), reftile.x + 1, reftile.y + i]
                         i += 1
@@ -276,23 +1196,23 @@ class TileMap():
                 nax, nay = 1, 1
                 reftile = self.narray[nay, nax]
 
-                if reftile.position.x > 0:
+                if reftile.position.x > view.left:
                     i = -1
                     topx, topy = 0, 0
 
                     for row in self.narray:
-                        self.narray[topy, topx] = self.create_tile(reftile.position.x - self.mapconfig.tilesize, reftile.position.y + (i * self.mapconfig.tilesize), reftile.x - 1, reftile.y + i)
+                        self.narray[topy, topx] = self.create_tile(reftile.position.x - self.mapconfig.tilesize, reftile.position.y + (i * self.mapconfig.tilesize), TileKey(reftile.zoom, reftile.x - 1, reftile.y + i))
                         i += 1
                         topy += 1
 
             if isinstance(reftile, Tile):
-                if reftile.position.x > 0:
+                if reftile.position.x > view.left:
                     self.narray = shift(self.narray, 1, fill = 0)
                     i = 0
                     topx, topy = 0, 0
 
                     for row in self.narray:
-                        self.narray[topy, topx] = self.create_tile(reftile.position.x - self.mapconfig.tilesize, reftile.position.y + (i * self.mapconfig.tilesize), reftile.x - 1, reftile.y + i)
+                        self.narray[topy, topx] = self.create_tile(reftile.position.x - self.mapconfig.tilesize, reftile.position.y + (i * self.mapconfig.tilesize), TileKey(reftile.zoom, reftile.x - 1, reftile.y + i))
                         i += 1
                         topy += 1
                     
@@ -307,17 +1227,17 @@ class TileMap():
                 reftile = self.narray[nay, nax]
                 
                 if isinstance(reftile, Tile):
-                    if reftile.position.y + self.mapconfig.tilesize < window_h:
+                    if reftile.position.y + self.mapconfig.tilesize < view.bottom:
                         i = -1
                         topx, topy = 0, len(self.narray)-1
 
                         for tile in self.narray[topy]:
-                            self.narray[topy, topx] = self.create_tile(reftile.position.x + (i * self.mapconfig.tilesize), reftile.position.y + self.mapconfig.tilesize, reftile.x + i, reftile.y + 1)
+                            self.narray[topy, topx] = self.create_tile(reftile.position.x + (i * self.mapconfig.tilesize), reftile.position.y + self.mapconfig.tilesize, TileKey(reftile.zoom, reftile.x + i, reftile.y + 1))
                             i += 1
                             topx += 1
 
             if isinstance(reftile, Tile):
-                if reftile.position.y + self.mapconfig.tilesize < window_h:
+                if reftile.position.y + self.mapconfig.tilesize < view.bottom:
                     #rot_array = numpy.rot90(self.narray, k=1, axes=(1, 0)) # rotate clockwise one time
                     #shift_array = shift(rot_array, 1, fill = 0)
                     #self.narray = numpy.rot90(shift_array, k=-1, axes=(1, 0))
@@ -326,7 +1246,7 @@ class TileMap():
                     topx, topy = 0, len(self.narray)-1
 
                     for tile in self.narray[topy]:
-                        self.narray[topy, topx] = self.create_tile(reftile.position.x + (i * self.mapconfig.tilesize), reftile.position.y + self.mapconfig.tilesize, reftile.x + i, reftile.y + 1)
+                        self.narray[topy, topx] = self.create_tile(reftile.position.x + (i * self.mapconfig.tilesize), reftile.position.y + self.mapconfig.tilesize, TileKey(reftile.zoom, reftile.x + i, reftile.y + 1))
                         i += 1
                         topx += 1
 
@@ -336,25 +1256,20 @@ class TileMap():
             if not isinstance(reftile, Tile):
                 reftile = self.narray[1, 1]
 
-                if reftile.position.y > 0:
+                if reftile.position.y > view.top:
                     topx, topy = 0, 0
                     for i, tile in enumerate(self.narray[topy], -1):
-                        self.narray[topy, topx] = self.create_tile(reftile.position.x + (i*self.mapconfig.tilesize), reftile.position.y-self.mapconfig.tilesize, reftile.x + i, reftile.y - 1)
+                        self.narray[topy, topx] = self.create_tile(reftile.position.x + (i*self.mapconfig.tilesize), reftile.position.y-self.mapconfig.tilesize, TileKey(reftile.zoom, reftile.x + i, reftile.y - 1))
                         topx += 1
             
             if isinstance(reftile, Tile):
-                if reftile.position.y > 0:
+                if reftile.position.y > view.top:
                     self.narray = numpy.roll(self.narray, 1, 0)
                     topx, topy = 0, 0
                     for i, tile in enumerate(self.narray[topy], 0):
-                        self.narray[topy, topx] = self.create_tile(reftile.position.x + (i * self.mapconfig.tilesize), reftile.position.y-self.mapconfig.tilesize, reftile.x + i, reftile.y - 1)
+                        self.narray[topy, topx] = self.create_tile(reftile.position.x + (i * self.mapconfig.tilesize), reftile.position.y-self.mapconfig.tilesize, TileKey(reftile.zoom, reftile.x + i, reftile.y - 1))
                         topx += 1
 
 
-        ## this is not possible, see the first if statement for why not
-        #for tile in new_tiles:
-            #executor = futures.ThreadPoolExecutor(20)
-            #fut = [executor.submit(self.create_tile_thread, tile[0], tile[1], new_tiles[tile][0], new_tiles[tile][1], new_tiles[tile][2], new_tiles[tile][3]) for tile in new_tiles]
-
         
         
@@ -0,0 +1,257 @@
+## Replays a trace recorded with core.trace.TraceRecorder without a window, against the local tile server
+## (tools/tileserver.py), and reports the frame times and which stage of the map made the long frames slow:
+##
+##     python tools/replay.py pan.trace --delay 0.3 --error-rate 0.1 --json report.json
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy
+import pygame
+
+from core import trace
+from core.constants import DEFAULT_TILESIZE, DEFAULT_ZOOM_STEP
+from core.models import MapConfig, Coordinate
+from core.tileservice import TileService
+from tilemap import TileMap
+
+
+## Methods of the map which are timed, the time of a stage does not include the stages it calls
+STAGES = [
+    "on_drag", "on_resize", "zoom_by", "set_bearing",
+    "draw", "draw_tiles", "draw_rotated", "draw_zooming", "settle_zoom", "retry_failed_tiles", "update_residency", "publish_tiles",
+    "load_tile_image", "fetch_tile"
+]
+
+
+class StageProfiler():
+    def __init__(self) -> None:
+        """ Times the stages of a frame, only the calls made by the thread running the frames are counted. """
+        self.thread = threading.get_ident()
+        self.stack: list = []
+        self.times: dict = {}
+
+
+    def wrap(self, obj, name: str) -> None:
+        """ Replaces a method of an object by one which times it. """
+        function = getattr(obj, name)
+
+        def timed(*args, **kwargs):
+            if threading.get_ident() != self.thread:
+                return function(*args, **kwargs)
+
+            self.stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = self.stack.pop()
+                self.times[name] = self.times.get(name, 0) + elapsed - children
+                if self.stack:
+                    self.stack[-1] += elapsed
+
+        setattr(obj, name, timed)
+
+
+    def take(self) -> dict:
+        """ Returns the times of the stages since the last call. """
+        times, self.times = self.times, {}
+        return times
+
+
+
+class Replay():
+    def __init__(self, header: trace.TraceHeader, url: str) -> None:
+        pygame.init()
+        self.window = pygame.display.set_mode(header.size, pygame.RESIZABLE)
+
+        self.map = TileMap(
+            mapconfig = MapConfig(
+                token = "",
+                url = url,
+                coordinates = Coordinate(longitude = header.longitude, latitude = header.latitude),
+                zoom = header.zoom,
+                bearing = header.bearing,
+                ## The tile size of the recorded map, traces of the first version do not have it
+                tilesize = header.tilesize or DEFAULT_TILESIZE
+            ),
+            service = TileService()
+        )
+        ## What the window showed when the recording started, the map may have been moved since it was created
+        if header.world is not None:
+            self.map.set_view(*header.world, header.scale)
+
+        self.profiler = StageProfiler()
+        for name in STAGES:
+            self.profiler.wrap(self.map, name)
+
+        self.pressing = False
+
+
+    def handle(self, event: trace.TraceEvent) -> bool:
+        """ Handles an event like testfile.py does, returns False on QUIT. """
+        m = self.map
+
+        if event.kind == trace.QUIT:
+            return False
+        elif event.kind == trace.MOUSEBUTTONDOWN:
+            self.pressing = True
+        elif event.kind == trace.MOUSEBUTTONUP:
+            self.pressing = False
+        elif event.kind == trace.VIDEORESIZE:
+            self.window = pygame.display.set_mode((event.a, event.b), pygame.RESIZABLE)
+            m.on_resize((event.a, event.b))
+        elif event.kind == trace.MOUSEWHEEL:
+            m.zoom_by(DEFAULT_ZOOM_STEP ** event.b, (event.x, event.y))
+        elif event.kind == trace.KEYDOWN:
+            if event.value == pygame.K_q:
+                m.set_bearing(m.mapconfig.bearing - 15)
+            elif event.value == pygame.K_e:
+                m.set_bearing(m.mapconfig.bearing + 15)
+        elif event.kind == trace.MOUSEMOTION:
+            if self.pressing:
+                m.on_drag((event.a, event.b))
+
+        return True
+
+
+    def run(self, frames: list, realtime: bool = True) -> list:
+        """
+            Replays the frames, waiting for the recorded time of each one if 'realtime' (so the tiles loading in the
+            background arrive like they did).
+
+            :returns list -- (frame time in seconds, {stage: seconds}) for every frame
+        """
+        results = []
+        start = time.perf_counter()
+
+        for frame in frames:
+            if realtime:
+                wait = frame[-1].time - (time.perf_counter() - start)
+                if wait > 0:
+                    time.sleep(wait)
+
+            frame_start = time.perf_counter()
+            running = True
+            for event in frame:
+                running = self.handle(event) and running
+
+            self.window.fill(pygame.Color("black"))
+            self.map.draw()
+            flip_start = time.perf_counter()
+            pygame.display.update()
+            end = time.perf_counter()
+
+            stages = self.profiler.take()
+            stages["flip"] = end - flip_start
+            stages["events"] = max(0.0, (end - frame_start) - sum(stages.values()))
+            results.append((end - frame_start, stages))
+
+            if not running:
+                break
+
+        return results
+
+
+
+def report(results: list, budget: float, top: int) -> dict:
+    """ Summarises the frame times (milliseconds). """
+    times = numpy.array([frame_time for frame_time, stages in results]) * 1000
+    totals: dict = {}
+    for frame_time, stages in results:
+        for name, seconds in stages.items():
+            totals[name] = totals.get(name, 0) + seconds * 1000
+
+    long_frames = []
+    for index in numpy.argsort(-times)[:top].tolist():
+        if times[index] <= budget:
+            break
+        stages = results[index][1]
+        stage = max(stages, key = stages.get)
+        long_frames.append({
+            "frame": index,
+            "ms": round(float(times[index]), 2),
+            "stage": stage,
+            "stage_ms": round(stages[stage] * 1000, 2),
+            "stages": {name: round(seconds * 1000, 2) for name, seconds in sorted(stages.items(), key = lambda item: -item[1]) if seconds > 0.0005}
+        })
+
+    return {
+        "frames": len(times),
+        "percentiles": {f"p{p}": round(float(numpy.percentile(times, p)), 2) for p in (50, 90, 95, 99)} if len(times) else {},
+        "max": round(float(times.max()), 2) if len(times) else 0,
+        "budget": budget,
+        "over_budget": int((times > budget).sum()),
+        "stages": {name: round(ms, 1) for name, ms in sorted(totals.items(), key = lambda item: -item[1])},
+        "long_frames": long_frames
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Replays a trace headlessly and reports the frame times")
+    parser.add_argument("trace", help = "The trace file (core.trace.TraceRecorder)")
+    parser.add_argument("--url", help = "The tile server (a local tools/tileserver.py is started if not given)")
+    parser.add_argument("--delay", type = float, default = 0, help = "Maximum delay of the local tile server (seconds)")
+    parser.add_argument("--error-rate", type = float, default = 0, help = "Share of the requests failing on the local tile server")
+    parser.add_argument("--fast", action = "store_true", help = "Do not wait for the recorded time of the frames")
+    parser.add_argument("--budget", type = float, default = 1000 / 60, help = "Frames longer than this are long frames (ms)")
+    parser.add_argument("--top", type = int, default = 10, help = "The number of long frames listed")
+    parser.add_argument("--json", help = "Also write the report to this file")
+    options = parser.parse_args()
+
+    header, frames = trace.read_trace(options.trace)
+
+    server = None
+    url = options.url
+    if url is None:
+        port = free_port()
+        server = subprocess.Popen([
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tileserver.py"),
+            "--port", str(port), "--delay", str(options.delay), "--error-rate", str(options.error_rate), "--quiet"
+        ])
+        url = f"http://localhost:{port}"
+        ## Wait until it accepts connections
+        for _ in range(100):
+            try:
+                socket.create_connection(("localhost", port), timeout = 0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+    try:
+        results = Replay(header, url).run(frames, realtime = not options.fast)
+    finally:
+        if server is not None:
+            server.terminate()
+
+    summary = report(results, options.budget, options.top)
+
+    print(f"{summary['frames']} frames, " + ", ".join(f"{name} {ms} ms" for name, ms in summary["percentiles"].items()) +
+          f", max {summary['max']} ms, {summary['over_budget']} over {options.budget:.1f} ms")
+    print("Time per stage (ms): " + ", ".join(f"{name} {ms}" for name, ms in summary["stages"].items()))
+    for frame in summary["long_frames"]:
+        print(f"  frame {frame['frame']}: {frame['ms']} ms, mostly {frame['stage']} ({frame['stage_ms']} ms)")
+
+    if options.json:
+        with open(options.json, "w") as file:
+            json.dump(summary, file, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+## A local stand-in for the tile server which can inject faults, to see how the map behaves when the server is slow,
+## fails or does not have the tiles:
+##
+##     python tools/tileserver.py --port 8080 --error-rate 0.3 --delay 2 --missing "*/*/5/*"
+##
+## --flaky N answers the first N requests of every path with 503 (a retry succeeds after N attempts) and
+## --truncate-rate cuts answers short (the client gets http.client.IncompleteRead).
+##
+## and use "http://localhost:8080" as the url of the map (MapConfig.url or Layer.url).
+
+import argparse
+import fnmatch
+import io
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pygame
+
+
+def tile_png(size: int, zoom: int, x: int, y: int) -> bytes:
+    """ Draws a tile showing its zoom, X and Y. """
+    pygame.font.init()
+    surface = pygame.Surface((size, size))
+    surface.fill(pygame.Color(230, 230, 220) if (x + y) % 2 else pygame.Color(210, 220, 230))
+    pygame.draw.rect(surface, pygame.Color(150, 150, 150), surface.get_rect(), 1)
+
+    text = pygame.font.Font(None, max(12, size // 12)).render(f"{zoom}/{x}/{y}", True, pygame.Color("black"))
+    surface.blit(text, text.get_rect(center = (size // 2, size // 2)))
+
+    data = io.BytesIO()
+    pygame.image.save(surface, data, "tile.png")
+    return data.getvalue()
+
+
+class TileHandler(BaseHTTPRequestHandler):
+    ## Set by 'main'
+    options = None
+    ## Keep-alive, like the real tile servers
+    protocol_version = "HTTP/1.1"
+    ## path -> number of requests, for --flaky
+    requests: dict = {}
+    lock = threading.Lock()
+
+    def do_GET(self) -> None:
+        options = self.options
+        path = self.path.split("?")[0].strip("/")
+
+        if options.delay:
+            time.sleep(random.uniform(0, options.delay))
+
+        with self.lock:
+            count = self.requests[path] = self.requests.get(path, 0) + 1
+
+        if count <= options.flaky or random.random() < options.error_rate:
+            self.send_error(503)
+            return
+
+        if options.missing and any(fnmatch.fnmatch(path, pattern) for pattern in options.missing):
+            self.send_error(404)
+            return
+
+        ## Same paths as Layer.build_url: /<tilesize>/<z>/<x>/<y> (or /<z>/<x>/<y> with the size of the server)
+        try:
+            values = [int(value.split(".")[0]) for value in path.split("/")[-4:]]
+        except ValueError:
+            self.send_error(400)
+            return
+
+        if len(values) == 4:
+            size, zoom, x, y = values
+        elif len(values) == 3:
+            size, (zoom, x, y) = options.tilesize, values
+        else:
+            self.send_error(400)
+            return
+
+        data = tile_png(size, zoom, x, y)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+
+        if random.random() < options.truncate_rate:
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = True
+            return
+
+        self.wfile.write(data)
+
+
+    def log_message(self, format, *args) -> None:
+        if not self.options.quiet:
+            super().log_message(format, *args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Local tile server which can inject faults")
+    parser.add_argument("--port", type = int, default = 8080)
+    parser.add_argument("--tilesize", type = int, default = 512, help = "Size of the tiles if the url has none")
+    parser.add_argument("--error-rate", type = float, default = 0, help = "Share of the requests answered with 503 (0..1)")
+    parser.add_argument("--delay", type = float, default = 0, help = "Maximum random delay of the answers (seconds)")
+    parser.add_argument("--flaky", type = int, default = 0, help = "Number of requests of every path answered with 503 before it works")
+    parser.add_argument("--truncate-rate", type = float, default = 0, help = "Share of the answers cut short (0..1)")
+    parser.add_argument("--missing", action = "append", help = "Paths answered with 404 (glob, e.g. \"*/*/5/*\")")
+    parser.add_argument("--quiet", action = "store_true")
+    options = parser.parse_args()
+
+    TileHandler.options = options
+    server = ThreadingHTTPServer(("", options.port), TileHandler)
+    print(f"Serving tiles on http://localhost:{options.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()